@@ -69,6 +69,16 @@ scored_mosaic = ee.Algorithms.Landsat.simpleCloudScore(mosaic)
 Map.addLayer(scored_mosaic, {'bands': ['B4', 'B3', 'B2'], 'max': 0.4},
     'TOA mosaic', False)
 
+# # The same score can be computed offline for TOA scenes saved as .npy files, e.g. with tiled_download.py.
+# import os, sys
+# import glob
+# root = os.getcwd()
+# while not os.path.isdir(os.path.join(root, 'Template')) and os.path.dirname(root) != root:
+#     root = os.path.dirname(root)
+# sys.path.append(os.path.join(root, 'Template'))
+# from local_cloud_score import score_scenes
+# score_scenes(glob.glob('scenes/*.npy'), 'scores', sensor='OLI_TIRS', threshold=20)
+
 
 
 
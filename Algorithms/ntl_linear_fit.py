@@ -74,6 +74,17 @@ Map.addLayer(fit,
          {'min': 0, 'max': [0.18, 20, -0.18], 'bands': ['scale', 'offset', 'scale']},
          'stable lights trend')
 
+# # The same fit can be computed locally from the yearly images saved as a .npy stack of shape (time, height, width),
+# # e.g. stacked with memmap_chunks.stack_scenes() from images saved by tiled_download.py.
+# import os, sys
+# root = os.getcwd()
+# while not os.path.isdir(os.path.join(root, 'Template')) and os.path.dirname(root) != root:
+#     root = os.path.dirname(root)
+# sys.path.append(os.path.join(root, 'Template'))
+# from local_linear_fit import linear_fit, years_since
+# dates = collection.aggregate_array('system:time_start').map(lambda t: ee.Date(t).format('YYYY-MM-dd')).getInfo()
+# linear_fit('dmsp_avg_vis.npy', 'trend.npy', years_since(dates, '1990-01-01'), residuals=True, count=True)
+
 
 # %%
 """
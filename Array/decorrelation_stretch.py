@@ -122,6 +122,16 @@ Map.addLayer(dcs(image, region, 1000).select(rgb), {}, 'DCS Image')
 # Display the region in which covariance stats were computed.
 Map.addLayer(ee.Image().paint(region, 0, 2), {}, 'Region')
 
+# # The same stretch can be computed locally, in one pass for the statistics, from the region saved as a .npy
+# # file of shape (bands, height, width), e.g. with tiled_download.py.
+# import os, sys
+# root = os.getcwd()
+# while not os.path.isdir(os.path.join(root, 'Template')) and os.path.dirname(root) != root:
+#     root = os.path.dirname(root)
+# sys.path.append(os.path.join(root, 'Template'))
+# from local_pca import decorrelation_stretch
+# decorrelation_stretch('MCD43A4_2002_07_04.npy', 'dcs.npy')
+
 
 
 # %%
@@ -132,6 +132,16 @@ for i in range(0, bandNames.length().getInfo()):
     band = pcImage.bandNames().get(i).getInfo()
     Map.addLayer(pcImage.select([band]), {'min': -2, 'max': 2}, band)
 
+# # The same components can be computed locally, in one pass for the statistics, from the scene saved as a .npy
+# # file of shape (bands, height, width), e.g. with tiled_download.py.
+# import os, sys
+# root = os.getcwd()
+# while not os.path.isdir(os.path.join(root, 'Template')) and os.path.dirname(root) != root:
+#     root = os.path.dirname(root)
+# sys.path.append(os.path.join(root, 'Template'))
+# from local_pca import principal_components
+# principal_components('LC80440342014077.npy', 'pcs.npy')
+
 
 
 
@@ -97,6 +97,16 @@ rgb = greenest.select(['B3', 'B2', 'B1'])
 Map.addLayer(rgb, {'gain': [1.4, 1.4, 1.1]}, 'Greenest')
 Map.setCenter(-90.08789, 16.38339, 11)
 
+# # The same mosaic can be computed locally from a downloaded stack of shape (time, bands, height, width) with the
+# # quality as band 0, e.g. stacked with memmap_chunks.stack_scenes() from scenes saved by tiled_download.py.
+# import os, sys
+# root = os.getcwd()
+# while not os.path.isdir(os.path.join(root, 'Template')) and os.path.dirname(root) != root:
+#     root = os.path.dirname(root)
+# sys.path.append(os.path.join(root, 'Template'))
+# from local_quality_mosaic import quality_mosaic
+# quality_mosaic('l7_2000_stack.npy', 'greenest.npy', quality_band=0, nodata=0)
+
 
 
 # %%
@@ -87,6 +87,18 @@ Map.addLayer(ee.Algorithms.Terrain(ee.Image('CGIAR/SRTM90_V4')).select('hillshad
 Map.addLayer(colored, {'min': 0, 'max': 1},
   'Unmixed (red=urban, green=veg, blue=water)')
 
+# # The pseudo inverse above lets fractions go negative or sum past one. For a scene downloaded as a
+# # (bands, height, width) .npy file, e.g. with tiled_download.py, the fractions can be computed locally
+# # with both constraints.
+# import os, sys
+# root = os.getcwd()
+# while not os.path.isdir(os.path.join(root, 'Template')) and os.path.dirname(root) != root:
+#     root = os.path.dirname(root)
+# sys.path.append(os.path.join(root, 'Template'))
+# from local_unmixing import unmix
+# unmix('l5_2007_median.npy', 'unmixed.npy', [urbanEndmember, vegEndmember, waterEndmember],
+#       sum_to_one=True, non_negative=True)
+
 
 # %%
 """
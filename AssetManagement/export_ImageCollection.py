@@ -45,6 +45,20 @@ Map
 
 # %%
 # Add Earth Engine dataset
+import os
+import sys
+
+# Export with the export scheduler when the Template folder of the repository is available
+# (see Template/export_scheduler.py), and with one task.start() per image otherwise, e.g. in Colab.
+root = os.getcwd()
+while not os.path.isdir(os.path.join(root, 'Template')) and os.path.dirname(root) != root:
+    root = os.path.dirname(root)
+sys.path.append(os.path.join(root, 'Template'))
+try:
+    from export_scheduler import ExportScheduler, collection_export_jobs
+except ImportError:
+    ExportScheduler = None
+
 # USDA NAIP ImageCollection
 collection = ee.ImageCollection('USDA/NAIP/DOQQ')
 
@@ -67,10 +81,6 @@ naip = collection.filterBounds(polys)
 naip_2015 = naip.filterDate('2015-01-01', '2015-12-31')
 mosaic = naip_2015.mosaic()
 
-# print out the number of images in the ImageCollection
-count = naip_2015.size().getInfo()
-print("Count: ", count)
-
 # add the ImageCollection and the roi to the map
 vis = {'bands': ['N', 'R', 'G']}
 Map.addLayer(mosaic,vis)
@@ -78,14 +88,28 @@ Map.addLayer(fc)
 
 # export the ImageCollection to Google Drive
 downConfig = {'scale': 30, "maxPixels": 1.0E13, 'driveFolder': 'image'}  # scale means resolution.
-img_lst = naip_2015.toList(100)
 
-for i in range(0, count):
-    image = ee.Image(img_lst.get(i))
-    name = image.get('system:index').getInfo()
+def exportImage(image, row):
+    name = row['system:index']
     # print(name)
-    task = ee.batch.Export.image(image, name, downConfig)
-    task.start()
+    return ee.batch.Export.image(image, name, downConfig)
+
+if ExportScheduler is not None:
+    # Get the IDs of all images with one request per 1000 images, then start the exports.
+    jobs = collection_export_jobs(naip_2015, exportImage)
+    scheduler = ExportScheduler(journal_file='export_ImageCollection_exports.jsonl', max_in_flight=100)
+    states = scheduler.run(jobs, wait=False)
+
+    # print out the number of images in the ImageCollection
+    print("Count: ", len(jobs))
+else:
+    count = naip_2015.size().getInfo()
+    print("Count: ", count)
+    img_lst = naip_2015.toList(100)
+    for i in range(0, count):
+        image = ee.Image(img_lst.get(i))
+        name = image.get('system:index').getInfo()
+        exportImage(image, {'system:index': name}).start()
 
 
 
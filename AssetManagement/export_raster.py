@@ -45,6 +45,20 @@ Map
 
 # %%
 # Add Earth Engine dataset
+import os
+import sys
+
+# Export with the export scheduler when the Template folder of the repository is available
+# (see Template/export_scheduler.py), and with one task.start() per image otherwise, e.g. in Colab.
+root = os.getcwd()
+while not os.path.isdir(os.path.join(root, 'Template')) and os.path.dirname(root) != root:
+    root = os.path.dirname(root)
+sys.path.append(os.path.join(root, 'Template'))
+try:
+    from export_scheduler import ExportScheduler, collection_export_jobs
+except ImportError:
+    ExportScheduler = None
+
 collection = ee.ImageCollection('USDA/NAIP/DOQQ')
 
 polys = ee.Geometry.Polygon(
@@ -62,9 +76,6 @@ naip = collection.filterBounds(polys)
 naip_2015 = naip.filterDate('2015-01-01', '2015-12-31')
 ppr = naip_2015.mosaic()
 
-count = naip_2015.size().getInfo()
-print("Count: ", count)
-
 # print(naip_2015.size().getInfo())
 # vis = {'bands': ['N', 'R', 'G']}
 # Map.setCenter(lng, lat, 12)
@@ -72,14 +83,26 @@ print("Count: ", count)
 # Map.addLayer(polys)
 
 downConfig = {'scale': 30, "maxPixels": 1.0E13, 'driveFolder': 'image'}  # scale means resolution.
-img_lst = naip_2015.toList(100)
 
-for i in range(0, count):
-    image = ee.Image(img_lst.get(i))
-    name = image.get('system:index').getInfo()
+def exportImage(image, row):
+    name = row['system:index']
     # print(name)
-    task = ee.batch.Export.image(image, name, downConfig)
-    task.start()
+    return ee.batch.Export.image(image, name, downConfig)
+
+if ExportScheduler is not None:
+    # Get the IDs of all images with one request per 1000 images, then start the exports.
+    jobs = collection_export_jobs(naip_2015, exportImage)
+    scheduler = ExportScheduler(journal_file='export_raster_exports.jsonl', max_in_flight=100)
+    states = scheduler.run(jobs, wait=False)
+    print("Count: ", len(jobs))
+else:
+    count = naip_2015.size().getInfo()
+    print("Count: ", count)
+    img_lst = naip_2015.toList(100)
+    for i in range(0, count):
+        image = ee.Image(img_lst.get(i))
+        name = image.get('system:index').getInfo()
+        exportImage(image, {'system:index': name}).start()
 
 
 
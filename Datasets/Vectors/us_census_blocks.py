@@ -61,6 +61,15 @@ Map.setCenter(-73.99172, 40.74101, 13)
 Map.addLayer(image, visParams, 'TIGER/2010/Blocks')
 # Map.addLayer(dataset, {}, 'for Inspector', False)
 
+# # Export the blocks of one state to GeoParquet page by page; getInfo() on the whole collection runs out of memory.
+# import os, sys
+# root = os.getcwd()
+# while not os.path.isdir(os.path.join(root, 'Template')) and os.path.dirname(root) != root:
+#     root = os.path.dirname(root)
+# sys.path.append(os.path.join(root, 'Template'))
+# from feature_stream import export_geoparquet
+# export_geoparquet(dataset.filter(ee.Filter.eq('statefp10', '11')), 'blocks_dc.parquet', page_size=2000)
+
 
 # %%
 """
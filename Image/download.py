@@ -57,6 +57,22 @@ print(path)
 vis_params = {'min': 0, 'max': 3000}
 Map.addLayer(image1, vis_params)
 
+# # A single download request fails over the size limit of the server. To download a larger region, the region
+# # can be split into tiles downloaded in parallel and mosaicked into a memory-mappable .npy file of shape
+# # (bands, height, width); a .tif output file gives a GeoTIFF instead, which needs the rasterio package.
+# # Rerunning the cell after an interruption only downloads the missing tiles.
+# import os, sys
+# root = os.getcwd()
+# while not os.path.isdir(os.path.join(root, 'Template')) and os.path.dirname(root) != root:
+#     root = os.path.dirname(root)
+# sys.path.append(os.path.join(root, 'Template'))
+# from tiled_download import download_tiled
+# path = download_tiled(image1, 'srtm90_v4.npy',
+#     region='[[-120, 35], [-119, 35], [-119, 34], [-120, 34]]',
+#     scale=30,
+#     crs='EPSG:4326',
+#     dtype='int16')
+
 
 # %%
 """
@@ -61,6 +61,16 @@ water = [51, 20, 14, 9, 7, 116, 4]
 fractions = image.unmix([urban, veg, water])
 Map.addLayer(fractions, {}, 'unmixed')
 
+# # The same fractions can be computed locally for the image downloaded as a (bands, height, width) .npy file,
+# # e.g. with tiled_download.py, optionally summing to one and non-negative.
+# import os, sys
+# root = os.getcwd()
+# while not os.path.isdir(os.path.join(root, 'Template')) and os.path.dirname(root) != root:
+#     root = os.path.dirname(root)
+# sys.path.append(os.path.join(root, 'Template'))
+# from local_unmixing import unmix
+# unmix('LT05_044034_20080214.npy', 'fractions.npy', [urban, veg, water], sum_to_one=True, non_negative=True)
+
 
 
 # %%
@@ -45,6 +45,21 @@ Map
 
 # %%
 # Add Earth Engine dataset
+import os
+import sys
+
+# Evaluate the values to print with one request when the Template folder of the repository is available
+# (see Template/getinfo_batch.py), and with one getInfo() call each otherwise, e.g. in Colab.
+root = os.getcwd()
+while not os.path.isdir(os.path.join(root, 'Template')) and os.path.dirname(root) != root:
+    root = os.path.dirname(root)
+sys.path.append(os.path.join(root, 'Template'))
+try:
+    from getinfo_batch import get_info_all
+except ImportError:
+    def get_info_all(*ee_objects):
+        return [ee_object.getInfo() for ee_object in ee_objects]
+
 p1 = ee.Geometry.Point([103.521, 13.028])
 p2 = ee.Geometry.Point([105.622, 13.050])
 Date_Start = ee.Date('2000-05-01')
@@ -53,16 +68,13 @@ Date_window = ee.Number(30)
 
 # Create list of dates for time series
 n_months = Date_End.difference(Date_Start, 'month').round()
-print("Number of months:", n_months.getInfo())
-dates = ee.List.sequence(0, n_months, 1)
-print(dates.getInfo())
+months = ee.List.sequence(0, n_months, 1)
 
 def make_datelist(n):
     return Date_Start.advance(n, 'month')
 
 
-dates = dates.map(make_datelist)
-print(dates.getInfo())
+dates = months.map(make_datelist)
 
 
 def fnc(d1):
@@ -83,9 +95,16 @@ def fnc(d1):
 
 
 list_of_images = dates.map(fnc)
-print('list_of_images', list_of_images.getInfo())
 mt = ee.ImageCollection(list_of_images)
-print(mt.getInfo())
+
+n_months_info, months_info, dates_info, list_of_images_info, mt_info = get_info_all(
+    n_months, months, dates, list_of_images, mt)
+
+print("Number of months:", n_months_info)
+print(months_info)
+print(dates_info)
+print('list_of_images', list_of_images_info)
+print(mt_info)
 # Map.addLayer(mt, {}, 'mt')
 
 
@@ -45,6 +45,25 @@ Map
 
 # %%
 # Add Earth Engine dataset
+import os
+import sys
+import functools
+
+# Submit the exports with the export scheduler and evaluate the getInfo() calls together when the Template folder
+# of the repository is available (see Template/export_scheduler.py), and one by one otherwise, e.g. in Colab.
+root = os.getcwd()
+while not os.path.isdir(os.path.join(root, 'Template')) and os.path.dirname(root) != root:
+    root = os.path.dirname(root)
+sys.path.append(os.path.join(root, 'Template'))
+try:
+    from export_scheduler import ExportScheduler, summarize
+    from getinfo_batch import get_info_all
+except ImportError:
+    ExportScheduler = None
+
+    def get_info_all(*ee_objects):
+        return [ee_object.getInfo() for ee_object in ee_objects]
+
 year = 2015
 collection = ee.ImageCollection('USDA/NAIP/DOQQ')
 startTime = ee.Date(str(year) + '-01-01')
@@ -57,11 +76,15 @@ fromFT = ee.FeatureCollection('ft:1CLldB-ULPyULBT2mxoRNv7enckVF0gCQoD2oH7XP')
 # print(count)
 polys = fromFT.geometry()
 centroid = polys.centroid()
-lng, lat = centroid.getInfo()['coordinates']
+columns = fromFT.reduceColumns(ee.Reducer.toList(2), ['system:index', 'name'])
+
+# Get the centroid and the watershed names with one request.
+centroid, columns = get_info_all(centroid, columns)
+lng, lat = centroid['coordinates']
 # print("lng = {}, lat = {}".format(lng, lat))
 
 
-values = fromFT.reduceColumns(ee.Reducer.toList(2), ['system:index', 'name']).getInfo()['list']
+values = columns['list']
 # print(values)
 Map.setCenter(lng, lat, 10)
 
@@ -95,20 +118,40 @@ def exportToDrive(vec, filename):
         'fileFormat': 'KML'
     }
     task = ee.batch.Export.table(vec, filename, taskParams)
-    task.start()
+    return task
 
 
-vis = {'bands': ['N', 'R', 'G']}
-for (id, name) in values:
+def watershedTask(id, name, filename):
     watershed = fromFT.filter(ee.Filter.eq('system:index', str(id)))
-    filename = "Y" + str(year) + "_" + str(id) + "_" + str(name).replace(" ", "_")
-    print(filename)
     image = subsetNAIP(collection, startTime, endTime, watershed)
     ndwi = calNDWI(image)
     vector = rasterToVector(ndwi, watershed)
-    exportToDrive(vector, filename)
     # Map.addLayer(image, vis)
     # Map.addLayer(vector)
+    return exportToDrive(vector, filename)
+
+
+vis = {'bands': ['N', 'R', 'G']}
+jobs = {}
+for (id, name) in values:
+    filename = "Y" + str(year) + "_" + str(id) + "_" + str(name).replace(" ", "_")
+    jobs[filename] = functools.partial(watershedTask, id, name, filename)
+
+if ExportScheduler is not None:
+    # Submit the exports, at most 100 at a time, and return once the last one is submitted.
+    # The journal records every task, so rerunning the cell resumes an interrupted run without
+    # resubmitting finished or running exports.
+    scheduler = ExportScheduler(journal_file='loop_FeatureCollection_exports.jsonl', max_in_flight=100)
+    states = scheduler.run(jobs, wait=False)
+    print(summarize(states))
+else:
+    for filename, job in jobs.items():
+        print(filename)
+        job().start()
+
+# # To wait for the exports and resubmit the failed ones later, run again with the same journal:
+# states = ExportScheduler(journal_file='loop_FeatureCollection_exports.jsonl', max_in_flight=100).run(jobs)
+# print(summarize(states))
 
 
 
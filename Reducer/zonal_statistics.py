@@ -76,6 +76,18 @@ means = nlDiff.reduceRegion(**{
 # Print the resultant Dictionary.
 print(means.getInfo())
 
+# # At a finer scale the region has too many pixels for one reduceRegion(). It can be reduced tile by tile instead,
+# # merging the means of the tiles per category.
+# import os, sys
+# root = os.getcwd()
+# while not os.path.isdir(os.path.join(root, 'Template')) and os.path.dirname(root) != root:
+#     root = os.path.dirname(root)
+# sys.path.append(os.path.join(root, 'Template'))
+# from tiled_reduce import tiled_reduce_region
+# means = tiled_reduce_region(nlDiff, region.geometry(), ['mean'], scale=100,
+#                             group_band='Land_Cover_Type_1', group_name='code')
+# print(means)
+
 
 # %%
 """
@@ -0,0 +1,287 @@
+''' Benchmark the Earth Engine JavaScript to Python/notebook conversion tools.
+
+Runs js_to_python (in memory and streaming), py_to_ipynb and the template extraction functions over every JavaScript in JavaScripts/ and over
+synthetically enlarged scripts, and reports files/sec, per-stage time and peak memory (RSS) for each stage.
+
+To record a baseline: python benchmark_converter.py --update-baseline
+To compare against the baseline: python benchmark_converter.py --threshold 20
+
+The comparison exits with status 1 when the time or peak memory of a stage grows by more than the threshold (percent).
+
+'''
+
+# License: MIT
+
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import resource
+import contextlib
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from convert_js_to_python import js_to_python, py_to_ipynb, remove_qgis_import, template_header, template_footer
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATE_FILE = os.path.join(ROOT_DIR, 'Template', 'template.py')
+BASELINE_FILE = os.path.join(ROOT_DIR, 'Template', 'benchmark_baseline.json')
+STAGES = ['js_to_python', 'js_to_python_stream', 'py_to_ipynb', 'template_extraction']
+
+
+def peak_rss_mb():
+    """Get the peak resident set size of the current process.
+
+    Returns:
+        float: Peak RSS in MB.
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':   # bytes on macOS, kilobytes elsewhere
+        return rss / 1024.0 / 1024.0
+    return rss / 1024.0
+
+
+def enlarge_feature_collection(in_file, out_file, features=10000, seed=0):
+    """Write a copy of a script whose first inline ee.Feature literal is repeated many times, like a large Code Editor import.
+
+    Args:
+        in_file (str): Input JavaScript containing inline ee.Feature(ee.Geometry.Point(...), {...}) literals, e.g. Demos/Classification.js.
+        out_file (str): Output JavaScript.
+        features (int, optional): Number of features to add. Defaults to 10000.
+        seed (int, optional): Seed used to jitter the coordinates. Defaults to 0.
+    """
+    with open(in_file) as f:
+        lines = f.readlines()
+
+    start = [index for index, line in enumerate(lines) if line.strip() == 'ee.Feature('][0]
+    end = start
+    while not lines[end].strip().startswith('})'):
+        end += 1
+    block = lines[start:end+1]
+    if not block[-1].rstrip().endswith(','):
+        block[-1] = block[-1].rstrip() + ',\n'
+
+    rng = random.Random(seed)
+    new_lines = []
+    for index in range(features):
+        lon = -122.5 + rng.random() * 0.5
+        lat = 37.5 + rng.random() * 0.5
+        for line in block:
+            if 'ee.Geometry.Point' in line:
+                line = line[:line.index('[')] + '[{}, {}]),\n'.format(lon, lat)
+            elif '"system:index"' in line:
+                line = line[:line.index(':') + 1] + ' "x{}"\n'.format(index)
+            new_lines.append(line)
+
+    lines[start:start] = new_lines
+    with open(out_file, 'w') as f:
+        f.writelines(lines)
+
+
+def many_map_functions(out_file, functions=2000):
+    """Write a script with many nested .map(function ...) blocks and helper functions.
+
+    Args:
+        out_file (str): Output JavaScript.
+        functions (int, optional): Number of map functions. Defaults to 2000.
+    """
+    with open(out_file, 'w') as f:
+        f.write("var collection = ee.ImageCollection('LANDSAT/LC08/C01/T1_TOA');\n")
+        for index in range(functions):
+            f.write('var col{} = collection.map(function(image) {{\n'.format(index))
+            f.write('  var scale = function(band) {\n')
+            f.write('    return image.select(band).multiply({min: 0, max: 1});\n')
+            f.write('  };\n')
+            f.write('  for (var i = 0; i < 3; i++) {\n')
+            f.write("    image = image.addBands(scale('B' + i));\n")
+            f.write('  }\n')
+            f.write("  return image.set({{index: {}}});\n".format(index))
+            f.write('});\n')
+            f.write("Map.addLayer(col{}, {{bands: ['B4', 'B3', 'B2'], max: 0.3}}, 'layer');\n".format(index))
+
+
+def make_corpora(work_dir, features=10000, functions=2000):
+    """Collect the benchmark corpora: the JavaScripts/ folder and synthetic scripts.
+
+    Args:
+        work_dir (str): Folder for the synthetic scripts.
+        features (int, optional): Number of inline features in the enlarged classification script. Defaults to 10000.
+        functions (int, optional): Number of map functions in the synthetic script. Defaults to 2000.
+
+    Returns:
+        dict: Lists of JavaScript file paths keyed by corpus name.
+    """
+    corpora = {'corpus': sorted(str(path) for path in Path(ROOT_DIR, 'JavaScripts').rglob('*.js'))}
+
+    synthetic_dir = os.path.join(work_dir, 'synthetic')
+    os.makedirs(synthetic_dir, exist_ok=True)
+
+    out_file = os.path.join(synthetic_dir, 'Classification_{}.js'.format(features))
+    enlarge_feature_collection(os.path.join(ROOT_DIR, 'JavaScripts', 'Demos', 'Classification.js'), out_file, features)
+    corpora['classification_features'] = [out_file]
+
+    out_file = os.path.join(synthetic_dir, 'MapFunctions_{}.js'.format(functions))
+    many_map_functions(out_file, functions)
+    corpora['map_functions'] = [out_file]
+
+    return corpora
+
+
+def run_stage(stage, files, out_dir, repeat=1):
+    """Run one stage over a list of files. Meant to run in a fresh process, so the peak RSS belongs to this stage.
+
+    Args:
+        stage (str): One of STAGES.
+        files (list): Input JavaScripts.
+        out_dir (str): Folder for the Python scripts and notebooks.
+        repeat (int, optional): Number of runs. The fastest run is reported. Defaults to 1.
+
+    Returns:
+        dict: Stage results.
+    """
+    # Keep the folders below the common input folder, since JavaScripts/ repeats some file names.
+    in_dir = os.path.commonpath([os.path.dirname(os.path.abspath(in_file)) for in_file in files])
+    py_files = [os.path.join(out_dir, os.path.splitext(os.path.relpath(os.path.abspath(in_file), in_dir))[0] + '_qgis.py') for in_file in files]
+    timings = []
+
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for in_file, py_file in zip(files, py_files):
+                if stage == 'js_to_python':
+                    js_to_python(in_file, py_file, use_qgis=True, force=True)
+                elif stage == 'js_to_python_stream':
+                    js_to_python(in_file, py_file, use_qgis=True, force=True, stream=True)
+                elif stage == 'py_to_ipynb':
+                    py_to_ipynb(py_file, TEMPLATE_FILE, py_file.replace('_qgis.py', '.ipynb'), force=True)
+                elif stage == 'template_extraction':
+                    template_header(TEMPLATE_FILE)
+                    template_footer(TEMPLATE_FILE)
+                    remove_qgis_import(py_file)
+                else:
+                    raise ValueError('The stage must be one of the following: {}'.format(', '.join(STAGES)))
+        timings.append(time.perf_counter() - start_time)
+
+    seconds = min(timings)
+    return {
+        'files': len(files),
+        'seconds': round(seconds, 4),
+        'files_per_sec': round(len(files) / seconds, 2) if seconds > 0 else None,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+
+def run_benchmarks(features=10000, functions=2000, repeat=3, stages=None):
+    """Run every stage over every corpus, each stage in its own process.
+
+    Args:
+        features (int, optional): Number of inline features in the enlarged classification script. Defaults to 10000.
+        functions (int, optional): Number of map functions in the synthetic script. Defaults to 2000.
+        repeat (int, optional): Number of runs per stage. Defaults to 3.
+        stages (list, optional): Stages to run. Defaults to None, which runs all STAGES.
+
+    Returns:
+        dict: Results keyed by corpus name and stage.
+    """
+    stages = stages or STAGES
+    work_dir = tempfile.mkdtemp(prefix='benchmark_converter_')
+    results = {}
+    try:
+        corpora = make_corpora(work_dir, features, functions)
+        for name, files in corpora.items():
+            out_dir = os.path.join(work_dir, name)
+            os.makedirs(out_dir, exist_ok=True)
+            results[name] = {}
+            # Later stages read the scripts written by js_to_python, so it always runs first.
+            for stage in ['js_to_python'] + [stage for stage in stages if stage != 'js_to_python']:
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    result = executor.submit(run_stage, stage, files, out_dir, repeat).result()
+                if stage in stages:
+                    results[name][stage] = result
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return results
+
+
+def compare_results(results, baseline, threshold=20):
+    """Compare benchmark results with a baseline.
+
+    Args:
+        results (dict): Results of run_benchmarks().
+        baseline (dict): Results of an earlier run.
+        threshold (float, optional): Allowed growth of time and peak memory, in percent. Defaults to 20.
+
+    Returns:
+        list: Descriptions of the regressions. Empty if there are none.
+    """
+    regressions = []
+    for name, stages in results.items():
+        for stage, result in stages.items():
+            base = baseline.get(name, {}).get(stage)
+            if base is None:
+                continue
+            for key in ['seconds', 'peak_rss_mb']:
+                if not base.get(key):
+                    continue
+                change = (result[key] - base[key]) / base[key] * 100
+                if change > threshold:
+                    regressions.append('{}/{}: {} {} -> {} (+{:.1f}%)'.format(
+                        name, stage, key, base[key], result[key], change))
+    return regressions
+
+
+def print_results(results):
+    """Print benchmark results as a table.
+
+    Args:
+        results (dict): Results of run_benchmarks().
+    """
+    print('{:<26}{:<22}{:>7}{:>11}{:>12}{:>14}'.format('corpus', 'stage', 'files', 'seconds', 'files/sec', 'peak RSS MB'))
+    for name, stages in results.items():
+        for stage, result in stages.items():
+            print('{:<26}{:<22}{:>7}{:>11}{:>12}{:>14}'.format(
+                name, stage, result['files'], result['seconds'], str(result['files_per_sec']), result['peak_rss_mb']))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the JavaScript to Python/notebook conversion tools.')
+    parser.add_argument('--baseline', type=str, default=BASELINE_FILE, help='Path to the baseline JSON file')
+    parser.add_argument('--update-baseline', action='store_true', help='Save the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=20, help='Allowed regression in percent')
+    parser.add_argument('--features', type=int, default=10000, help='Inline features in the enlarged Classification.js')
+    parser.add_argument('--functions', type=int, default=2000, help='Map functions in the synthetic script')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per stage; the fastest one is reported')
+    parser.add_argument('--stages', type=str, nargs='+', choices=STAGES, default=None, help='Stages to run')
+    parser.add_argument('--output', type=str, default=None, help='Path to save the results as JSON')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.features, args.functions, args.repeat, args.stages)
+    print_results(results)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('Baseline saved at: {}'.format(args.baseline))
+    elif os.path.isfile(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare_results(results, json.load(f), args.threshold)
+        if regressions:
+            print('\nRegressions over {}%:'.format(args.threshold))
+            for regression in regressions:
+                print(regression)
+            sys.exit(1)
+        print('\nNo regressions over {}%.'.format(args.threshold))
+    else:
+        print('\nNo baseline found at {}. Run with --update-baseline to create one.'.format(args.baseline))
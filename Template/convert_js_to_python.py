@@ -2,6 +2,7 @@
 
 To convert one Earth Engine JavaScript to Python script: js_to_python(in_file_path, out_file_path)
 To convert all Earth Engine JavaScripts in a folder recursively: js_to_python_dir(in_dir, out_dir)
+To use the legacy engine that rescans the script for every bracket lookup: js_to_python(in_file_path, out_file_path, engine='legacy')
 
 '''
 
@@ -9,13 +10,34 @@ To convert all Earth Engine JavaScripts in a folder recursively: js_to_python_di
 # License: MIT
 
 import os
+import re
+import ast
+import copy
 import glob
+import json
+import time
+import queue
 import random
 import string
+import heapq
+import marshal
+import filecmp
+import hashlib
 import argparse
+import functools
+import threading
+import contextlib
 import subprocess
 from pathlib import Path
 from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+
+# Bump this whenever a change to the converter changes its output, so that incremental runs reconvert everything.
+CONVERTER_VERSION = '2'
+
+# Default name of the manifest file written to the output folder by js_to_python_dir(incremental=True).
+MANIFEST_FILE = '.js_to_python_manifest.json'
 
 
 def random_string(string_length=3):
@@ -32,6 +54,57 @@ def random_string(string_length=3):
     return ''.join(random.choice(letters) for i in range(string_length))
 
 
+def stable_name(text, position, used_names=None, prefix='func_', string_length=3):
+    """Derive a name from a hash of a piece of code and its position, so the same input always gets the same name.
+
+    Args:
+        text (str): The code the name is given to, e.g. a function body.
+        position (int): Position of the code in its file, e.g. the ordinal of the function.
+        used_names (set, optional): Names already taken. The hash is extended until the name is unused, and the new name is added. Defaults to None.
+        prefix (str, optional): Prefix of the name. Defaults to 'func_'.
+        string_length (int, optional): Number of letters taken from the hash. Defaults to 3.
+
+    Returns:
+        str: A name such as 'func_kqz'.
+    """
+    digest = hashlib.sha256('{}\n{}'.format(position, text).encode('utf-8')).digest()
+    letters = ''.join(string.ascii_lowercase[byte % 26] for byte in digest)
+
+    name = prefix + letters[:string_length]
+    while used_names is not None and name in used_names:
+        string_length += 1
+        name = prefix + letters[:string_length]
+    if used_names is not None:
+        used_names.add(name)
+
+    return name
+
+
+def write_text(out_file, text, force=False):
+    """Write text to a file, leaving the file untouched if it already holds the same text.
+
+    Args:
+        out_file (str): Output file path.
+        text (str): Text to write.
+        force (bool, optional): Whether to write even if the content is unchanged. Defaults to False.
+
+    Returns:
+        bool: True if the file was written.
+    """
+    if not force and os.path.isfile(out_file):
+        with open(out_file) as f:
+            if f.read() == text:
+                return False
+
+    out_dir = os.path.dirname(os.path.abspath(out_file))
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    with open(out_file, 'w') as f:
+        f.write(text)
+    return True
+
+
 def find_matching_bracket(lines, start_line_index, start_char_index, matching_char='{'):
     """Find the position of the matching closing bracket from a list of lines.
 
@@ -89,6 +162,329 @@ def find_matching_bracket(lines, start_line_index, start_char_index, matching_ch
     return matching_line_index, matching_char_index
 
 
+class ScanningBracketIndex:
+    """Legacy bracket lookup that rescans the lines with find_matching_bracket on every call.
+
+    Args:
+        lines (list): The list of lines to search. The list is updated in place by set_line() and remove_char().
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+
+    def find(self, line_index, char_index):
+        """Find the position of the '}' matching the '{' at the given position.
+
+        Args:
+            line_index (int): The line index where the starting bracket is located.
+            char_index (int): The position index of the starting bracket.
+
+        Returns:
+            tuple: The line index and the position index of the matching closing bracket.
+        """
+        return find_matching_bracket(self.lines, line_index, char_index)
+
+    def set_line(self, line_index, line):
+        """Replace a line.
+
+        Args:
+            line_index (int): The index of the line to replace.
+            line (str): The new line.
+        """
+        self.lines[line_index] = line
+
+    def remove_char(self, line_index, char_index):
+        """Remove one character from a line.
+
+        Args:
+            line_index (int): The index of the line.
+            char_index (int): The position index of the character to remove.
+        """
+        line = self.lines[line_index]
+        self.lines[line_index] = line[:char_index] + line[char_index+1:]
+
+
+class BracketIndex(ScanningBracketIndex):
+    """Bracket/scope index built by tokenizing the lines once.
+
+    Every '{' and '}' is paired in a single linear pass using a stack, so finding a matching bracket is a
+    lookup instead of a scan to the end of the file. Brackets inside strings and comments are counted just
+    like find_matching_bracket counts them, so both produce the same pairs. The index is kept up to date
+    as lines are rewritten; when an edit cannot be mapped onto the existing tokens the index is rebuilt
+    from the current lines on the next lookup.
+
+    Args:
+        lines (list): The list of lines to index. The list is updated in place by set_line() and remove_char().
+    """
+
+    token_regex = re.compile(r'[{}]')
+
+    def __init__(self, lines):
+        super().__init__(lines)
+        self.build()
+
+    def build(self, lines=None):
+        """Tokenize all lines and pair the brackets.
+
+        Args:
+            lines (iterable, optional): The lines to tokenize. Defaults to None, which uses the indexed lines.
+        """
+        self.tokens = {}   # line index -> list of [char_index, token_id] for every bracket on the line, in order.
+        self.token_lines = {}   # token_id -> line index, for tokens that still exist.
+        self.pairs = {}   # token_id of '{' -> token_id of the matching '}'.
+        self.line_count = 0
+        self.dirty = False
+
+        stack = []
+        token_id = 0
+        for line_index, line in enumerate(self.lines if lines is None else lines):
+            line_tokens = []
+            for match in self.token_regex.finditer(line):
+                if match.group() == '{':
+                    stack.append(token_id)
+                elif stack:
+                    self.pairs[stack.pop()] = token_id
+                line_tokens.append([match.start(), token_id])
+                self.token_lines[token_id] = line_index
+                token_id += 1
+            if line_tokens:
+                self.tokens[line_index] = line_tokens
+            self.line_count = line_index + 1
+
+    def lookup(self, line_index, char_index):
+        """Look up the '}' matching an indexed '{'.
+
+        Args:
+            line_index (int): The line index where the starting bracket is located.
+            char_index (int): The position index of the starting bracket.
+
+        Returns:
+            tuple: The line index and the position index of the matching closing bracket, (-1, -1) if it has none,
+                or None if the index no longer describes this bracket.
+        """
+        for index, token_id in self.tokens.get(line_index, []):
+            if index != char_index:
+                continue
+            if token_id not in self.pairs:
+                return -1, -1
+            match_id = self.pairs[token_id]
+            if match_id not in self.token_lines:
+                return None
+            match_line_index = self.token_lines[match_id]
+            for match_index, tmp_id in self.tokens[match_line_index]:
+                if tmp_id == match_id:
+                    return match_line_index, match_index
+        return None
+
+    def find(self, line_index, char_index):
+        """Find the position of the '}' matching the '{' at the given position.
+
+        Falls back to find_matching_bracket when the given position is not an indexed '{'.
+
+        Args:
+            line_index (int): The line index where the starting bracket is located.
+            char_index (int): The position index of the starting bracket.
+
+        Returns:
+            tuple: The line index and the position index of the matching closing bracket.
+        """
+        if self.dirty:
+            self.build()
+
+        line = self.lines[line_index]
+        if 0 <= char_index < len(line) and line[char_index] == '{':
+            match = self.lookup(line_index, char_index)
+            if match is not None:
+                return match
+
+            # The index no longer describes this bracket. Rebuild it from the current lines.
+            self.build()
+
+        return super().find(line_index, char_index)
+
+    def set_line(self, line_index, line):
+        """Replace a line, keeping the tokens of brackets that are still on it.
+
+        Args:
+            line_index (int): The index of the line to replace.
+            line (str): The new line.
+        """
+        if line_index < 0:
+            line_index += len(self.lines)
+        if self.dirty:
+            self.lines[line_index] = line
+            return
+
+        old_line = self.lines[line_index]
+        old_tokens = self.tokens.get(line_index, [])
+        old_chars = [old_line[index] for index, _ in old_tokens]
+        new_indices = [match.start() for match in self.token_regex.finditer(line)]
+        new_chars = [line[index] for index in new_indices]
+
+        # The brackets kept must be the trailing ones, e.g. when a line is replaced by the text after '}'.
+        kept = len(new_chars)
+        if kept <= len(old_chars) and old_chars[len(old_chars)-kept:] == new_chars:
+            for _, token_id in old_tokens[:len(old_chars)-kept]:
+                del self.token_lines[token_id]
+            new_tokens = old_tokens[len(old_chars)-kept:]
+            for token, index in zip(new_tokens, new_indices):
+                token[0] = index
+            self.tokens[line_index] = new_tokens
+        else:
+            self.dirty = True
+
+        self.lines[line_index] = line
+
+    def remove_tokens(self, line_index, char_index):
+        """Remove the bracket at a position from the index and shift the brackets after it.
+
+        Args:
+            line_index (int): The index of the line.
+            char_index (int): The position index of the removed character.
+
+        Returns:
+            bool: True if a bracket was removed.
+        """
+        removed = False
+        new_tokens = []
+        for token in self.tokens.get(line_index, []):
+            if token[0] == char_index:
+                del self.token_lines[token[1]]
+                removed = True
+                continue
+            if token[0] > char_index:
+                token[0] -= 1
+            new_tokens.append(token)
+        self.tokens[line_index] = new_tokens
+        return removed
+
+    def remove_char(self, line_index, char_index):
+        """Remove one character from a line, shifting the brackets after it.
+
+        Args:
+            line_index (int): The index of the line.
+            char_index (int): The position index of the character to remove.
+        """
+        if line_index < 0:
+            line_index += len(self.lines)
+        line = self.lines[line_index]
+        if self.dirty or not 0 <= char_index < len(line):
+            self.set_line(line_index, line[:char_index] + line[char_index+1:])
+            return
+
+        self.remove_tokens(line_index, char_index)
+        self.lines[line_index] = line[:char_index] + line[char_index+1:]
+
+
+class StreamFallback(Exception):
+    """Raised when a script cannot be converted as a stream, so it has to be converted in memory."""
+
+
+class LineStream:
+    """Lines read one at a time from an iterator, holding only a window of lines in memory.
+
+    The window starts at the line being converted and grows as far as the code looks ahead, e.g. to the end of a
+    map function. The number of lines is unknown until the iterator is exhausted, so indexing past the last line
+    raises IndexError, like a list, and len() is not supported.
+
+    Args:
+        lines (iterable): The lines.
+    """
+
+    def __init__(self, lines):
+        self.source = iter(lines)
+        self.window = {}
+        self.next_index = 0
+        self.exhausted = False
+
+    def load(self, line_index):
+        while self.next_index <= line_index and not self.exhausted:
+            try:
+                self.window[self.next_index] = next(self.source)
+                self.next_index += 1
+            except StopIteration:
+                self.exhausted = True
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            if key.start is None or key.start < 0 or key.stop is None or key.stop < 0 or key.step is not None:
+                raise StreamFallback('Cannot slice lines with {}'.format(key))
+            lines = []
+            for line_index in range(key.start, key.stop):
+                try:
+                    lines.append(self[line_index])
+                except IndexError:
+                    break
+            return lines
+        if key < 0:
+            raise StreamFallback('Line {} is out of range'.format(key))
+        if key >= self.next_index:
+            self.load(key)
+            if key >= self.next_index:
+                raise IndexError('Line {} is out of range'.format(key))
+        if key not in self.window:
+            raise StreamFallback('Line {} has left the window'.format(key))
+        return self.window[key]
+
+    def __setitem__(self, line_index, line):
+        self[line_index]
+        self.window[line_index] = line
+
+    def __iter__(self):
+        line_index = 0
+        while True:
+            try:
+                line = self[line_index]
+            except IndexError:
+                return
+            self.window.pop(line_index - 1, None)
+            yield line
+            line_index += 1
+
+
+class StreamBracketIndex(ScanningBracketIndex):
+    """Bracket lookup over a LineStream that scans forward from the '{' to its matching '}'.
+
+    Nothing is indexed in advance, so memory holds only the lines between the line being converted and the
+    farthest bracket looked up, e.g. one function body. Lookups the stream cannot answer raise StreamFallback.
+
+    Args:
+        lines (LineStream): The lines as they are converted.
+    """
+
+    token_regex = BracketIndex.token_regex
+
+    def find(self, line_index, char_index):
+        line = self.lines[line_index]
+        if not (0 <= char_index < len(line) and line[char_index] == '{'):
+            raise StreamFallback('No bracket at line {}'.format(line_index))
+        depth = 0
+        while True:
+            for match in self.token_regex.finditer(line, char_index):
+                depth += 1 if match.group() == '{' else -1
+                if not depth:
+                    return line_index, match.start()
+            line_index += 1
+            char_index = 0
+            try:
+                line = self.lines[line_index]
+            except IndexError:
+                raise StreamFallback('No matching bracket')
+
+    def remove_char(self, line_index, char_index):
+        if line_index < 0:
+            raise StreamFallback('Cannot remove a character from line {}'.format(line_index))
+        super().remove_char(line_index, char_index)
+
+
+# Conversion engines that can be passed to js_to_python(). 'index' tokenizes each script once,
+# 'legacy' rescans the script for every bracket lookup.
+ENGINES = {
+    'index': BracketIndex,
+    'legacy': ScanningBracketIndex,
+}
+
+
 # extract parameters and wrap them with single/double quotes if needed.
 def format_params(line, sep=':'):
     """Format keys in a dictionary and adds quotes to the keys. 
@@ -227,56 +623,618 @@ def convert_for_loop(line):
     return new_line
 
 
-def check_map_functions(input_lines):
+def check_map_functions(input_lines, bracket_index=None):
     """Extract Earth Engine map function
     
     Args:
         input_lines (list): List of Earth Engine JavaScrips
+        bracket_index (ScanningBracketIndex, optional): Bracket index over input_lines. Defaults to None, which rescans the lines for every lookup.
     
     Returns:
         list: Output JavaScript with map function
     """    
-    output_lines = []
+    return list(iter_map_functions(input_lines, bracket_index))
+
+
+def iter_map_functions(input_lines, bracket_index=None):
+    """Extract Earth Engine map function, yielding the output lines one at a time. See check_map_functions().
+
+    Args:
+        input_lines (list): List of Earth Engine JavaScrips, or a LineStream.
+        bracket_index (ScanningBracketIndex, optional): Bracket index over input_lines. Defaults to None, which rescans the lines for every lookup.
+
+    Yields:
+        str: Output JavaScript with map function
+    """
+    if bracket_index is None:
+        bracket_index = ScanningBracketIndex(input_lines)
+
+    used_names = set()
     for index, line in enumerate(input_lines):
 
         if ('.map(function' in line) or ('.map (function') in line:
 
-            bracket_index = line.index("{")
-            matching_line_index, matching_char_index = find_matching_bracket(input_lines, index, bracket_index)
+            bracket_char_index = line.index("{")
+            matching_line_index, matching_char_index = bracket_index.find(index, bracket_char_index)
 
             func_start_index = line.index('function')
-            func_name = 'func_' + random_string()
+            func_text = line[func_start_index:] + ''.join(input_lines[index+1: matching_line_index])
+            func_name = stable_name(func_text, len(used_names), used_names)
             func_header = line[func_start_index:].replace('function', 'function ' + func_name)
-            output_lines.append('\n')
-            output_lines.append(func_header)
+            yield '\n'
+            yield func_header
 
             for sub_index, tmp_line in enumerate(input_lines[index+1: matching_line_index]):
-                output_lines.append(tmp_line)
-                input_lines[index+1+sub_index] = ''                
+                yield tmp_line
+                bracket_index.set_line(index+1+sub_index, '')
 
             header_line = line[:func_start_index] + func_name 
             header_line = header_line.rstrip()
 
             func_footer = input_lines[matching_line_index][:matching_char_index+1]
-            output_lines.append(func_footer)
+            yield func_footer
 
             footer_line = input_lines[matching_line_index][matching_char_index+1:].strip()
             if footer_line == ')' or footer_line == ');':
                 header_line = header_line + footer_line
                 footer_line = ''
 
-            input_lines[matching_line_index] = footer_line
+            bracket_index.set_line(matching_line_index, footer_line)
 
-            output_lines.append(header_line)
-            output_lines.append(footer_line)
+            yield header_line
+            yield footer_line
         else: 
-            output_lines.append(line)            
+            yield line
 
-    return output_lines
+
+class ConverterProfiler:
+    """Record call counts and cumulative time of each rewrite stage of js_to_python().
+
+    The same profiler can be passed to several js_to_python() calls to accumulate their stages. Stage names are
+    'read', 'check_map_functions', 'bracket_index', 'comments', 'function_hoisting', 'for_loops', 'blocks',
+    'replacements', 'format_params', 'output', 'compact_literals' and 'write'.
+
+    Args:
+        slowest_lines (int, optional): Number of slowest lines to keep for each per-line stage. Defaults to 0.
+    """
+
+    def __init__(self, slowest_lines=0):
+        self.slowest_lines = slowest_lines
+        self.calls = {}
+        self.seconds = {}
+        self.slowest = {}
+        self.in_file = None
+        self.count = 0
+
+    @contextlib.contextmanager
+    def stage(self, name, line_index=None, line=None):
+        """Time one call of a stage.
+
+        Args:
+            name (str): Name of the stage.
+            line_index (int, optional): Index of the line being rewritten, after map functions were extracted. Defaults to None.
+            line (str, optional): The line being rewritten. Defaults to None.
+        """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start_time, line_index, line)
+
+    def record(self, name, start_time, line_index=None, line=None):
+        """Record one call of a stage that started at start_time, without the cost of a context manager.
+
+        Args:
+            name (str): Name of the stage.
+            start_time (float): time.perf_counter() at the start of the call.
+            line_index (int, optional): Index of the line being rewritten. Defaults to None.
+            line (str, optional): The line being rewritten. Defaults to None.
+        """
+        elapsed = time.perf_counter() - start_time
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self.seconds[name] = self.seconds.get(name, 0.0) + elapsed
+
+        if self.slowest_lines and line_index is not None:
+            heap = self.slowest.setdefault(name, [])
+            self.count += 1
+            item = (elapsed, self.count, self.in_file, line_index, (line or '').rstrip())
+            if len(heap) < self.slowest_lines:
+                heapq.heappush(heap, item)
+            elif elapsed > heap[0][0]:
+                heapq.heapreplace(heap, item)
+
+    def to_dict(self):
+        """Export the recorded stages.
+
+        Returns:
+            dict: Calls and seconds per stage, and the slowest lines per stage if requested.
+        """
+        result = {'stages': {}}
+        for name in self.calls:
+            result['stages'][name] = {'calls': self.calls[name], 'seconds': round(self.seconds[name], 6)}
+        if self.slowest_lines:
+            result['slowest_lines'] = {}
+            for name, heap in self.slowest.items():
+                result['slowest_lines'][name] = [
+                    {'seconds': round(elapsed, 6), 'in_file': in_file, 'line_index': line_index, 'line': line}
+                    for elapsed, _, in_file, line_index, line in sorted(heap, reverse=True)]
+        return result
+
+    def save_json(self, out_file):
+        """Save the recorded stages as JSON.
+
+        Args:
+            out_file (str): Output JSON file path.
+        """
+        with open(out_file, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def dump_stats(self, out_file):
+        """Save the recorded stages in the cProfile stats format, which can be loaded with pstats.Stats or snakeviz.
+
+        Args:
+            out_file (str): Output stats file path.
+        """
+        stats = {}
+        for name in self.calls:
+            key = (os.path.basename(__file__), 0, name)
+            stats[key] = (self.calls[name], self.calls[name], self.seconds[name], self.seconds[name], {})
+        with open(out_file, 'wb') as f:
+            marshal.dump(stats, f)
+
+
+class NullProfiler(ConverterProfiler):
+    """Profiler that records nothing, used when js_to_python() is not profiled."""
+
+    @contextlib.contextmanager
+    def stage(self, name, line_index=None, line=None):
+        yield
+
+    def record(self, name, start_time, line_index=None, line=None):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+def next_line(lines, index):
+    """Get the line after a line, or '' after the last line. Works on lists and on a LineStream."""
+    try:
+        return lines[index+1]
+    except IndexError:
+        return ''
+
+
+def rewrite_js_lines(header, lines, brackets, profiler=None):
+    """Rewrite JavaScript lines (after check_map_functions) as Python, yielding the output in pieces.
+
+    Trailing whitespace is held back until a non-blank line follows, because a line starting with '.' is
+    joined to the previous line after stripping it. Pieces therefore do not always end at line breaks.
+
+    Args:
+        header (str): Text written before the script, e.g. the import statements.
+        lines (list): List of lines returned by check_map_functions(), or a LineStream of them.
+        brackets (ScanningBracketIndex): Bracket index over lines.
+        profiler (ConverterProfiler, optional): Profiler recording the time spent in each rewrite stage. Defaults to None.
+
+    Yields:
+        str: Pieces of the Python script.
+    """
+    if profiler is None:
+        profiler = NULL_PROFILER
+    # Stages are timed with explicit record() calls, skipped entirely when profiling is off.
+    timed = not isinstance(profiler, NullProfiler)
+    clock = time.perf_counter
+
+    text = header + "\n"
+    stripped = text.rstrip()
+    if stripped:
+        yield stripped
+    pending = text[len(stripped):]
+
+    for index, line in enumerate(lines):
+
+        if timed:
+            start_time, stage_line = clock(), line
+        if ('/* color' in line) and ('*/' in line):
+            line = line[:line.index('/*')].lstrip() + line[(line.index('*/')+2):]
+        if timed:
+            profiler.record('comments', start_time, index, stage_line)
+
+        if ("= function" in line) or ("=function" in line) or line.strip().startswith("function"):
+            if timed:
+                start_time, stage_line = clock(), line
+            bracket_index = line.index("{")
+            matching_line_index, matching_char_index = brackets.find(index, bracket_index)
+
+            line = line[:bracket_index] + line[bracket_index+1:]
+            if matching_line_index == index:
+                line = line[:matching_char_index] + \
+                    line[matching_char_index+1:]
+            else:
+                brackets.remove_char(matching_line_index, matching_char_index)
+
+            line = line.replace(" = function", "").replace(
+                "=function", '').replace("function ", '')
+            line = " " * (len(line) - len(line.lstrip())) + "def " + line.strip() + ":"
+            if timed:
+                profiler.record('function_hoisting', start_time, index, stage_line)
+        elif "{" in line:
+            if timed:
+                start_time, stage_line = clock(), line
+            block_stage = 'blocks'
+            bracket_index = line.index("{")
+            matching_line_index, matching_char_index = brackets.find(index, bracket_index)
+            if (matching_line_index == index) and (':' in line):
+                pass
+            elif ('for (' in line) or ('for(' in line):
+                block_stage = 'for_loops'
+                line = convert_for_loop(line)
+                brackets.set_line(index, line)
+                bracket_index = line.index("{")
+                matching_line_index, matching_char_index = brackets.find(index, bracket_index)
+                brackets.remove_char(matching_line_index, matching_char_index)
+                line = line.replace('{', '')
+            if timed:
+                profiler.record(block_stage, start_time, index, stage_line)
+
+        if line is None:
+            line = ''
+
+        if timed:
+            start_time, stage_line = clock(), line
+        line = line.replace("//", "#")
+        line = line.replace("var ", "", 1)
+        line = line.replace("/*", '#')
+        line = line.replace("*/", '#')
+        line = line.replace("true", "True").replace("false", "False")
+        line = line.replace("null", "{}")
+        line = line.replace(".or", ".Or")
+        line = line.replace(".and", '.And')
+        line = line.replace(".not", '.Not')
+        line = line.replace('visualize({', 'visualize(**{')
+        line = line.replace('Math.PI', 'math.pi')
+        line = line.replace('Math.', 'math.')
+        line = line.replace('= new', '=')
+        line = line.rstrip()
+
+        if line.endswith("+"):
+            line = line + " \\"
+        elif line.endswith(";"):
+            line = line[:-1]             
+        
+        if line.lstrip().startswith('*'):
+            line = line.replace('*', '#')
+        if timed:
+            profiler.record('replacements', start_time, index, stage_line)
+
+        if (":" in line) and (not line.strip().startswith("#")) and (not line.strip().startswith('def')) and (not line.strip().startswith(".")):
+            if timed:
+                start_time, stage_line = clock(), line
+            line = format_params(line)
+            if timed:
+                profiler.record('format_params', start_time, index, stage_line)
+
+        if timed:
+            start_time, stage_line = clock(), line
+        if line.lstrip().startswith("#") and next_line(lines, index).lstrip().startswith("."):
+            line = ''               
+
+        if line.lstrip().startswith("."):
+            if "#" in line:
+                line = line[:line.index("#")]
+            # Continuation lines are joined to the previous line, dropping the whitespace held back.
+            pending = ''
+            text = " " + "\\" + "\n" + line + "\n"
+        else:
+            text = line + "\n"
+
+        stripped = text.rstrip()
+        if timed:
+            profiler.record('output', start_time, index, stage_line)
+        if stripped:
+            yield pending + stripped
+            pending = text[len(stripped):]
+        else:
+            pending += text
+
+    yield pending
 
 
 # Convert GEE JavaScripts to Python
-def js_to_python(in_file, out_file=None, use_qgis=True, github_repo=None):
+def ee_invocation(name, **arguments):
+    """Model an Earth Engine function invocation as it is serialized in a request.
+
+    Args:
+        name (str): Name of the Earth Engine algorithm.
+        **arguments: Serialized arguments of the invocation.
+
+    Returns:
+        dict: Serialized invocation.
+    """
+    return {'functionInvocationValue': {'functionName': name, 'arguments': arguments}}
+
+
+def ee_function(argument_names, body):
+    """Model an Earth Engine function definition (e.g. the algorithm of a map) as it is serialized in a request.
+
+    Args:
+        argument_names (list): Names of the function arguments.
+        body (dict): Serialized function body.
+
+    Returns:
+        dict: Serialized function definition.
+    """
+    return {'functionDefinitionValue': {'argumentNames': argument_names, 'body': body}}
+
+
+def serialized_size(value):
+    """Get the size of a serialized Earth Engine expression.
+
+    Args:
+        value (dict): Serialized expression, see ee_invocation().
+
+    Returns:
+        int: Size of the compact JSON encoding in bytes.
+    """
+    return len(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+
+
+def point_feature(node):
+    """Get the coordinates and properties of an ee.Feature(ee.Geometry.Point([x, y]), {...}) literal.
+
+    Args:
+        node (ast.AST): Python expression.
+
+    Returns:
+        tuple: The [x, y] coordinates and the dict of properties, or None if the expression is not a point feature with literal coordinates and properties.
+    """
+    if not isinstance(node, ast.Call) or ast.unparse(node.func) != 'ee.Feature' or node.keywords or len(node.args) not in (1, 2):
+        return None
+    geometry = node.args[0]
+    if not isinstance(geometry, ast.Call) or ast.unparse(geometry.func) != 'ee.Geometry.Point' or geometry.keywords:
+        return None
+
+    try:
+        coords = [ast.literal_eval(arg) for arg in geometry.args]
+        properties = ast.literal_eval(node.args[1]) if len(node.args) == 2 else {}
+    except (ValueError, TypeError, SyntaxError):
+        return None
+
+    if len(coords) == 1:
+        coords = coords[0]
+    if not isinstance(coords, (list, tuple)) or len(coords) != 2 or \
+            not all(isinstance(c, (int, float)) and not isinstance(c, bool) for c in coords):
+        return None
+    if not isinstance(properties, dict) or not all(isinstance(key, str) for key in properties):
+        return None
+    return list(coords), properties
+
+
+def wrap_items(items, indent, width=100):
+    """Wrap the items of a Python list or dict literal over several lines.
+
+    Args:
+        items (list): Source code of the items.
+        indent (str): Indentation of the lines.
+        width (int, optional): Maximum line length, unless a single item is longer. Defaults to 100.
+
+    Returns:
+        str: Lines of items separated by commas, without a trailing newline.
+    """
+    lines = []
+    line = ''
+    for item in items:
+        if line and len(indent) + len(line) + len(item) + 2 > width:
+            lines.append(indent + line.rstrip())
+            line = ''
+        line += item + ', '
+    if line:
+        lines.append(indent + line.rstrip().rstrip(','))
+    return '\n'.join(lines)
+
+
+def compact_point_features(features, indent):
+    """Rewrite homogeneous point features into a columnar ee.FeatureCollection built with one server-side map.
+
+    The coordinates and every property that differs between the features are sent as constant arrays, and the
+    features are built on the server by mapping over their indices. Properties shared by all features are set once.
+
+    Args:
+        features (list): Coordinates and properties of the features, see point_feature().
+        indent (str): Indentation of the line where the collection starts.
+
+    Returns:
+        tuple: Python source of the collection, and the serialized sizes of the original and compact expressions in bytes.
+    """
+    coordinates = [coords for coords, _ in features]
+    columns = {key: [properties[key] for _, properties in features] for key in features[0][1]}
+    constants = {key: values[0] for key, values in columns.items() if all(value == values[0] for value in values)}
+    columns = {key: values for key, values in columns.items() if key not in constants}
+
+    original = ee_invocation('Collection', features={'arrayValue': {'values': [
+        ee_invocation('Feature',
+                      geometry=ee_invocation('GeometryConstructors.Point', coordinates={'constantValue': coords}),
+                      metadata={'constantValue': properties})
+        for coords, properties in features]}})
+
+    index = {'argumentReference': '_MAPPING_VAR_1_0'}
+    metadata = {'constantValue': constants}
+    if columns:
+        metadata = ee_invocation('Dictionary.map', dictionary={'constantValue': columns}, baseAlgorithm=ee_function(
+            ['_MAPPING_VAR_0_0', '_MAPPING_VAR_0_1'],
+            ee_invocation('List.get', list={'argumentReference': '_MAPPING_VAR_0_1'}, index=index)))
+        if constants:
+            metadata = ee_invocation('Dictionary.combine', first=metadata, second={'constantValue': constants})
+    compact = ee_invocation('Collection', features=ee_invocation(
+        'List.map',
+        list=ee_invocation('List.sequence', start={'constantValue': 0}, end={'constantValue': len(features) - 1}),
+        baseAlgorithm=ee_function(['_MAPPING_VAR_1_0'], ee_invocation(
+            'Feature',
+            geometry=ee_invocation('GeometryConstructors.Point', coordinates=ee_invocation(
+                'List.get', list={'constantValue': coordinates}, index=index)),
+            metadata=metadata))))
+
+    inner = indent + ' ' * 8
+    source = 'ee.FeatureCollection(ee.List.sequence(0, {}).map(lambda i: ee.Feature(\n'.format(len(features) - 1)
+    source += indent + '    ee.Geometry.Point(ee.List([\n'
+    source += wrap_items([repr(coords) for coords in coordinates], inner) + '\n'
+    source += indent + '    ]).get(i)),\n'
+    if columns:
+        source += indent + '    ee.Dictionary({\n'
+        for key, values in columns.items():
+            source += inner + repr(key) + ': [\n'
+            source += wrap_items([repr(value) for value in values], inner + '    ') + '\n'
+            source += inner + '],\n'
+        source += indent + '    }).map(lambda key, values: ee.List(values).get(i))'
+        if constants:
+            source += '.combine({})'.format(repr(constants))
+    else:
+        source += indent + '    ' + repr(constants)
+    source += ')))'
+
+    return source, serialized_size(original), serialized_size(compact)
+
+
+def compact_feature_literals(source, min_features=10):
+    """Rewrite inline ee.FeatureCollection literals of point features into a compact columnar form.
+
+    Code Editor imports such as the training points of Demos/Classification.js become one ee.Feature(ee.Geometry.Point(...), {...})
+    expression per point, and the whole expression graph is uploaded with every request that uses the collection.
+    Collections whose features all have literal point coordinates and the same property names are rewritten by
+    compact_point_features(). The serialized sizes are estimated from the expression graph the Earth Engine API sends.
+
+    Args:
+        source (str): Python script.
+        min_features (int, optional): Minimum number of features of the collections to rewrite. Defaults to 10.
+
+    Returns:
+        tuple: The rewritten script, and a list of dicts with the 'line', number of 'features', 'original_bytes' and 'compact_bytes' of each rewritten collection.
+    """
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return source, []
+
+    lines = source.splitlines(keepends=True)
+    starts = [0]
+    for line in lines:
+        starts.append(starts[-1] + len(line))
+
+    def offset(lineno, col_offset):   # ast column offsets count UTF-8 bytes
+        return starts[lineno - 1] + len(lines[lineno - 1].encode('utf-8')[:col_offset].decode('utf-8'))
+
+    replacements = []
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call) or ast.unparse(node.func) != 'ee.FeatureCollection' or node.keywords or \
+                len(node.args) != 1 or not isinstance(node.args[0], ast.List) or len(node.args[0].elts) < min_features:
+            continue
+        features = [point_feature(element) for element in node.args[0].elts]
+        if any(feature is None for feature in features) or \
+                any(properties.keys() != features[0][1].keys() for _, properties in features):
+            continue
+
+        line = lines[node.lineno - 1]
+        indent = line[:len(line) - len(line.lstrip())]
+        compact, original_bytes, compact_bytes = compact_point_features(features, indent)
+        if compact_bytes >= original_bytes:
+            continue
+        replacements.append((offset(node.lineno, node.col_offset), offset(node.end_lineno, node.end_col_offset), compact, {
+            'line': node.lineno, 'features': len(features), 'original_bytes': original_bytes, 'compact_bytes': compact_bytes}))
+
+    report = []
+    for start, end, compact, entry in sorted(replacements, key=lambda replacement: replacement[0], reverse=True):
+        source = source[:start] + compact + source[end:]
+        report.insert(0, entry)
+    return source, report
+
+
+def read_lines(in_file):
+    """Read the lines of a file one at a time.
+
+    Args:
+        in_file (str): Input file path.
+
+    Yields:
+        str: Lines of the file.
+    """
+    with open(in_file) as f:
+        for line in f:
+            yield line
+
+
+def stream_map_functions(in_file):
+    """Extract Earth Engine map functions from a JavaScript file while reading it, see check_map_functions().
+
+    Args:
+        in_file (str): File path of the input JavaScript.
+
+    Returns:
+        generator: Output JavaScript lines with map functions.
+    """
+    lines = LineStream(read_lines(in_file))
+    return iter_map_functions(lines, StreamBracketIndex(lines))
+
+
+def replace_if_changed(tmp_file, out_file, force=False):
+    """Move a temporary file over the output file, unless the output file already has the same content.
+
+    Args:
+        tmp_file (str): Temporary file path. It is removed in either case.
+        out_file (str): Output file path.
+        force (bool, optional): Whether to replace the output file even if its content is unchanged. Defaults to False.
+
+    Returns:
+        bool: True if the output file was replaced.
+    """
+    if not force and os.path.isfile(out_file) and filecmp.cmp(tmp_file, out_file, shallow=False):
+        os.remove(tmp_file)
+        return False
+    os.replace(tmp_file, out_file)
+    return True
+
+
+def stream_js_to_python(in_file, out_file, header, force=False, profiler=None):
+    """Convert an Earth Engine JavaScript to Python script while reading it, writing the output as it is produced.
+
+    The script is read once: map functions are extracted from the lines as they are read, and the extracted lines
+    are converted as they are produced. Bracket lookups scan ahead to the matching bracket, so memory holds a window
+    of lines as long as the longest function or block body, and nothing for the rest of the script.
+
+    Args:
+        in_file (str): File path of the input JavaScript.
+        out_file (str): File path of the output Python script.
+        header (str): Text written before the script, e.g. the import statements.
+        force (bool, optional): Whether to rewrite the output file even if its content is unchanged. Defaults to False.
+        profiler (ConverterProfiler, optional): Profiler recording the time spent in each rewrite stage. Defaults to None.
+
+    Raises:
+        StreamFallback: If the script cannot be converted as a stream. The output file is left untouched.
+    """
+    if profiler is None:
+        profiler = NULL_PROFILER
+
+    brackets = StreamBracketIndex(LineStream(stream_map_functions(in_file)))
+
+    out_dir = os.path.dirname(os.path.abspath(out_file))
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    tmp_file = out_file + '.tmp'
+    try:
+        with open(tmp_file, 'w') as f:
+            for piece in rewrite_js_lines(header, brackets.lines, brackets, profiler):
+                f.write(piece)
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+
+    with profiler.stage('write'):
+        replace_if_changed(tmp_file, out_file, force)
+
+
+def js_to_python(in_file, out_file=None, use_qgis=True, github_repo=None, engine='index', force=False, profiler=None,
+                 stream=False, compact_literals=False):
     """Convert an Earth Engine JavaScript to Python script.
 
     Args:
@@ -284,11 +1242,21 @@ def js_to_python(in_file, out_file=None, use_qgis=True, github_repo=None):
         out_file (str, optional): File path of the output Python script. Defaults to None.
         use_qgis (bool, optional): Whether to add "from ee_plugin import Map \n" to the output script. Defaults to True.
         github_repo (str, optional): GitHub repo url. Defaults to None.
+        engine (str, optional): Conversion engine, either 'index' (tokenize once) or 'legacy' (rescan for every bracket). Both produce the same output. Defaults to 'index'.
+        force (bool, optional): Whether to rewrite the output file even if its content is unchanged. Defaults to False.
+        profiler (ConverterProfiler, optional): Profiler recording the time spent in each rewrite stage. Defaults to None.
+        stream (bool, optional): Whether to convert the script while reading it and write the output incrementally, for very large scripts. Scripts that cannot be streamed are converted in memory. Defaults to False.
+        compact_literals (bool, optional): Whether to rewrite inline FeatureCollection literals of point features into a compact columnar form, see compact_feature_literals(). The script is converted in memory. Defaults to False.
 
     Returns:
-        list : Python script
+        list : Python script, or None if stream is True.
 
     """
+    if profiler is None:
+        profiler = NULL_PROFILER
+    if engine not in ENGINES:
+        raise ValueError("The engine must be one of the following: {}".format(', '.join(ENGINES.keys())))
+
     if out_file is None:
         out_file = in_file.replace(".js", ".py")
 
@@ -297,6 +1265,7 @@ def js_to_python(in_file, out_file=None, use_qgis=True, github_repo=None):
         in_file = os.path.join(root_dir, in_file)
     if not os.path.isfile(out_file):
         out_file = os.path.join(root_dir, out_file)
+    profiler.in_file = str(in_file)
 
     is_python = False
     add_github_url = False
@@ -311,6 +1280,29 @@ def js_to_python(in_file, out_file=None, use_qgis=True, github_repo=None):
     math_import = False
     math_import_str = ""
 
+    if stream and not compact_literals:
+        for line in read_lines(in_file):
+            math_import = math_import or 'Math.' in line
+            is_python = is_python or line.strip() == 'import ee'
+        math_import_str = "import math\n" if math_import else ""
+        header = github_url + "import ee \n" + qgis_import_str + math_import_str
+        if is_python:
+            tmp_file = out_file + '.tmp'
+            with open(tmp_file, 'w') as f:
+                f.write(github_url)
+                f.writelines(read_lines(in_file))
+            replace_if_changed(tmp_file, out_file, force)
+            return None
+
+        print('Processing {}'.format(in_file))
+        try:
+            stream_js_to_python(in_file, out_file, header, force, profiler)
+            return None
+        except StreamFallback as e:
+            print('Converting {} in memory: {}'.format(in_file, e))
+            js_to_python(in_file, out_file, use_qgis, github_repo, engine, force, profiler)
+            return None
+
     lines = []
     with open(in_file) as f:
         lines = f.readlines()
@@ -335,99 +1327,106 @@ def js_to_python(in_file, out_file=None, use_qgis=True, github_repo=None):
         function_defs = []
         output = header + "\n"
 
-        with open(in_file) as f:
-            lines = f.readlines()
+        with profiler.stage('read'):
+            with open(in_file) as f:
+                lines = f.readlines()
 
-            print('Processing {}'.format(in_file))
-            lines = check_map_functions(lines)
+        print('Processing {}'.format(in_file))
+        with profiler.stage('check_map_functions'):
+            lines = check_map_functions(lines, ENGINES[engine](lines))
+        with profiler.stage('bracket_index'):
+            brackets = ENGINES[engine](lines)
 
-            for index, line in enumerate(lines):
+        output = ''.join(rewrite_js_lines(header, lines, brackets, profiler))
 
-                if ('/* color' in line) and ('*/' in line):
-                    line = line[:line.index('/*')].lstrip() + line[(line.index('*/')+2):]
-                
-                if ("= function" in line) or ("=function" in line) or line.strip().startswith("function"):
-                    bracket_index = line.index("{")
-                    matching_line_index, matching_char_index = find_matching_bracket(
-                        lines, index, bracket_index)
+        if compact_literals:
+            with profiler.stage('compact_literals'):
+                output, report = compact_feature_literals(output)
+            if report:
+                original_bytes = sum(entry['original_bytes'] for entry in report)
+                compact_bytes = sum(entry['compact_bytes'] for entry in report)
+                print('Compacted {} feature collection(s) of {} features: {} -> {} serialized bytes ({} saved)'.format(
+                    len(report), sum(entry['features'] for entry in report), original_bytes, compact_bytes,
+                    original_bytes - compact_bytes))
 
-                    line = line[:bracket_index] + line[bracket_index+1:]
-                    if matching_line_index == index:
-                        line = line[:matching_char_index] + \
-                            line[matching_char_index+1:]
-                    else:
-                        tmp_line = lines[matching_line_index]
-                        lines[matching_line_index] = tmp_line[:matching_char_index] + \
-                            tmp_line[matching_char_index+1:]
-
-                    line = line.replace(" = function", "").replace(
-                        "=function", '').replace("function ", '')
-                    line = " " * (len(line) - len(line.lstrip())) + "def " + line.strip() + ":"
-                elif "{" in line:
-                    bracket_index = line.index("{")
-                    matching_line_index, matching_char_index = find_matching_bracket(
-                        lines, index, bracket_index)
-                    if (matching_line_index == index) and (':' in line):
-                        pass
-                    elif ('for (' in line) or ('for(' in line):
-                        line = convert_for_loop(line)
-                        lines[index] = line
-                        bracket_index = line.index("{")
-                        matching_line_index, matching_char_index = find_matching_bracket(lines, index, bracket_index)
-                        tmp_line = lines[matching_line_index]
-                        lines[matching_line_index] = tmp_line[:matching_char_index] + tmp_line[matching_char_index+1:]
-                        line = line.replace('{', '')
-
-                if line is None:
-                    line = ''
-
-                line = line.replace("//", "#")
-                line = line.replace("var ", "", 1)
-                line = line.replace("/*", '#')
-                line = line.replace("*/", '#')
-                line = line.replace("true", "True").replace("false", "False")
-                line = line.replace("null", "{}")
-                line = line.replace(".or", ".Or")
-                line = line.replace(".and", '.And')
-                line = line.replace(".not", '.Not')
-                line = line.replace('visualize({', 'visualize(**{')
-                line = line.replace('Math.PI', 'math.pi')
-                line = line.replace('Math.', 'math.')
-                line = line.replace('= new', '=')
-                line = line.rstrip()
-
-                if line.endswith("+"):
-                    line = line + " \\"
-                elif line.endswith(";"):
-                    line = line[:-1]             
-                
-                if line.lstrip().startswith('*'):
-                    line = line.replace('*', '#')
-
-                if (":" in line) and (not line.strip().startswith("#")) and (not line.strip().startswith('def')) and (not line.strip().startswith(".")):
-                    line = format_params(line)
-
-                if index < (len(lines) - 1) and line.lstrip().startswith("#") and lines[index+1].lstrip().startswith("."):
-                    line = ''               
-
-                if line.lstrip().startswith("."):
-                    if "#" in line:
-                        line = line[:line.index("#")]
-                    output = output.rstrip() + " " + "\\" + "\n" + line + "\n"
-                else:
-                    output += line + "\n"
+    with profiler.stage('write'):
+        write_text(out_file, output, force)
+
+    return output
+
+
+def file_hash(in_file):
+    """Compute the SHA-256 hash of a file.
+
+    Args:
+        in_file (str): Input file path.
+
+    Returns:
+        str: Hex digest of the file content.
+    """
+    sha = hashlib.sha256()
+    with open(in_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def conversion_key(in_file, use_qgis=True, github_repo=None, compact_literals=False):
+    """Compute the manifest key of a conversion from the input content, the converter options and CONVERTER_VERSION.
+
+    Args:
+        in_file (str): File path of the input JavaScript.
+        use_qgis (bool, optional): Whether to add "from ee_plugin import Map \n" to the output script. Defaults to True.
+        github_repo (str, optional): GitHub repo url. Defaults to None.
+        compact_literals (bool, optional): Whether feature literals are compacted. Defaults to False.
+
+    Returns:
+        str: Hex digest identifying the conversion.
+    """
+    params = [file_hash(in_file), str(in_file), bool(use_qgis), github_repo, CONVERTER_VERSION]
+    if compact_literals:
+        params.append('compact_literals')
+    return hashlib.sha256(json.dumps(params).encode('utf-8')).hexdigest()
+
+
+def read_manifest(manifest_file):
+    """Read a conversion manifest.
 
-    out_dir = os.path.dirname(out_file)
+    Args:
+        manifest_file (str): File path of the manifest.
+
+    Returns:
+        dict: Manifest entries keyed by output file path. Empty if the manifest does not exist or cannot be read.
+    """
+    if not os.path.isfile(manifest_file):
+        return {}
+    try:
+        with open(manifest_file) as f:
+            return json.load(f)
+    except ValueError:
+        print('Ignoring invalid manifest: {}'.format(manifest_file))
+        return {}
+
+
+def write_manifest(manifest_file, manifest):
+    """Write a conversion manifest, replacing the old one atomically.
+
+    Args:
+        manifest_file (str): File path of the manifest.
+        manifest (dict): Manifest entries keyed by output file path.
+    """
+    out_dir = os.path.dirname(os.path.abspath(manifest_file))
     if not os.path.exists(out_dir):
         os.makedirs(out_dir)
 
-    with open(out_file, 'w') as f:
-        f.write(output)
+    tmp_file = manifest_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_file, manifest_file)
 
-    return output
 
-
-def js_to_python_dir(in_dir, out_dir=None, use_qgis=True, github_repo=None):
+def js_to_python_dir(in_dir, out_dir=None, use_qgis=True, github_repo=None, engine='index', processes=1,
+                     incremental=False, manifest_file=None, profiler=None, stream=False, compact_literals=False):
     """Convert all Earth Engine JavaScripts in a folder recursively to Python scripts
 
     Args:
@@ -435,16 +1434,58 @@ def js_to_python_dir(in_dir, out_dir=None, use_qgis=True, github_repo=None):
         out_dir (str, optional): The output folder containing Earth Engine Python scripts. Defaults to None.
         use_qgis (bool, optional): Whether to add "from ee_plugin import Map \n" to the output script. Defaults to True.
         github_repo (str, optional): GitHub repo url. Defaults to None.
+        engine (str, optional): Conversion engine, either 'index' or 'legacy'. Defaults to 'index'.
+        processes (int, optional): Number of worker processes. Use None for one per CPU. Defaults to 1, which converts the files serially.
+        incremental (bool, optional): Whether to skip files whose input, options and converter version are unchanged since the last run. Defaults to False.
+        manifest_file (str, optional): File path of the manifest used by incremental runs. Defaults to None, which uses MANIFEST_FILE in out_dir.
+        profiler (ConverterProfiler, optional): Profiler accumulating the rewrite stages of all files. Profiled runs convert the files serially. Defaults to None.
+        stream (bool, optional): Whether to convert each script while reading it, see js_to_python(). Defaults to False.
+        compact_literals (bool, optional): Whether to compact inline FeatureCollection literals, see js_to_python(). Defaults to False.
 
+    Returns:
+        list: File paths of the Python scripts that were (re)converted.
     """
     if out_dir is None:
         out_dir = in_dir
+    if manifest_file is None:
+        manifest_file = os.path.join(out_dir, MANIFEST_FILE)
+
+    manifest = read_manifest(manifest_file) if incremental else {}
 
+    jobs = []
     for in_file in Path(in_dir).rglob('*.js'):
         out_file = os.path.splitext(in_file)[0] + ".py"
         out_file = out_file.replace(in_dir, out_dir)
-        js_to_python(in_file, out_file, use_qgis, github_repo)
+        key = conversion_key(in_file, use_qgis, github_repo, compact_literals)
+        entry = manifest.get(out_file)
+        if incremental and entry is not None and entry['key'] == key and os.path.isfile(out_file):
+            continue
+        jobs.append((str(in_file), out_file, key))
+
+    converted = []
+    try:
+        if processes == 1 or len(jobs) < 2 or profiler is not None:
+            for in_file, out_file, key in jobs:
+                js_to_python(in_file, out_file, use_qgis, github_repo, engine, profiler=profiler, stream=stream,
+                             compact_literals=compact_literals)
+                manifest[out_file] = {'in_file': in_file, 'key': key}
+                converted.append(out_file)
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                futures = [(executor.submit(js_to_python, in_file, out_file, use_qgis, github_repo, engine, stream=stream,
+                                           compact_literals=compact_literals), in_file, out_file, key)
+                           for in_file, out_file, key in jobs]
+                for future, in_file, out_file, key in futures:
+                    future.result()
+                    manifest[out_file] = {'in_file': in_file, 'key': key}
+                    converted.append(out_file)
+    finally:
+        # Record the files converted so far, so an interrupted run does not redo them.
+        if incremental:
+            write_manifest(manifest_file, manifest)
+
     # print("Ouput Python script folder: {}".format(out_dir))
+    return converted
 
 
 # def dict_key_str(line):
@@ -485,6 +1526,34 @@ def remove_qgis_import(in_file):
                         i = i + 1
 
 
+@functools.lru_cache(maxsize=8)
+def read_template(in_template, mtime=None):
+    """Read the lines of a notebook template. Results are cached per template file and modification time.
+
+    Args:
+        in_template (str): Input notebook template file path.
+        mtime (float, optional): Modification time of the template, used to invalidate the cache. Defaults to None.
+
+    Returns:
+        tuple: Tuple of lines.
+    """
+    with open(in_template) as f:
+        return tuple(f.readlines())
+
+
+def template_lines(in_template):
+    """Read the lines of a notebook template, reusing the cached copy if the file has not changed.
+
+    Args:
+        in_template (str): Input notebook template file path.
+
+    Returns:
+        tuple: Tuple of lines.
+    """
+    in_template = str(in_template)
+    return read_template(in_template, os.path.getmtime(in_template))
+
+
 def template_header(in_template):
     """Extract header from the notebook template.
     
@@ -495,16 +1564,14 @@ def template_header(in_template):
         list: List of lines.
     """    
     header = []
-    template_lines = []
     header_end_index = 0
 
-    with open(in_template) as f:
-        template_lines = f.readlines()
-        for index, line in enumerate(template_lines):
-           if '## Add Earth Engine Python script' in line:
-                header_end_index = index + 5
+    template = template_lines(in_template)
+    for index, line in enumerate(template):
+        if '## Add Earth Engine Python script' in line:
+            header_end_index = index + 5
 
-    header = template_lines[:header_end_index]
+    header = list(template[:header_end_index])
 
     return header
 
@@ -519,21 +1586,283 @@ def template_footer(in_template):
         list: List of lines.
     """    
     footer = []
-    template_lines = []
     footer_start_index = 0
 
-    with open(in_template) as f:
-        template_lines = f.readlines()
-        for index, line in enumerate(template_lines):
-            if '## Display Earth Engine data layers' in line:
-                footer_start_index = index - 3
+    template = template_lines(in_template)
+    for index, line in enumerate(template):
+        if '## Display Earth Engine data layers' in line:
+            footer_start_index = index - 3
 
-    footer = ['\n'] + template_lines[footer_start_index:]
+    footer = ['\n'] + list(template[footer_start_index:])
 
     return footer
 
 
-def py_to_ipynb(in_file, template_file, out_file=None, github_username=None, github_repo=None):
+# Cell marker and separator used by the percent format that ipynb-py-convert reads.
+CELL_HEADER = '# %%\n'
+CELL_SEPARATOR = '\n\n' + CELL_HEADER
+
+
+def new_cell(chunk):
+    """Create a notebook cell from a chunk of a percent-format script. Triple-quoted chunks become markdown cells.
+
+    Args:
+        chunk (str): Source of the cell.
+
+    Returns:
+        dict: Notebook cell.
+    """
+    cell_type = 'code'
+    if chunk.startswith("'''"):
+        chunk = chunk.strip("'\n")
+        cell_type = 'markdown'
+    elif chunk.startswith('"""'):
+        chunk = chunk.strip('"\n')
+        cell_type = 'markdown'
+
+    cell = {
+        'cell_type': cell_type,
+        'metadata': {},
+        'source': chunk.splitlines(True),
+    }
+    if cell_type == 'code':
+        cell.update({'outputs': [], 'execution_count': None})
+
+    return cell
+
+
+def new_notebook(cells):
+    """Create a notebook with the same metadata as ipynb-py-convert.
+
+    Args:
+        cells (list): List of notebook cells.
+
+    Returns:
+        dict: Notebook.
+    """
+    return {
+        'cells': cells,
+        'metadata': {
+            'anaconda-cloud': {},
+            'kernelspec': {
+                'display_name': 'Python 3',
+                'language': 'python',
+                'name': 'python3'},
+            'language_info': {
+                'codemirror_mode': {'name': 'ipython', 'version': 3},
+                'file_extension': '.py',
+                'mimetype': 'text/x-python',
+                'name': 'python',
+                'nbconvert_exporter': 'python',
+                'pygments_lexer': 'ipython3',
+                'version': '3.6.1'}},
+        'nbformat': 4,
+        'nbformat_minor': 4
+    }
+
+
+def script_to_notebook(py_str):
+    """Convert a percent-format Python script to a notebook, the same way ipynb-py-convert does.
+
+    Args:
+        py_str (str): Content of the script.
+
+    Returns:
+        dict: Notebook.
+    """
+    if py_str.startswith(CELL_HEADER):
+        py_str = py_str[len(CELL_HEADER):]
+    return new_notebook([new_cell(chunk) for chunk in py_str.split(CELL_SEPARATOR)])
+
+
+def notebook_sources(notebook):
+    """Get the type and source of every cell, ignoring outputs and metadata added when a notebook is executed.
+
+    Args:
+        notebook (dict): Notebook.
+
+    Returns:
+        list: List of (cell_type, source) tuples.
+    """
+    return [(cell.get('cell_type'), ''.join(cell.get('source', ''))) for cell in notebook.get('cells', [])]
+
+
+def write_notebook(notebook, out_file, force=False):
+    """Write a notebook to an .ipynb file.
+
+    The file is left untouched if it already holds the same notebook, including an executed copy of it, so
+    notebooks whose source did not change keep their outputs and do not need to be executed again.
+
+    Args:
+        notebook (dict): Notebook.
+        out_file (str): Output Jupyter notebook.
+        force (bool, optional): Whether to write even if the notebook is unchanged. Defaults to False.
+
+    Returns:
+        bool: True if the file was written.
+    """
+    if not force and os.path.isfile(out_file):
+        try:
+            with open(out_file) as f:
+                if notebook_sources(json.load(f)) == notebook_sources(notebook):
+                    return False
+        except ValueError:
+            pass
+
+    return write_text(out_file, json.dumps(notebook, indent=2), force=True)
+
+
+class NotebookTemplate:
+    """Notebook template parsed once into cells, into which Python scripts are spliced in memory.
+
+    The template header ends inside the 'Add Earth Engine Python script' code cell and the footer starts with the
+    separator of the 'Display Earth Engine data layers' cell, so only the cell holding the script is split per notebook.
+    The result is identical to converting header + script + footer with script_to_notebook().
+
+    Args:
+        template_file (str): Input notebook template file path.
+    """
+
+    def __init__(self, template_file):
+        self.template_file = str(template_file)
+        self.header = template_header(template_file)
+        self.footer = template_footer(template_file)
+
+        header_text = ''.join(self.header)
+        footer_text = ''.join(self.footer)
+        self.spliceable = header_text.startswith(CELL_HEADER) and footer_text.startswith(CELL_SEPARATOR)
+
+        if header_text.startswith(CELL_HEADER):
+            header_text = header_text[len(CELL_HEADER):]
+        header_chunks = header_text.split(CELL_SEPARATOR)
+        self.header_chunks = header_chunks[:-1]
+        self.script_prefix = header_chunks[-1]
+        self.footer_cells = [new_cell(chunk) for chunk in footer_text[len(CELL_SEPARATOR):].split(CELL_SEPARATOR)]
+
+    def build(self, content, replacements=None):
+        """Build a notebook from the lines of a Python script.
+
+        Args:
+            content (list): Lines of the Python script. None adds no script.
+            replacements (list, optional): List of (old, new) string replacements applied to the template header. Defaults to None.
+
+        Returns:
+            dict: Notebook.
+        """
+        script = ''.join(content) if content is not None else ''
+        replacements = replacements or []
+
+        def replace(text):
+            for old, new in replacements:
+                text = text.replace(old, new)
+            return text
+
+        # A separator spanning the end of the script and the footer would split the cells differently.
+        tail = script[-(len(CELL_SEPARATOR) - 1):]
+        if not self.spliceable or CELL_SEPARATOR in tail + CELL_SEPARATOR[:-1]:
+            header = [replace(line) for line in self.header]
+            return script_to_notebook(''.join(header) + script + ''.join(self.footer))
+
+        chunks = [replace(chunk) for chunk in self.header_chunks]
+        chunks.extend((replace(self.script_prefix) + script).split(CELL_SEPARATOR))
+        cells = [new_cell(chunk) for chunk in chunks] + copy.deepcopy(self.footer_cells)
+        return new_notebook(cells)
+
+
+    def script(self, content, replacements=None):
+        """Build the percent-format Python script of a notebook, i.e. the template header, the script and the footer.
+
+        Args:
+            content (list): Lines of the Python script. None adds no script.
+            replacements (list, optional): List of (old, new) string replacements applied to the template header. Defaults to None.
+
+        Returns:
+            str: The percent-format script.
+        """
+        header = []
+        for line in self.header:
+            for old, new in replacements or []:
+                line = line.replace(old, new)
+            header.append(line)
+        return ''.join(header) + (''.join(content) if content is not None else '') + ''.join(self.footer)
+
+
+@functools.lru_cache(maxsize=8)
+def load_notebook_template(template_file, mtime=None):
+    """Parse a notebook template. Results are cached per template file and modification time.
+
+    Args:
+        template_file (str): Input notebook template file path.
+        mtime (float, optional): Modification time of the template, used to invalidate the cache. Defaults to None.
+
+    Returns:
+        NotebookTemplate: The parsed template.
+    """
+    return NotebookTemplate(template_file)
+
+
+def notebook_template(template_file):
+    """Get the parsed notebook template, reusing the cached copy if the file has not changed.
+
+    Args:
+        template_file (str): Input notebook template file path.
+
+    Returns:
+        NotebookTemplate: The parsed template.
+    """
+    template_file = str(template_file)
+    return load_notebook_template(template_file, os.path.getmtime(template_file))
+
+
+def template_replacements(in_file, github_username=None, github_repo=None):
+    """Get the replacements that point the links in the template header to the notebook of a Python script.
+
+    Args:
+        in_file (str): Input Earth Engine Python script. Its path must contain github_repo.
+        github_username (str, optional): GitHub username. Defaults to None.
+        github_repo (str, optional): GitHub repo name. Defaults to None.
+
+    Returns:
+        list: List of (old, new) string replacements. Empty if github_username or github_repo is None.
+    """
+    replacements = []
+    if (github_username is not None) and (github_repo is not None):
+
+        out_py_path = str(in_file).split('/')
+        index = out_py_path.index(github_repo)
+        out_py_relative_path = '/'.join(out_py_path[index+1:])
+        out_ipynb_relative_path = out_py_relative_path.replace('.py', '.ipynb')
+
+        replacements = [('giswqs', github_username),
+                        ('earthengine-py-notebooks', github_repo),
+                        ('Template/template.ipynb', out_ipynb_relative_path)]
+
+    return replacements
+
+
+def py_to_nb_script(in_file, template_file, out_file, github_username=None, github_repo=None, force=False,
+                    link_file=None):
+    """Convert Earth Engine Python script to the percent-format Python script of its notebook.
+
+    Args:
+        in_file (str): Input Earth Engine Python script.
+        template_file (str): Input Jupyter notebook template.
+        out_file (str): Output percent-format Python script.
+        github_username (str, optional): GitHub username. Defaults to None.
+        github_repo (str, optional): GitHub repo name. Defaults to None.
+        force (bool, optional): Whether to rewrite the script even if it is unchanged. Defaults to False.
+        link_file (str, optional): Python script whose notebook the header links point to, e.g. X.py for X_qgis.py. Defaults to None, which uses in_file.
+
+    Returns:
+        bool: True if the script was written, False if it was already up to date.
+    """
+    content = remove_qgis_import(in_file)
+    replacements = template_replacements(link_file or in_file, github_username, github_repo)
+    return write_text(out_file, notebook_template(template_file).script(content, replacements), force)
+
+
+def py_to_ipynb(in_file, template_file, out_file=None, github_username=None, github_repo=None, use_subprocess=False,
+                force=False, link_file=None):
     """Convert Earth Engine Python script to Jupyter notebook.
     
     Args:
@@ -542,30 +1871,35 @@ def py_to_ipynb(in_file, template_file, out_file=None, github_username=None, git
         out_file (str, optional)): Output Jupyter notebook.
         github_username (str, optional): GitHub username. Defaults to None.
         github_repo (str, optional): GitHub repo name. Defaults to None.
+        use_subprocess (bool, optional): Whether to build the notebook by running ipynb-py-convert on a temporary script instead of in memory. Defaults to False.
+        force (bool, optional): Whether to rewrite the notebook even if it is unchanged. Defaults to False.
+        link_file (str, optional): Python script whose notebook the header links point to, e.g. X.py for X_qgis.py. Defaults to None, which uses in_file.
+
+    Returns:
+        bool: True if the notebook was written, False if it was already up to date.
     """    
+    in_file = str(in_file)
     if out_file is None:
         out_file = in_file.replace('.py', '.ipynb')
-    out_py_file = in_file.replace(".py", "_nb.py")
 
     content = remove_qgis_import(in_file)
-    header = template_header(template_file)
-    footer = template_footer(template_file)
 
-    if (github_username is not None) and (github_repo is not None):
+    replacements = template_replacements(link_file or in_file, github_username, github_repo)
 
-        out_py_path = str(in_file).split('/')
-        index = out_py_path.index(github_repo)
-        out_py_relative_path = '/'.join(out_py_path[index+1:])
-        out_ipynb_relative_path = out_py_relative_path.replace('.py', '.ipynb')
+    if not use_subprocess:
+        notebook = notebook_template(template_file).build(content, replacements)
+        return write_notebook(notebook, out_file, force)
 
-        new_header = []
-        for line in header:
-            line = line.replace('giswqs', github_username)
-            line = line.replace('earthengine-py-notebooks', github_repo)
-            line = line.replace('Template/template.ipynb', out_ipynb_relative_path)
+    out_py_file = in_file.replace(".py", "_nb.py")
+    header = template_header(template_file)
+    footer = template_footer(template_file)
 
-            new_header.append(line)
-        header = new_header
+    new_header = []
+    for line in header:
+        for old, new in replacements:
+            line = line.replace(old, new)
+        new_header.append(line)
+    header = new_header
 
     if content != None:
         out_text = header + content + footer 
@@ -586,9 +1920,10 @@ def py_to_ipynb(in_file, template_file, out_file=None, github_username=None, git
         print('pip install ipynb-py-convert')
 
     os.remove(out_py_file)
+    return True
 
 
-def py_to_ipynb_dir(in_dir, template_file, out_dir=None, github_username=None, github_repo=None):
+def py_to_ipynb_dir(in_dir, template_file, out_dir=None, github_username=None, github_repo=None, processes=1):
     """Convert Earth Engine Python scripts in a folder recursively to Jupyter notebooks.
     
     Args:
@@ -597,15 +1932,36 @@ def py_to_ipynb_dir(in_dir, template_file, out_dir=None, github_username=None, g
         out_dir str, optional): Ouput folder. Defaults to None.
         github_username (str, optional): GitHub username. Defaults to None.
         github_repo (str, optional): GitHub repo name. Defaults to None.
+        processes (int, optional): Number of worker processes. Use None for one per CPU. Defaults to 1, which converts the files serially.
+
+    Returns:
+        list: File paths of the notebooks that were written. Unchanged notebooks are left untouched and not listed.
     """    
     files = list(Path(in_dir).rglob('*.py'))
     if out_dir is None:
         out_dir = in_dir
 
+    jobs = []
     for file in files:
         in_file = str(file)
         out_file = in_file.replace(in_dir, out_dir).replace('.py', '.ipynb')
-        py_to_ipynb(in_file, template_file, out_file, github_username, github_repo)
+        jobs.append((in_file, out_file))
+
+    changed = []
+    if processes == 1 or len(jobs) < 2:
+        for in_file, out_file in jobs:
+            if py_to_ipynb(in_file, template_file, out_file, github_username, github_repo):
+                changed.append(out_file)
+    else:
+        # Each worker parses the template once and reuses it for all of its notebooks.
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [(executor.submit(py_to_ipynb, in_file, template_file, out_file, github_username, github_repo), out_file)
+                       for in_file, out_file in jobs]
+            for future, out_file in futures:
+                if future.result():
+                    changed.append(out_file)
+
+    return changed
 
 
 def execute_notebook(in_file):
@@ -618,20 +1974,192 @@ def execute_notebook(in_file):
     print(os.popen(command).read().rstrip())
 
 
-def execute_notebook_dir(in_dir):
+# Code run in every warm kernel at start-up and after its namespace is reset between notebooks.
+KERNEL_PRELOAD = """import ee
+import geemap
+try:
+    ee.Initialize()
+except Exception:
+    pass
+"""
+
+
+class WarmKernelPool:
+    """Pool of Jupyter kernels that stay running between notebooks.
+
+    Each kernel imports ee and geemap once at start-up. Before every notebook its namespace is reset with
+    '%reset -f' and the preload code is run again, which is cheap because the modules are already imported.
+    A kernel whose notebook timed out is restarted before it is reused.
+
+    Args:
+        size (int, optional): Number of kernels. Defaults to 2.
+        kernel_name (str, optional): Name of the Jupyter kernel. Defaults to 'python3'.
+        preload (str, optional): Code run in each kernel after start-up and after each reset. Defaults to KERNEL_PRELOAD.
+        startup_timeout (int, optional): Seconds to wait for a kernel to start. Defaults to 60.
+    """
+
+    def __init__(self, size=2, kernel_name='python3', preload=KERNEL_PRELOAD, startup_timeout=60):
+        try:
+            from jupyter_client import KernelManager
+        except ImportError:
+            print('Please install jupyter_client and nbclient using the following command:\n')
+            print('pip install jupyter_client nbclient')
+            raise
+
+        self.preload = preload
+        self.startup_timeout = startup_timeout
+        self.kernels = queue.Queue()
+        self.managers = []
+
+        for _ in range(size):
+            km = KernelManager(kernel_name=kernel_name)
+            km.start_kernel()
+            kc = km.client()
+            kc.start_channels()
+            kc.wait_for_ready(timeout=startup_timeout)
+            self.managers.append((km, kc))
+            self.reset(kc)
+            self.kernels.put((km, kc))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def reset(self, kc, cwd=None):
+        """Clear the namespace of a kernel and run the preload code.
+
+        Args:
+            kc (jupyter_client.BlockingKernelClient): Client of the kernel.
+            cwd (str, optional): Working directory to switch the kernel to. Defaults to None.
+        """
+        code = '%reset -f\n'
+        if cwd is not None:
+            code += 'import os\nos.chdir({!r})\n'.format(cwd)
+        code += self.preload
+        reply = kc.execute_interactive(code, store_history=False, timeout=self.startup_timeout,
+                                       output_hook=lambda msg: None)
+        if reply['content']['status'] != 'ok':
+            print('Kernel preload failed: {}'.format(reply['content'].get('evalue', '')))
+
+    def execute(self, in_file, timeout=None):
+        """Execute a Jupyter notebook on the next free kernel and save output cells.
+
+        Args:
+            in_file (str): Input Jupyter notebook.
+            timeout (int, optional): Seconds allowed for the whole notebook. Defaults to None, which means no limit.
+
+        Returns:
+            dict: Notebook path, status ('ok', 'error' or 'timeout'), wall time in seconds and error message.
+        """
+        import nbformat
+        from nbclient import NotebookClient
+
+        in_file = str(in_file)
+        cwd = os.path.dirname(os.path.abspath(in_file))
+        km, kc = self.kernels.get()
+        timed_out = threading.Event()
+        timer = None
+        status = 'ok'
+        error = None
+        start_time = time.time()
+
+        def interrupt():
+            timed_out.set()
+            km.interrupt_kernel()
+
+        try:
+            self.reset(kc, cwd)
+            nb = nbformat.read(in_file, as_version=4)
+            client = NotebookClient(nb, km=km, kc=kc, resources={'metadata': {'path': cwd}})
+            if timeout is not None:
+                timer = threading.Timer(timeout, interrupt)
+                timer.start()
+            client.execute()
+            if timer is not None:
+                timer.cancel()
+            if not timed_out.is_set():
+                nbformat.write(nb, in_file)
+        except Exception as e:
+            error = str(e).strip().splitlines()[-1] if str(e).strip() else repr(e)
+            status = 'error'
+        finally:
+            if timer is not None:
+                timer.cancel()
+            if timed_out.is_set():
+                status = 'timeout'
+                error = 'Timed out after {} seconds'.format(timeout)
+                km.restart_kernel(now=True)
+                kc.wait_for_ready(timeout=self.startup_timeout)
+                self.reset(kc)
+            self.kernels.put((km, kc))
+
+        return {
+            'notebook': in_file,
+            'status': status,
+            'wall_time': round(time.time() - start_time, 3),
+            'error': error,
+        }
+
+    def shutdown(self):
+        """Stop all kernels."""
+        for km, kc in self.managers:
+            kc.stop_channels()
+            km.shutdown_kernel(now=True)
+        self.managers = []
+
+
+def execute_notebook_dir(in_dir, kernels=1, timeout=None, summary_file=None, use_subprocess=False, notebooks=None):
     """Execute all Jupyter notebooks in the given directory recursively and save output cells.
     
     Args:
         in_dir (str): Input folder containing notebooks.
+        kernels (int, optional): Number of warm kernels executing notebooks concurrently. Defaults to 1.
+        timeout (int, optional): Seconds allowed for each notebook. Defaults to None, which means no limit.
+        summary_file (str, optional): File path of a JSON summary with the wall time and status of each notebook. Defaults to None.
+        use_subprocess (bool, optional): Whether to run 'jupyter nbconvert --execute' once per notebook instead of using warm kernels. Defaults to False.
+        notebooks (list, optional): Only execute these notebooks, e.g. the ones returned by py_to_ipynb_dir(). Defaults to None, which executes all notebooks in in_dir.
+
+    Returns:
+        dict: Summary of the run. Empty if use_subprocess is True.
     """
-    files = list(Path(in_dir).rglob('*.ipynb'))
+    if notebooks is not None:
+        files = [Path(file) for file in notebooks]
+    else:
+        files = list(Path(in_dir).rglob('*.ipynb'))
     count = len(files)
-    if files is not None:
+
+    if use_subprocess:
         for index, file in enumerate(files):
             in_file = str(file)
             print('Processing {}/{} ...'.format(index+1, count))
             execute_notebook(in_file)
+        return {}
+
+    results = []
+    start_time = time.time()
+    with WarmKernelPool(kernels) as pool, ThreadPoolExecutor(max_workers=kernels) as executor:
+        futures = [executor.submit(pool.execute, str(file), timeout) for file in files]
+        for index, future in enumerate(as_completed(futures)):
+            result = future.result()
+            results.append(result)
+            print('Processed {}/{}: {} ({}, {:.1f}s)'.format(
+                index+1, count, result['notebook'], result['status'], result['wall_time']))
+
+    summary = {
+        'kernels': kernels,
+        'timeout': timeout,
+        'wall_time': round(time.time() - start_time, 3),
+        'failed': sum(1 for result in results if result['status'] != 'ok'),
+        'notebooks': sorted(results, key=lambda result: result['notebook']),
+    }
+
+    if summary_file is not None:
+        with open(summary_file, 'w') as f:
+            json.dump(summary, f, indent=2)
 
+    return summary
 
 
 if __name__ == '__main__':
@@ -646,7 +2174,7 @@ if __name__ == '__main__':
     # Convert all Earth Engine JavaScripts in a folder recursively to Python scripts.
     in_dir = os.path.join(root_dir, "JavaScripts")
     out_dir = os.path.join(root_dir, "JavaScripts")
-    js_to_python_dir(in_dir, out_dir, use_qgis=True)
+    js_to_python_dir(in_dir, out_dir, use_qgis=True, processes=None, incremental=True)
     print("Python scripts saved at: {}".format(out_dir))
 
     # Convert an Earth Engine Python script to Jupyter notebook.
@@ -657,10 +2185,10 @@ if __name__ == '__main__':
 
     # Convert all Earth Engine Python scripts in a folder recursively to Jupyter notebooks.
     in_dir = os.path.join(root_dir, 'JavaScripts')
-    py_to_ipynb_dir(in_dir, in_template, github_username='giswqs', github_repo='earthengine-py-notebooks')
+    changed = py_to_ipynb_dir(in_dir, in_template, github_username='giswqs', github_repo='earthengine-py-notebooks', processes=None)
 
-    # Execute all Jupyter notebooks in a folder recursively and save the output cells.
-    execute_notebook_dir(in_dir)
+    # Execute the Jupyter notebooks that changed and save the output cells.
+    execute_notebook_dir(in_dir, kernels=4, timeout=600, summary_file=os.path.join(in_dir, 'execution_summary.json'), notebooks=changed)
 
 
     # parser = argparse.ArgumentParser()
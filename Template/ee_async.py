@@ -0,0 +1,398 @@
+''' Awaitable counterparts of getInfo(), getThumbURL() and getDownloadURL().
+
+Each of these calls blocks the kernel until the Earth Engine servers answer, so a cell that needs several
+independent values waits for the sum of their latencies. AsyncEarthEngine sends the same requests to the Earth
+Engine REST API over one shared pool of HTTP connections, so they can run concurrently:
+
+    client = AsyncEarthEngine(max_concurrency=8)
+    stats, thumb_url = await asyncio.gather(
+        client.get_info(image.reduceRegion(ee.Reducer.mean(), region, 30)),
+        client.get_thumb_url(image, {'min': 0, 'max': 3000, 'dimensions': 512}),
+    )
+
+Notebooks can await at the top level of a cell. The requests are authorized with the credentials and the Cloud
+project of ee.Initialize(), and retried with exponential backoff when the server is busy (HTTP 429 or 5xx).
+
+The client needs the aiohttp package. StandInServer is a local stand-in for the REST API, which answers after
+an injected latency, so the client can be exercised without an Earth Engine account:
+
+    python ee_async.py --requests 100 --latency 0.5 --concurrency 20
+
+'''
+
+# License: MIT
+
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+BASE_URL = 'https://earthengine.googleapis.com'
+API_VERSION = 'v1'
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+
+def encode(ee_object):
+    """Serialize an Earth Engine object for the REST API.
+
+    Args:
+        ee_object (ee.ComputedObject | dict): Object to serialize. A dict is taken as an already serialized expression.
+
+    Returns:
+        dict: Serialized expression.
+    """
+    if isinstance(ee_object, dict):
+        return ee_object
+    import ee
+    return ee.serializer.encode(ee_object, for_cloud_api=True)
+
+
+def thumbnail_image(image, params):
+    """Apply the visualization and region parameters of getThumbURL() to an image.
+
+    Args:
+        image (ee.Image): Image.
+        params (dict): Parameters of getThumbURL(): bands, min, max, gamma, palette, region, dimensions.
+
+    Returns:
+        ee.Image: The image to render.
+    """
+    vis = {key: params[key] for key in ['bands', 'min', 'max', 'gamma', 'palette'] if key in params}
+    if vis:
+        image = image.visualize(**vis)
+    if 'region' in params or 'dimensions' in params:
+        kwargs = {}
+        if 'region' in params:
+            kwargs['geometry'] = params['region']
+        dimensions = params.get('dimensions')
+        if isinstance(dimensions, str):
+            dimensions = [int(value) for value in dimensions.split('x')]
+        if isinstance(dimensions, (list, tuple)):
+            kwargs['width'], kwargs['height'] = dimensions
+        elif dimensions is not None:
+            kwargs['maxDimension'] = dimensions
+        image = image.clipToBoundsAndScale(**kwargs)
+    return image
+
+
+def download_image(image, params):
+    """Apply the band, projection and region parameters of getDownloadURL() to an image.
+
+    Without a crs the image keeps its native projection, and a scale only sets the pixel size of the output, like
+    getDownloadURL(); a crs reprojects the image at the scale, or else at its native nominal scale.
+
+    Args:
+        image (ee.Image): Image.
+        params (dict): Parameters of getDownloadURL(): bands, crs, scale, region.
+
+    Returns:
+        ee.Image: The image to download.
+    """
+    import ee
+
+    if 'bands' in params:
+        image = image.select(params['bands'])
+    if 'crs' in params:
+        scale = params.get('scale', image.projection().nominalScale())
+        image = image.reproject(ee.Projection(params['crs']).atScale(scale))
+    kwargs = {}
+    if 'region' in params:
+        kwargs['geometry'] = params['region']
+    if 'scale' in params and 'crs' not in params:
+        kwargs['scale'] = params['scale']
+    if kwargs:
+        image = image.clipToBoundsAndScale(**kwargs)
+    return image
+
+
+def initialized_session():
+    """Get the Cloud project and the credentials set by ee.Initialize().
+
+    The Earth Engine API keeps them in private attributes, whose location changed between versions.
+
+    Returns:
+        tuple: Cloud project, 'earthengine-legacy' when there is none, and credentials.
+    """
+    import ee
+
+    if hasattr(ee.data, '_get_state'):
+        state = ee.data._get_state()
+        project, credentials = state.cloud_api_user_project, state.credentials
+    elif hasattr(ee.data, '_credentials') and hasattr(ee.data, '_cloud_api_user_project'):
+        project, credentials = ee.data._cloud_api_user_project, ee.data._credentials
+    else:
+        raise RuntimeError('Cannot read the project and credentials of ee.Initialize() from this version of the '
+                           'earthengine-api. Pass project and credentials to AsyncEarthEngine() instead.')
+    if credentials is None:
+        credentials = ee.data.get_persistent_credentials()
+    return project or 'earthengine-legacy', credentials
+
+
+def ee_exception(message):
+    """Create the exception raised by the Earth Engine API for a failed request, or a RuntimeError without it."""
+    try:
+        import ee
+    except ImportError:
+        return RuntimeError(message)
+    return ee.EEException(message)
+
+
+class AsyncEarthEngine:
+    """Client of the Earth Engine REST API for asyncio code.
+
+    Args:
+        project (str, optional): Cloud project of the requests. Defaults to None, which uses the project of ee.Initialize().
+        credentials (google.auth.credentials.Credentials, optional): Credentials. Defaults to None, which uses those of ee.Initialize().
+            Pass False to send requests without authorization, e.g. to a StandInServer.
+        base_url (str, optional): URL of the REST API. Defaults to BASE_URL.
+        max_concurrency (int, optional): Maximum number of requests in progress. Defaults to 16.
+        max_connections (int, optional): Maximum number of pooled HTTP connections. Defaults to 32.
+        retries (int, optional): Number of retries of a request that fails with a retryable status. Defaults to 4.
+        timeout (float, optional): Seconds before a request times out. Defaults to 300.
+    """
+
+    def __init__(self, project=None, credentials=None, base_url=BASE_URL, max_concurrency=16, max_connections=32,
+                 retries=4, timeout=300):
+        if project is None or credentials is None:
+            default_project, default_credentials = initialized_session()
+            project = default_project if project is None else project
+            credentials = default_credentials if credentials is None else credentials
+        self.project = project
+        self.credentials = credentials
+        self.base_url = base_url.rstrip('/')
+        self.max_concurrency = max_concurrency
+        self.max_connections = max_connections
+        self.retries = retries
+        self.timeout = timeout
+        self.semaphore = None
+        self.session = None
+        self.token_lock = None
+
+    async def open(self):
+        """Open the connection pool. Called by the first request."""
+        try:
+            import aiohttp
+        except ImportError:
+            raise ImportError('The aiohttp package is required. To install it: pip install aiohttp')
+
+        if self.session is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.token_lock = asyncio.Lock()
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+    async def close(self):
+        """Close the connection pool."""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def headers(self):
+        headers = {'Content-Type': 'application/json'}
+        if self.credentials is False:
+            return headers
+        async with self.token_lock:
+            if not self.credentials.valid:
+                import google.auth.transport.requests
+                # Refreshing is a blocking request, so it runs on a worker thread.
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self.credentials.refresh, google.auth.transport.requests.Request())
+        headers['Authorization'] = 'Bearer {}'.format(self.credentials.token)
+        if self.project != 'earthengine-legacy':
+            headers['x-goog-user-project'] = self.project
+        return headers
+
+    async def post(self, method, body):
+        """Send a request to the REST API, with retries.
+
+        Args:
+            method (str): Path of the method below the project, e.g. 'value:compute'.
+            body (dict): JSON body of the request.
+
+        Returns:
+            dict: JSON response.
+        """
+        await self.open()
+        url = '{}/{}/projects/{}/{}'.format(self.base_url, API_VERSION, self.project, method)
+        async with self.semaphore:
+            for attempt in range(self.retries + 1):
+                async with self.session.post(url, data=json.dumps(body), headers=await self.headers()) as response:
+                    if response.status == 200:
+                        return await response.json()
+                    text = await response.text()
+                if response.status not in RETRY_STATUSES or attempt == self.retries:
+                    try:
+                        message = json.loads(text)['error']['message']
+                    except (ValueError, KeyError, TypeError):
+                        message = text
+                    raise ee_exception(message)
+                await asyncio.sleep(min(2 ** attempt, 32) * (0.5 + random.random()))
+
+    async def get_info(self, ee_object):
+        """Awaitable counterpart of ee_object.getInfo().
+
+        Args:
+            ee_object (ee.ComputedObject): Object to evaluate.
+
+        Returns:
+            object: Client-side value of the object.
+        """
+        response = await self.post('value:compute', {'expression': encode(ee_object)})
+        return response.get('result')
+
+    async def thumbnail(self, ee_object, file_format):
+        response = await self.post('thumbnails', {'expression': encode(ee_object), 'fileFormat': file_format})
+        return '{}/{}/{}:getPixels'.format(self.base_url, API_VERSION, response['name'])
+
+    async def get_thumb_url(self, image, params=None):
+        """Awaitable counterpart of image.getThumbURL().
+
+        Args:
+            image (ee.Image): Image.
+            params (dict, optional): bands, min, max, gamma, palette, region, dimensions and format ('png' or 'jpg'). Defaults to None.
+
+        Returns:
+            str: URL of the thumbnail.
+        """
+        params = params or {}
+        file_format = 'JPEG' if params.get('format', 'png').lower() in ['jpg', 'jpeg'] else 'PNG'
+        return await self.thumbnail(thumbnail_image(image, params), file_format)
+
+    async def get_download_url(self, image, params=None):
+        """Awaitable counterpart of image.getDownloadURL().
+
+        Args:
+            image (ee.Image): Image.
+            params (dict, optional): bands, crs, scale, region and format ('ZIPPED_GEO_TIFF' or 'GEO_TIFF'). Defaults to None.
+
+        Returns:
+            str: URL of the download.
+        """
+        params = params or {}
+        return await self.thumbnail(download_image(image, params), params.get('format', 'ZIPPED_GEO_TIFF'))
+
+
+class StandInServer:
+    """Local stand-in for the Earth Engine REST API, answering after an injected latency.
+
+    value:compute returns the constant of the expression, e.g. the value of ee.Number(1), or else an echo of the
+    expression. thumbnails returns a thumbnail name. A share of the requests can fail with HTTP 503 to exercise
+    the retries.
+
+    Args:
+        latency (float, optional): Seconds before each answer. Defaults to 0.2.
+        failure_rate (float, optional): Probability that a request fails with HTTP 503. Defaults to 0.
+        port (int, optional): Port. Defaults to 0, which picks a free port.
+    """
+
+    def __init__(self, latency=0.2, failure_rate=0, port=0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                status, response = server.answer(self.path, body)
+                data = json.dumps(response).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.httpd.daemon_threads = True
+        self.url = 'http://127.0.0.1:{}'.format(self.httpd.server_address[1])
+
+    def answer(self, path, body):
+        with self.lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.latency)
+            if random.random() < self.failure_rate:
+                return 503, {'error': {'code': 503, 'message': 'Simulated overload.'}}
+            expression = body.get('expression', {})
+            if path.endswith('value:compute'):
+                node = expression.get('values', {}).get(expression.get('result'), expression)
+                return 200, {'result': node['constantValue'] if 'constantValue' in node else expression}
+            if path.endswith('thumbnails'):
+                return 200, {'name': 'projects/stand-in/thumbnails/{:08d}'.format(self.requests)}
+            return 404, {'error': {'code': 404, 'message': 'Unknown method {}'.format(path)}}
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+async def run_stand_in(requests=100, latency=0.2, concurrency=16, failure_rate=0.05):
+    """Evaluate constant expressions concurrently against a StandInServer.
+
+    Args:
+        requests (int, optional): Number of get_info() calls. Defaults to 100.
+        latency (float, optional): Seconds before each answer. Defaults to 0.2.
+        concurrency (int, optional): Maximum number of requests in progress. Defaults to 16.
+        failure_rate (float, optional): Probability that a request fails with HTTP 503. Defaults to 0.05.
+
+    Returns:
+        dict: Elapsed seconds, the serial estimate and the peak number of concurrent requests seen by the server.
+    """
+    server = StandInServer(latency, failure_rate).start()
+    try:
+        async with AsyncEarthEngine('stand-in', False, server.url, max_concurrency=concurrency, retries=8) as client:
+            start_time = time.perf_counter()
+            results = await asyncio.gather(*[
+                client.get_info({'result': '0', 'values': {'0': {'constantValue': index}}}) for index in range(requests)])
+            elapsed = time.perf_counter() - start_time
+        assert results == list(range(requests))
+    finally:
+        server.stop()
+    return {
+        'requests': requests,
+        'server_requests': server.requests,
+        'seconds': round(elapsed, 3),
+        'serial_seconds': round(requests * latency, 3),
+        'max_in_flight': server.max_in_flight,
+    }
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Run concurrent evaluations against a local stand-in for the Earth Engine REST API.')
+    parser.add_argument('--requests', type=int, default=100, help='Number of evaluations')
+    parser.add_argument('--latency', type=float, default=0.2, help='Seconds before the stand-in answers')
+    parser.add_argument('--concurrency', type=int, default=16, help='Maximum number of requests in progress')
+    parser.add_argument('--failure-rate', type=float, default=0.05, help='Probability that the stand-in answers HTTP 503')
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(run_stand_in(args.requests, args.latency, args.concurrency, args.failure_rate)), indent=2))
@@ -0,0 +1,405 @@
+''' Submit and monitor batches of Earth Engine export tasks.
+
+Scripts such as NAIP/ndwi_timeseries.py export one table per year and watershed. Starting every export at once
+floods the task queue, and a failed or interrupted run has to be sorted out by hand. ExportScheduler takes the
+whole job matrix and
+    * keeps at most max_in_flight tasks submitted but not finished,
+    * polls the states of all its tasks with one batched status call per poll,
+    * resubmits failed tasks up to max_retries times,
+    * appends every submission and state change to a journal, so a rerun after an interruption skips the
+      completed jobs and keeps polling the tasks that are still running instead of resubmitting them.
+
+collection_export_jobs() builds one job per image of an ImageCollection, fetching the image IDs and properties
+a page of images per request instead of one getInfo() per image.
+
+The Earth Engine task API is wrapped by EarthEngineTaskBackend. FakeTaskBackend simulates queueing and running
+latency and failures on a virtual clock, so the scheduler can be exercised offline:
+
+    python export_scheduler.py --jobs 450 --in-flight 20 --failure-rate 0.1
+
+'''
+
+# License: MIT
+
+import os
+import json
+import time
+import random
+import argparse
+import functools
+from collections import deque
+
+
+TERMINAL_STATES = ['COMPLETED', 'FAILED', 'CANCELLED']
+
+
+class ExportJournal:
+    """Append-only record of the export jobs, one JSON object per line. The last line of a job holds its current state.
+
+    Args:
+        journal_file (str): File path of the journal.
+    """
+
+    def __init__(self, journal_file):
+        self.journal_file = journal_file
+        self.jobs = self.read()
+
+    def read(self):
+        """Read the journal.
+
+        Returns:
+            dict: The latest entry of each job, keyed by job name. Empty if the journal does not exist.
+        """
+        jobs = {}
+        if not os.path.isfile(self.journal_file):
+            return jobs
+        with open(self.journal_file) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:   # a line cut short by an interruption
+                    continue
+                jobs[entry['job']] = entry
+        return jobs
+
+    def record(self, job, **entry):
+        """Record a new state of a job.
+
+        Args:
+            job (str): Job name.
+            **entry: Fields of the job to change, e.g. state, task_id, attempts and error.
+
+        Returns:
+            dict: The updated entry of the job.
+        """
+        entry = dict(self.jobs.get(job, {'attempts': 0}), job=job, time=time.time(), **entry)
+        self.jobs[job] = entry
+        with open(self.journal_file, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+        return entry
+
+
+class EarthEngineTaskBackend:
+    """Start Earth Engine export tasks and get their states.
+
+    ee.data.getTaskList() returns the states of all the tasks of the account in one request, which is cheaper
+    than one ee.batch.Task.status() request per task.
+    """
+
+    def submit(self, job, task):
+        """Start an export task.
+
+        Args:
+            job (str): Job name.
+            task (ee.batch.Task): Unstarted export task, e.g. from ee.batch.Export.table().
+
+        Returns:
+            str: Task ID.
+        """
+        task.start()
+        return task.id
+
+    def status(self, task_ids):
+        """Get the states of tasks.
+
+        Args:
+            task_ids (list): Task IDs.
+
+        Returns:
+            dict: Task status dicts with at least 'state', keyed by task ID. Tasks not listed yet are missing.
+        """
+        import ee
+
+        task_ids = set(task_ids)
+        return {task['id']: task for task in ee.data.getTaskList() if task['id'] in task_ids}
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class FakeTaskBackend:
+    """Simulated task backend for running the scheduler offline.
+
+    Each task waits in the queue (READY) and then runs (RUNNING) for random durations, and then ends COMPLETED,
+    or FAILED with probability failure_rate. Time is virtual: sleep() advances the clock instantly.
+
+    Args:
+        queue_latency (tuple, optional): Range of seconds a task waits in the queue. Defaults to (5, 60).
+        run_time (tuple, optional): Range of seconds a task runs. Defaults to (30, 300).
+        failure_rate (float, optional): Probability that a task fails. Defaults to 0.1.
+        submit_failure_rate (float, optional): Probability that starting a task raises an error. Defaults to 0.
+        seed (int, optional): Random seed. Defaults to 0.
+    """
+
+    def __init__(self, queue_latency=(5, 60), run_time=(30, 300), failure_rate=0.1, submit_failure_rate=0, seed=0):
+        self.queue_latency = queue_latency
+        self.run_time = run_time
+        self.failure_rate = failure_rate
+        self.submit_failure_rate = submit_failure_rate
+        self.random = random.Random(seed)
+        self.clock = 0.0
+        self.tasks = {}
+        self.submit_calls = 0
+        self.status_calls = 0
+        self.max_in_flight = 0
+
+    def submit(self, job, task):
+        self.submit_calls += 1
+        if self.random.random() < self.submit_failure_rate:
+            raise RuntimeError('Too many tasks already in the queue.')
+
+        task_id = 'FAKE{:06d}'.format(len(self.tasks))
+        start = self.clock + self.random.uniform(*self.queue_latency)
+        self.tasks[task_id] = {
+            'job': job,
+            'start': start,
+            'end': start + self.random.uniform(*self.run_time),
+            'failed': self.random.random() < self.failure_rate,
+        }
+        self.max_in_flight = max(self.max_in_flight, self.in_flight())
+        return task_id
+
+    def state(self, task_id):
+        task = self.tasks[task_id]
+        if self.clock < task['start']:
+            return 'READY'
+        if self.clock < task['end']:
+            return 'RUNNING'
+        return 'FAILED' if task['failed'] else 'COMPLETED'
+
+    def in_flight(self):
+        return sum(self.state(task_id) not in TERMINAL_STATES for task_id in self.tasks)
+
+    def status(self, task_ids):
+        self.status_calls += 1
+        statuses = {}
+        for task_id in task_ids:
+            if task_id not in self.tasks:   # e.g. a task journaled by another run
+                continue
+            state = self.state(task_id)
+            statuses[task_id] = {'id': task_id, 'state': state}
+            if state == 'FAILED':
+                statuses[task_id]['error_message'] = 'Simulated failure.'
+        return statuses
+
+    def sleep(self, seconds):
+        self.clock += seconds
+
+
+class ExportScheduler:
+    """Run a batch of export jobs with a bounded number of tasks in flight.
+
+    Args:
+        backend (object, optional): Task backend, see EarthEngineTaskBackend. Defaults to None, which uses EarthEngineTaskBackend.
+        journal_file (str, optional): File path of the journal used to resume interrupted runs. Defaults to 'export_journal.jsonl'.
+        max_in_flight (int, optional): Maximum number of submitted tasks that have not finished. Defaults to 10.
+        max_retries (int, optional): Number of times a failed job is resubmitted. Defaults to 2.
+        poll_interval (float, optional): Seconds between two status polls. Defaults to 30.
+        missing_polls (int, optional): Number of consecutive polls a submitted task may be missing from the task list before its job is treated as failed. Defaults to 5.
+        verbose (bool, optional): Whether to print the state changes. Defaults to True.
+    """
+
+    def __init__(self, backend=None, journal_file='export_journal.jsonl', max_in_flight=10, max_retries=2,
+                 poll_interval=30, missing_polls=5, verbose=True):
+        if backend is None:
+            backend = EarthEngineTaskBackend()
+        self.backend = backend
+        self.journal = ExportJournal(journal_file)
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.poll_interval = poll_interval
+        self.missing_polls = missing_polls
+        self.verbose = verbose
+
+    def log(self, message):
+        if self.verbose:
+            print(message)
+
+    def failed(self, job, error, pending):
+        """Record a failed attempt and queue the job again if it has retries left."""
+        entry = self.journal.record(job, state='FAILED', error=str(error))
+        if entry['attempts'] <= self.max_retries:
+            self.log('{} failed ({}), retrying'.format(job, error))
+            pending.append(job)
+        else:
+            self.log('{} failed ({}), giving up after {} attempts'.format(job, error, entry['attempts']))
+
+    def run(self, jobs, wait=True):
+        """Run export jobs until every job has completed, failed max_retries + 1 times or been cancelled.
+
+        Args:
+            jobs (dict): Functions returning an unstarted export task, keyed by job name, e.g.
+                {'Y2014_2_Pipestem': functools.partial(make_task, 2014, 2, 'Pipestem')}. The functions
+                are only called when their job is submitted.
+            wait (bool, optional): Whether to wait for the last tasks to finish. If False, return as soon as every job has been submitted. Defaults to True.
+
+        Returns:
+            dict: Final (or, if wait is False, latest) state of each job, keyed by job name.
+        """
+        pending = deque()
+        in_flight = {}
+        missing = {}
+        for job in jobs:
+            entry = self.journal.jobs.get(job)
+            state = entry and entry.get('state')
+            if state in ['COMPLETED', 'CANCELLED']:
+                continue
+            if state == 'FAILED':
+                if entry['attempts'] <= self.max_retries:
+                    pending.append(job)
+            elif state and entry.get('task_id'):
+                # SUBMITTED, READY, RUNNING, CANCEL_REQUESTED, UNSUBMITTED...: polled until the task ends. A task
+                # that is not in the task list any more fails after missing_polls polls and is resubmitted.
+                in_flight[entry['task_id']] = job
+            else:   # not journaled, or without a task
+                pending.append(job)
+        self.log('{} jobs: {} to submit, {} resumed in flight'.format(len(jobs), len(pending), len(in_flight)))
+
+        while pending or (in_flight and wait):
+            while pending and len(in_flight) < self.max_in_flight:
+                job = pending.popleft()
+                attempts = self.journal.jobs.get(job, {'attempts': 0})['attempts'] + 1
+                try:
+                    task_id = self.backend.submit(job, jobs[job]())
+                except Exception as e:
+                    self.journal.record(job, attempts=attempts)
+                    self.failed(job, e, pending)
+                    continue
+                self.journal.record(job, state='SUBMITTED', task_id=task_id, attempts=attempts)
+                in_flight[task_id] = job
+
+            if not in_flight or not (pending or wait):
+                continue
+            self.backend.sleep(self.poll_interval)
+
+            statuses = self.backend.status(list(in_flight))
+            for task_id in list(in_flight):
+                if task_id in statuses:
+                    missing.pop(task_id, None)
+                    continue
+                missing[task_id] = missing.get(task_id, 0) + 1
+                if missing[task_id] >= self.missing_polls:
+                    del missing[task_id]
+                    self.failed(in_flight.pop(task_id), 'task {} not found'.format(task_id), pending)
+            for task_id, status in statuses.items():
+                job = in_flight.get(task_id)
+                if job is None or status['state'] == self.journal.jobs[job]['state']:
+                    continue
+                if status['state'] == 'FAILED':
+                    del in_flight[task_id]
+                    self.failed(job, status.get('error_message', 'unknown error'), pending)
+                    continue
+                self.journal.record(job, state=status['state'])
+                if status['state'] in TERMINAL_STATES:
+                    del in_flight[task_id]
+                    self.log('{} {}'.format(job, status['state'].lower()))
+
+        return {job: self.journal.jobs[job]['state'] for job in jobs if job in self.journal.jobs}
+
+
+def image_properties(image, properties):
+    """Get properties of an image as a dictionary, leaving out the properties it does not have.
+
+    Args:
+        image (ee.Image): Image.
+        properties (list): Property names, including system properties such as 'system:index'.
+
+    Returns:
+        ee.Dictionary: Property values keyed by name.
+    """
+    import ee
+
+    image = ee.Image(image)
+    return image.toDictionary(image.propertyNames()).select(properties, True)
+
+
+def collection_metadata(collection, properties=None, page_size=1000):
+    """Get the ID and properties of every image in a collection, with one request per page of images.
+
+    Each page holds the images whose 'system:index' follows the last one of the page before, rather than an
+    offset, which the server would have to skip over again for every page.
+
+    Args:
+        collection (ee.ImageCollection): Image collection, with unique 'system:index' values.
+        properties (list, optional): Properties to get besides 'system:index'. Defaults to None.
+        page_size (int, optional): Number of images per request. Defaults to 1000.
+
+    Returns:
+        list: Property dicts of the images, in 'system:index' order.
+    """
+    import ee
+
+    properties = ['system:index'] + [name for name in properties or [] if name != 'system:index']
+    rows = []
+    while True:
+        remaining = collection
+        if rows:
+            remaining = collection.filter(ee.Filter.gt('system:index', rows[-1]['system:index']))
+        page = remaining.limit(page_size, 'system:index').toList(page_size)
+        page = page.map(lambda image: image_properties(image, properties)).getInfo()
+        rows.extend(page)
+        if len(page) < page_size:
+            return rows
+
+
+def collection_export_jobs(collection, make_task, properties=None, page_size=1000):
+    """Build one export job per image of a collection, for ExportScheduler.run().
+
+    The image IDs and properties are fetched by collection_metadata(), instead of one getInfo() per image.
+
+    Args:
+        collection (ee.ImageCollection): Image collection.
+        make_task (function): Function taking an image and its property dict, and returning an unstarted export task, e.g.
+            lambda image, row: ee.batch.Export.image(image, row['system:index'], config).
+        properties (list, optional): Properties to get besides 'system:index'. Defaults to None.
+        page_size (int, optional): Number of images per metadata request. Defaults to 1000.
+
+    Returns:
+        dict: Export jobs keyed by image ID.
+    """
+    import ee
+
+    def make_job(row):
+        image = collection.filter(ee.Filter.eq('system:index', row['system:index'])).first()
+        return make_task(ee.Image(image), row)
+
+    return {row['system:index']: functools.partial(make_job, row)
+            for row in collection_metadata(collection, properties, page_size)}
+
+
+def summarize(states):
+    """Count jobs by state.
+
+    Args:
+        states (dict): Job states, see ExportScheduler.run().
+
+    Returns:
+        dict: Number of jobs in each state.
+    """
+    counts = {}
+    for state in states.values():
+        counts[state] = counts.get(state, 0) + 1
+    return counts
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Run the export scheduler against a simulated task backend.')
+    parser.add_argument('--jobs', type=int, default=450, help='Number of jobs, e.g. 9 years x 50 watersheds')
+    parser.add_argument('--in-flight', type=int, default=20, help='Maximum number of tasks in flight')
+    parser.add_argument('--retries', type=int, default=2, help='Number of times a failed job is resubmitted')
+    parser.add_argument('--failure-rate', type=float, default=0.1, help='Probability that a simulated task fails')
+    parser.add_argument('--submit-failure-rate', type=float, default=0.02, help='Probability that starting a simulated task fails')
+    parser.add_argument('--journal', type=str, default='fake_export_journal.jsonl', help='Path to the journal. Rerun with the same journal to resume')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the simulation')
+    args = parser.parse_args()
+
+    backend = FakeTaskBackend(failure_rate=args.failure_rate, submit_failure_rate=args.submit_failure_rate, seed=args.seed)
+    scheduler = ExportScheduler(backend, args.journal, args.in_flight, args.retries, poll_interval=10, verbose=False)
+    jobs = {'job_{:04d}'.format(index): dict for index in range(args.jobs)}
+
+    states = scheduler.run(jobs)
+    print('Job states: {}'.format(summarize(states)))
+    print('Simulated time: {:.0f}s, submissions: {}, status calls: {}, max tasks in flight: {}'.format(
+        backend.clock, backend.submit_calls, backend.status_calls, backend.max_in_flight))
@@ -0,0 +1,511 @@
+''' Stream a FeatureCollection of any size to a GeoParquet file, page by page.
+
+getInfo() on collections such as TIGER/2010/Blocks (over 11 million features) fails or runs out of memory,
+because the whole collection is serialized into one response. FeatureStream instead
+    * pages through the collection in 'system:index' order, each page starting at a key rather than at an offset,
+      which the server would have to skip over again for every page; the first keys of the next pages are
+      fetched a few dozen pages at a time,
+    * fetches several pages at the same time, retrying failed pages, and hands them over in order,
+    * converts each page into an Arrow record batch, with the geometries encoded as WKB, and writes it as one
+      row group of a GeoParquet file,
+so at most `workers` * 2 pages are held in memory.
+
+    export_geoparquet(ee.FeatureCollection('TIGER/2010/Blocks').filter(ee.Filter.eq('statefp10', '11')),
+                      'blocks_dc.parquet', page_size=2000)
+
+Writing needs the pyarrow package. FakePagingServer serves generated features the same way, so the export can be
+checked offline:
+
+    python feature_stream.py --features 50000
+
+'''
+
+# License: MIT
+
+import json
+import time
+import random
+import struct
+import argparse
+import threading
+import urllib.parse
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+WKB_TYPES = {
+    'Point': 1, 'LineString': 2, 'Polygon': 3, 'MultiPoint': 4, 'MultiLineString': 5, 'MultiPolygon': 6,
+    'GeometryCollection': 7,
+}
+
+
+def wkb_points(coordinates):
+    return struct.pack('<I', len(coordinates)) + b''.join(struct.pack('<dd', x, y) for x, y in
+                                                          (point[:2] for point in coordinates))
+
+
+def wkb(geometry):
+    """Encode a GeoJSON geometry as little-endian 2D WKB.
+
+    Args:
+        geometry (dict): GeoJSON geometry.
+
+    Returns:
+        bytes: WKB of the geometry, or None for a null geometry.
+    """
+    if geometry is None:
+        return None
+    geometry_type = geometry['type']
+    header = struct.pack('<BI', 1, WKB_TYPES[geometry_type])
+    if geometry_type == 'GeometryCollection':
+        return header + struct.pack('<I', len(geometry['geometries'])) + \
+            b''.join(wkb(part) for part in geometry['geometries'])
+
+    coordinates = geometry['coordinates']
+    if geometry_type == 'Point':
+        return header + struct.pack('<dd', *coordinates[:2])
+    if geometry_type == 'LineString':
+        return header + wkb_points(coordinates)
+    if geometry_type == 'Polygon':
+        return header + struct.pack('<I', len(coordinates)) + b''.join(wkb_points(ring) for ring in coordinates)
+    part_type = geometry_type[len('Multi'):]
+    return header + struct.pack('<I', len(coordinates)) + \
+        b''.join(wkb({'type': part_type, 'coordinates': part}) for part in coordinates)
+
+
+class EarthEngineFeatureSource:
+    """Pages of an Earth Engine FeatureCollection, in 'system:index' order.
+
+    Args:
+        collection (ee.FeatureCollection): Collection to read, with unique 'system:index' values.
+        properties (list, optional): Properties to read. Defaults to None, which reads every property.
+    """
+
+    def __init__(self, collection, properties=None):
+        self.collection = collection.select(properties) if properties is not None else collection
+
+    def count(self):
+        return self.collection.size().getInfo()
+
+    def after(self, start):
+        import ee
+
+        return self.collection if start is None else self.collection.filter(ee.Filter.gte('system:index', start))
+
+    def starts(self, start, pages, page_size):
+        """Get the first keys of the next pages.
+
+        Args:
+            start (str): First key of the first page, or None for the start of the collection.
+            pages (int): Maximum number of pages.
+            page_size (int): Number of features per page.
+
+        Returns:
+            list: First 'system:index' of each page, in order.
+        """
+        import ee
+
+        keys = self.after(start).limit(pages * page_size, 'system:index').aggregate_array('system:index')
+        return ee.List(keys).slice(0, None, page_size).getInfo()
+
+    def page(self, start, limit):
+        """Get the first `limit` features from the key `start` on.
+
+        Returns:
+            list: GeoJSON features.
+        """
+        import ee
+
+        return ee.data.computeValue(self.after(start).limit(limit, 'system:index'))['features']
+
+
+class HTTPFeatureSource:
+    """Pages of features served over HTTP at <url>/count, <url>/starts?start=&pages=&page_size= and
+    <url>/features?start=&limit=, e.g. by FakePagingServer.
+
+    Args:
+        url (str): Base URL of the endpoint.
+    """
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def get(self, path, **params):
+        params = {key: value for key, value in params.items() if value is not None}
+        with urllib.request.urlopen(self.url + path + '?' + urllib.parse.urlencode(params), timeout=300) as response:
+            return json.loads(response.read().decode('utf-8'))
+
+    def count(self):
+        return self.get('/count')['count']
+
+    def starts(self, start, pages, page_size):
+        return self.get('/starts', start=start, pages=pages, page_size=page_size)['starts']
+
+    def page(self, start, limit):
+        return self.get('/features', start=start, limit=limit)['features']
+
+
+class FeatureStream:
+    """Read the features of a source page by page, fetching several pages at the same time.
+
+    Args:
+        source (EarthEngineFeatureSource | HTTPFeatureSource): Source of the pages.
+        page_size (int, optional): Number of features per page. Defaults to 1000.
+        workers (int, optional): Number of pages fetched at the same time. Defaults to 4.
+        retries (int, optional): Number of retries of a failed request. Defaults to 4.
+        starts_per_request (int, optional): Number of page keys fetched per request. Defaults to 32.
+    """
+
+    def __init__(self, source, page_size=1000, workers=4, retries=4, starts_per_request=32):
+        self.source = source
+        self.page_size = page_size
+        self.workers = workers
+        self.retries = retries
+        self.starts_per_request = starts_per_request
+
+    def fetch(self, function, *args):
+        for attempt in range(self.retries + 1):
+            try:
+                return function(*args)
+            except Exception:
+                if attempt == self.retries:
+                    raise
+                time.sleep(min(2 ** attempt, 60) * (0.5 + random.random()))
+
+    def starts(self):
+        """Get the first key of every page, a batch of keys per request.
+
+        Yields:
+            str: First key of each page, in order.
+        """
+        start = None
+        while True:
+            # One more key than pages: the first key of the next batch.
+            starts = self.fetch(self.source.starts, start, self.starts_per_request + 1, self.page_size)
+            for key in starts[:self.starts_per_request]:
+                yield key
+            if len(starts) <= self.starts_per_request:
+                return
+            start = starts[-1]
+
+    def pages(self):
+        """Read the pages in order, with at most `workers` * 2 pages fetched ahead.
+
+        Yields:
+            list: GeoJSON features of each page.
+        """
+        futures = deque()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for start in self.starts():
+                futures.append(executor.submit(self.fetch, self.source.page, start, self.page_size))
+                if len(futures) >= self.workers * 2:
+                    yield futures.popleft().result()
+            while futures:
+                yield futures.popleft().result()
+
+
+def arrow_type(values):
+    """Get the Arrow type of the values of a property: bool, float64, or string (JSON for lists and dicts).
+
+    Numbers are always float64: JSON does not tell integers from floats, and a property that holds only whole
+    numbers on the first page may hold fractions on later ones. Pass int64 in the schema of export_geoparquet()
+    for integer properties.
+    """
+    import pyarrow as pa
+
+    values = [value for value in values if value is not None]
+    if values and all(isinstance(value, bool) for value in values):
+        return pa.bool_()
+    if values and all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+        return pa.float64()
+    return pa.string()
+
+
+def infer_schema(features, geometry_column='geometry'):
+    """Infer the schema of a GeoParquet file from a page of features.
+
+    Args:
+        features (list): GeoJSON features.
+        geometry_column (str, optional): Name of the geometry column. Defaults to 'geometry'.
+
+    Returns:
+        pyarrow.Schema: Schema with an 'id' column, the properties, and the WKB geometry column.
+    """
+    import pyarrow as pa
+
+    names = []
+    for feature in features:
+        for name in feature.get('properties') or {}:
+            if name not in names:
+                names.append(name)
+    fields = [pa.field('id', pa.string())]
+    fields += [pa.field(name, arrow_type([(feature.get('properties') or {}).get(name) for feature in features]))
+               for name in names]
+    fields.append(pa.field(geometry_column, pa.binary()))
+    metadata = {'geo': json.dumps({
+        'version': '1.0.0',
+        'primary_column': geometry_column,
+        'columns': {geometry_column: {'encoding': 'WKB', 'geometry_types': []}},
+    })}
+    return pa.schema(fields, metadata=metadata)
+
+
+def column_value(value, arrow_type):
+    import pyarrow as pa
+
+    if value is None:
+        return None
+    if arrow_type == pa.string() and not isinstance(value, str):
+        return json.dumps(value)
+    if arrow_type == pa.float64() and isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if pa.types.is_integer(arrow_type) and isinstance(value, float):
+        if not value.is_integer():   # pyarrow would truncate it silently
+            raise TypeError('{} is not an integer.'.format(value))
+        return int(value)
+    return value
+
+
+def page_batch(features, schema):
+    """Convert a page of features into an Arrow record batch.
+
+    Args:
+        features (list): GeoJSON features.
+        schema (pyarrow.Schema): Schema, see infer_schema(). Properties missing from it are dropped, see new_properties().
+
+    Returns:
+        pyarrow.RecordBatch: One row per feature.
+    """
+    import pyarrow as pa
+
+    geometry_column = json.loads(schema.metadata[b'geo'])['primary_column']
+    columns = []
+    for field in schema:
+        if field.name == 'id':
+            values = [None if feature.get('id') is None else str(feature['id']) for feature in features]
+        elif field.name == geometry_column:
+            values = [wkb(feature.get('geometry')) for feature in features]
+        else:
+            values = [(feature.get('properties') or {}).get(field.name) for feature in features]
+        try:
+            if field.name not in ('id', geometry_column):
+                values = [column_value(value, field.type) for value in values]
+            columns.append(pa.array(values, type=field.type))
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+            raise TypeError('The values of the property {} do not match its type {}, inferred from the first page '
+                            'unless given. Pass a schema for it.'.format(field.name, field.type))
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def new_properties(features, schema):
+    """Get the properties of a page of features that are missing from a schema, in order of appearance."""
+    names = []
+    for feature in features:
+        for name in feature.get('properties') or {}:
+            if name not in names and schema.get_field_index(name) < 0:
+                names.append(name)
+    return names
+
+
+def export_geoparquet(collection, out_file, page_size=1000, workers=4, properties=None, schema=None,
+                      compression='zstd'):
+    """Stream a FeatureCollection to a GeoParquet file in 'system:index' order, one row group per page.
+
+    Args:
+        collection (ee.FeatureCollection | HTTPFeatureSource): Collection to export.
+        out_file (str): Output .parquet file.
+        page_size (int, optional): Number of features per page and row group. Defaults to 1000.
+        workers (int, optional): Number of pages fetched at the same time. Defaults to 4.
+        properties (list, optional): Properties to export. Defaults to None, which exports every property.
+        schema (dict, optional): Arrow types of some properties, e.g. {'pop10': pyarrow.int64()}, including properties missing from the first page. Defaults to None, which infers them from the first page.
+        compression (str, optional): Parquet compression codec. Defaults to 'zstd'.
+
+    Returns:
+        int: Number of features written.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError('Writing GeoParquet needs the pyarrow package. To install it: pip install pyarrow')
+
+    source = collection if hasattr(collection, 'page') else EarthEngineFeatureSource(collection, properties)
+    stream = FeatureStream(source, page_size, workers)
+    count = source.count()
+    print('{} features in {} pages of {}'.format(count, -(-count // page_size), page_size))
+
+    writer = None
+    written = 0
+    start_time = time.time()
+    try:
+        for features in stream.pages():
+            if writer is None:
+                arrow_schema = infer_schema(features)
+                for name, arrow_type in (schema or {}).items():
+                    index = arrow_schema.get_field_index(name)
+                    if index >= 0:
+                        arrow_schema = arrow_schema.set(index, pa.field(name, arrow_type))
+                    else:   # before the geometry column
+                        arrow_schema = arrow_schema.insert(len(arrow_schema) - 1, pa.field(name, arrow_type))
+                writer = pq.ParquetWriter(out_file, arrow_schema, compression=compression)
+                dropped = set()
+            else:
+                names = [name for name in new_properties(features, arrow_schema) if name not in dropped]
+                if names:
+                    print('Dropping the properties {}, which are not on the first page. Pass their types in '
+                          'schema to export them.'.format(', '.join(names)))
+                    dropped.update(names)
+            writer.write_batch(page_batch(features, arrow_schema))
+            written += len(features)
+            print('{}/{} features ({:.1f}s)'.format(written, count, time.time() - start_time))
+    finally:
+        if writer is not None:
+            writer.close()
+    return written
+
+
+class FakePagingServer:
+    """Local stand-in for a paged FeatureCollection, serving generated points and polygons keyed by zero-padded IDs.
+
+    Args:
+        features (int, optional): Number of features. Defaults to 10000.
+        latency (float, optional): Seconds before each page is answered. Defaults to 0.05.
+        failure_rate (float, optional): Share of the pages answered with HTTP 503. Defaults to 0.
+    """
+
+    def __init__(self, features=10000, latency=0.05, failure_rate=0):
+        self.features = features
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                with server.lock:
+                    server.requests += 1
+                url = urllib.parse.urlparse(self.path)
+                query = dict(urllib.parse.parse_qsl(url.query))
+                time.sleep(server.latency)
+                first = int(query['start']) if 'start' in query else 0   # keys are zero-padded indexes
+                if url.path == '/count':
+                    status, body = 200, {'count': server.features}
+                elif url.path == '/features' and random.random() < server.failure_rate:
+                    status, body = 503, {'error': 'Too many concurrent requests'}
+                elif url.path == '/starts':
+                    end = min(first + int(query['pages']) * int(query['page_size']), server.features)
+                    status, body = 200, {'starts': [server.key(index) for index in
+                                                    range(first, end, int(query['page_size']))]}
+                elif url.path == '/features':
+                    end = min(first + int(query['limit']), server.features)
+                    status, body = 200, {'type': 'FeatureCollection',
+                                         'features': [server.feature(index) for index in range(first, end)]}
+                else:
+                    status, body = 404, {'error': 'Not found'}
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = 'http://127.0.0.1:{}'.format(self.httpd.server_address[1])
+
+    @staticmethod
+    def key(index):
+        return '{:010d}'.format(index)
+
+    @staticmethod
+    def feature(index):
+        x, y = -125 + (index % 600) * 0.1, 25 + (index // 600 % 250) * 0.1
+        if index % 2:
+            geometry = {'type': 'Polygon', 'coordinates': [[[x, y], [x + 0.1, y], [x + 0.1, y + 0.1], [x, y]]]}
+        else:
+            geometry = {'type': 'Point', 'coordinates': [x, y]}
+        properties = {'blockid10': '{:015d}'.format(index), 'pop10': index % 700, 'aland10': index * 1.5}
+        return {'type': 'Feature', 'id': FakePagingServer.key(index), 'geometry': geometry, 'properties': properties}
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == '__main__':
+
+    import os
+    import tempfile
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    parser = argparse.ArgumentParser(description='Export the features of a local fake paging endpoint to GeoParquet.')
+    parser.add_argument('--features', type=int, default=50000, help='Number of features')
+    parser.add_argument('--page-size', type=int, default=1000, help='Number of features per page')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds before each page is answered')
+    parser.add_argument('--failure-rate', type=float, default=0.05, help='Share of the pages answered with HTTP 503')
+    args = parser.parse_args()
+
+    assert wkb({'type': 'Point', 'coordinates': [1, 2]}).hex() == '0101000000000000000000f03f0000000000000040'
+    assert wkb({'type': 'Polygon', 'coordinates': [[[0, 0], [1, 0], [0, 1], [0, 0]]]}).hex().startswith(
+        '01030000000100000004000000')
+    server = FakePagingServer(args.features, args.latency, args.failure_rate).start()
+    with tempfile.TemporaryDirectory() as out_dir:
+        out_file = os.path.join(out_dir, 'features.parquet')
+        export_geoparquet(HTTPFeatureSource(server.url), out_file, args.page_size)
+        parquet = pq.ParquetFile(out_file)
+        table = parquet.read()
+        assert table.num_rows == args.features
+        assert table.column('id').to_pylist() == [FakePagingServer.key(index) for index in range(args.features)]
+        for index in range(0, args.features, max(args.features // 100, 1)):
+            assert table.column('geometry')[index].as_py() == wkb(FakePagingServer.feature(index)['geometry'])
+        assert json.loads(parquet.schema_arrow.metadata[b'geo'])['primary_column'] == 'geometry'
+        print('{} rows in {} row groups, {} requests to the fake endpoint: OK'.format(
+            table.num_rows, parquet.num_row_groups, server.requests))
+
+        class ListSource:
+            def __init__(self, features):
+                self.features = features
+
+            def count(self):
+                return len(self.features)
+
+            def first(self, start):
+                return next((index for index, feature in enumerate(self.features) if feature['id'] >= start),
+                            len(self.features)) if start is not None else 0
+
+            def starts(self, start, pages, page_size):
+                first = self.first(start)
+                return [feature['id'] for feature in self.features[first:first + pages * page_size:page_size]]
+
+            def page(self, start, limit):
+                return self.features[self.first(start):self.first(start) + limit]
+
+        # Whole numbers on the first page must not turn the column into integers, and later properties need a type.
+        features = [{'id': str(index), 'geometry': None, 'properties': {'value': value}}
+                    for index, value in enumerate([1, 2, 2.5, 3.75])]
+        features[3]['properties']['late'] = 'x'
+        export_geoparquet(ListSource(features), out_file, page_size=2)
+        table = pq.read_table(out_file)
+        assert table.column('value').to_pylist() == [1, 2, 2.5, 3.75] and 'late' not in table.column_names
+        export_geoparquet(ListSource(features), out_file, page_size=2, schema={'late': pa.string()})
+        assert pq.read_table(out_file).column('late').to_pylist() == [None, None, None, 'x']
+        try:
+            export_geoparquet(ListSource(features), out_file, page_size=2, schema={'value': pa.int64()})
+            raise AssertionError('2.5 was written as an integer')
+        except TypeError:
+            pass
+        print('Numbers keep their fractions, integer columns refuse them: OK')
+    server.stop()
@@ -0,0 +1,256 @@
+''' Evaluate several Earth Engine objects with one request instead of one getInfo() call each.
+
+Every getInfo() is a blocking round trip to the Earth Engine servers. Independent values, such as the size of a
+collection, a centroid and a list of dates, can be packed into one server-side ee.Dictionary and evaluated
+together:
+
+    with GetInfoBatch() as batch:
+        count = batch.add(collection.size())
+        centroid = batch.add(polys.centroid())
+    print(count, centroid['coordinates'])
+
+or, when all the values are wanted at once:
+
+    count, centroid = get_info_all(collection.size(), polys.centroid())
+
+The notebook template can also turn on an automatic mode, in which getInfo() returns a DeferredValue that is
+only evaluated when it is used, together with every other getInfo() called before that:
+
+    enable_auto_batching()
+
+'''
+
+# License: MIT
+
+import threading
+
+
+class DeferredValue:
+    """Client-side value of an Earth Engine object, evaluated with the other values of its batch.
+
+    The value is evaluated the first time it is needed. A DeferredValue can be used like the value itself for
+    printing, indexing, iteration, comparisons and arithmetic; isinstance() checks need DeferredValue.value.
+
+    Args:
+        batch (GetInfoBatch): The batch evaluating the value.
+    """
+
+    def __init__(self, batch):
+        self._batch = batch
+        self._resolved = False
+        self._value = None
+        self._error = None
+
+    def _set(self, value=None, error=None):
+        self._value = value
+        self._error = error
+        self._resolved = True
+
+    @property
+    def value(self):
+        """The evaluated value. Raises the evaluation error if the object could not be evaluated."""
+        if not self._resolved:
+            self._batch.evaluate()
+        if not self._resolved:
+            raise RuntimeError('The value was not evaluated by its batch.')
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.value, name)
+
+    def __repr__(self):
+        if not self._resolved and not self._batch.auto:
+            return '<DeferredValue (not evaluated)>'
+        return repr(self.value)
+
+    def __str__(self):
+        return str(self.value)
+
+    def __format__(self, format_spec):
+        return format(self.value, format_spec)
+
+    def __bool__(self):
+        return bool(self.value)
+
+    def __len__(self):
+        return len(self.value)
+
+    def __iter__(self):
+        return iter(self.value)
+
+    def __contains__(self, item):
+        return item in self.value
+
+    def __getitem__(self, key):
+        return self.value[key]
+
+    def __hash__(self):
+        return hash(self.value)
+
+    def __int__(self):
+        return int(self.value)
+
+    def __float__(self):
+        return float(self.value)
+
+    def __index__(self):
+        return self.value.__index__()
+
+
+def unwrap(value):
+    return value.value if isinstance(value, DeferredValue) else value
+
+
+def add_operator(name):
+    def operator(self, *args):
+        return getattr(self.value, name)(*[unwrap(arg) for arg in args])
+    operator.__name__ = name
+    setattr(DeferredValue, name, operator)
+
+
+for name in ['__eq__', '__ne__', '__lt__', '__le__', '__gt__', '__ge__',
+             '__add__', '__radd__', '__sub__', '__rsub__', '__mul__', '__rmul__', '__truediv__', '__rtruediv__',
+             '__floordiv__', '__rfloordiv__', '__mod__', '__rmod__', '__pow__', '__rpow__', '__neg__', '__abs__']:
+    add_operator(name)
+
+
+class GetInfoBatch:
+    """Collect Earth Engine objects and evaluate them with one request.
+
+    The objects are packed into one ee.Dictionary. If the combined request fails, e.g. because one of the objects
+    cannot be computed, the objects are evaluated one by one, so the error belongs to the value that caused it.
+
+    Args:
+        max_size (int, optional): Number of objects after which the batch is evaluated without waiting. Defaults to 1000.
+        auto (bool, optional): Whether the batch is used by the automatic mode. Defaults to False.
+    """
+
+    def __init__(self, max_size=1000, auto=False):
+        self.max_size = max_size
+        self.auto = auto
+        self.pending = []
+        self.values = []
+        self.requests = 0
+        self.lock = threading.RLock()
+
+    def add(self, ee_object):
+        """Add an object to the batch.
+
+        Args:
+            ee_object (ee.ComputedObject): Object to evaluate.
+
+        Returns:
+            DeferredValue: The value of the object, evaluated when the batch is evaluated or the value is first used.
+        """
+        value = DeferredValue(self)
+        with self.lock:
+            self.pending.append((ee_object, value))
+            if not self.auto:   # the automatic mode lives as long as the kernel, so only its pending values are kept
+                self.values.append(value)
+            full = len(self.pending) >= self.max_size
+        if full:
+            self.evaluate()
+        return value
+
+    def evaluate(self):
+        """Evaluate the pending objects with one request.
+
+        Returns:
+            list: Values of all the objects added to the batch, in order. Empty in the automatic mode.
+        """
+        import ee
+
+        with self.lock:
+            pending, self.pending = self.pending, []
+            if pending:
+                self.requests += 1
+                try:
+                    packed = ee.Dictionary({str(index): ee_object for index, (ee_object, _) in enumerate(pending)})
+                    results = ee.data.computeValue(packed)
+                except ee.EEException:
+                    for ee_object, value in pending:
+                        self.requests += 1
+                        try:
+                            value._set(ee.data.computeValue(ee_object))
+                        except Exception as e:
+                            value._set(error=e)
+                except Exception as e:
+                    # Not a computation error (e.g. the connection or the credentials): every value shares it.
+                    for _, value in pending:
+                        value._set(error=e)
+                    raise
+                else:
+                    for index, (_, value) in enumerate(pending):
+                        value._set(results.get(str(index)))
+
+        return [value.value for value in self.values]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.evaluate()
+
+
+def get_info_all(*ee_objects):
+    """Evaluate Earth Engine objects with one request.
+
+    Args:
+        *ee_objects (ee.ComputedObject): Objects to evaluate.
+
+    Returns:
+        list: Client-side values of the objects, in order.
+    """
+    batch = GetInfoBatch(max_size=len(ee_objects) + 1)
+    for ee_object in ee_objects:
+        batch.add(ee_object)
+    return batch.evaluate()
+
+
+AUTO_BATCH = None
+ORIGINAL_GET_INFO = None
+
+
+def enable_auto_batching(max_size=1000):
+    """Make getInfo() return DeferredValues that are evaluated together the first time one of them is used.
+
+    Consecutive getInfo() calls whose results are not used in between, e.g.
+        count = collection.size().getInfo()
+        dates = dates.getInfo()
+    then cost one request. Code that needs the exact type of a getInfo() result (isinstance(), json.dumps())
+    should use DeferredValue.value.
+
+    Args:
+        max_size (int, optional): Number of pending getInfo() calls after which they are evaluated. Defaults to 1000.
+    """
+    import ee
+
+    global AUTO_BATCH, ORIGINAL_GET_INFO
+    if ORIGINAL_GET_INFO is None:
+        ORIGINAL_GET_INFO = ee.ComputedObject.getInfo
+    AUTO_BATCH = GetInfoBatch(max_size, auto=True)
+
+    def getInfo(self, *args, **kwargs):
+        if args or kwargs:   # e.g. a callback
+            return ORIGINAL_GET_INFO(self, *args, **kwargs)
+        return AUTO_BATCH.add(self)
+
+    ee.ComputedObject.getInfo = getInfo
+
+
+def disable_auto_batching():
+    """Evaluate the pending getInfo() calls and restore the original getInfo()."""
+    import ee
+
+    global AUTO_BATCH, ORIGINAL_GET_INFO
+    if ORIGINAL_GET_INFO is None:
+        return
+    AUTO_BATCH.evaluate()
+    ee.ComputedObject.getInfo = ORIGINAL_GET_INFO
+    AUTO_BATCH = None
+    ORIGINAL_GET_INFO = None
@@ -0,0 +1,467 @@
+''' Persistent cache of getInfo() results, keyed by the expression graph that Earth Engine evaluates.
+
+Rerunning a notebook such as Reducer/zonal_statistics.py sends the same expressions to the server again. With the
+cache enabled, every evaluation (getInfo(), and the batches of Template/getinfo_batch.py) is looked up by the
+SHA-256 of its canonical serialized expression first:
+
+    from getinfo_cache import enable_cache
+    enable_cache()
+
+The results are stored in an SQLite file shared by all the kernels of a machine, e.g. the kernels of a Voila
+deployment. The file is capped in size and the least recently used results are evicted first. Each result
+expires after the TTL of the datasets its expression loads (see DATASET_TTLS). Expressions that can give a
+different result for the same graph are evaluated but never cached:
+    * non-deterministic algorithms called without an explicit seed, e.g. randomPoints(),
+    * collections that keep receiving new images (see TIME_VARYING_DATASETS) that are not limited to a date
+      range ending in the past.
+
+The hit and miss counters of all the kernels are kept in the cache file. To print them as JSON:
+
+    python getinfo_cache.py --stats
+
+'''
+
+# License: MIT
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import datetime
+import threading
+
+
+CACHE_FILE = os.environ.get('EE_GETINFO_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'ee_getinfo_cache.sqlite'))
+
+# Algorithms whose result depends on a seed argument, and algorithms that are never deterministic (None).
+NON_DETERMINISTIC = {
+    'FeatureCollection.randomPoints': 'seed',
+    'Collection.randomColumn': 'seed',
+    'Image.random': 'seed',
+    'Image.randomVisualizer': None,
+    'Classifier.smileRandomForest': 'seed',
+    'Clusterer.wekaKMeans': 'seed',
+}
+
+# Collections that keep receiving new images, by asset ID prefix.
+TIME_VARYING_DATASETS = [
+    'COPERNICUS/S1_GRD', 'COPERNICUS/S2', 'COPERNICUS/S3', 'COPERNICUS/S5P',
+    'LANDSAT/LC08', 'LANDSAT/LC09', 'LANDSAT/LE07',
+    'MODIS/006', 'MODIS/061', 'MODIS/NTSG',
+    'NOAA/GOES', 'NOAA/GFS0P25', 'NOAA/VIIRS', 'NOAA/CFSV2',
+    'ECMWF/ERA5', 'ECMWF/ERA5_LAND', 'NASA/GPM_L3', 'NASA/GLDAS', 'JAXA/GPM_L3',
+    'UCSB-CHG/CHIRPS/DAILY', 'IDAHO_EPSCOR/GRIDMET', 'IDAHO_EPSCOR/TERRACLIMATE',
+]
+
+# Seconds a result stays valid, by asset ID prefix. The longest matching prefix wins; the shortest TTL of all the
+# datasets of an expression applies.
+DATASET_TTLS = {
+    'users/': 3600,
+    'projects/': 3600,
+    'USDA/NAIP/DOQQ': 86400,
+    'USGS/SRTMGL1_003': 365 * 86400,
+    'CGIAR/SRTM90_V4': 365 * 86400,
+    'JRC/GSW1_0': 30 * 86400,
+    'JRC/GSW1_1': 30 * 86400,
+}
+
+LOAD_FUNCTIONS = {
+    'Image.load': 'id',
+    'ImageCollection.load': 'id',
+    'Collection.loadTable': 'tableId',
+}
+# Loads of collections, which grow, unlike the loads of single images.
+COLLECTION_LOADS = ['ImageCollection.load', 'Collection.loadTable']
+
+
+def canonical_json(expression):
+    """Encode a serialized expression as canonical JSON, with sorted keys and no whitespace.
+
+    Args:
+        expression (dict): Serialized expression, e.g. from ee.serializer.encode(obj, for_cloud_api=True).
+
+    Returns:
+        str: Canonical JSON.
+    """
+    return json.dumps(expression, sort_keys=True, separators=(',', ':'))
+
+
+def expression_key(expression):
+    """Compute the cache key of a serialized expression.
+
+    Args:
+        expression (dict): Serialized expression.
+
+    Returns:
+        str: Hex SHA-256 of the canonical JSON.
+    """
+    return hashlib.sha256(canonical_json(expression).encode('utf-8')).hexdigest()
+
+
+def root_node(expression):
+    return {'valueReference': expression['result']} if 'result' in expression else expression
+
+
+def invocations(expression, node=None):
+    """Iterate over the function invocations of a serialized expression.
+
+    Args:
+        expression (dict): Serialized expression, with or without a table of shared 'values'.
+        node (dict, optional): Node of the expression to start from. Defaults to None, which uses the whole expression.
+
+    Yields:
+        tuple: Function name and arguments of every invocation, with value references resolved.
+    """
+    values = expression.get('values', {})
+    stack = [root_node(expression) if node is None else node]
+    seen = set()
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+            continue
+        if not isinstance(node, dict):
+            continue
+        if 'valueReference' in node:
+            if node['valueReference'] not in seen:
+                seen.add(node['valueReference'])
+                stack.append(values.get(node['valueReference']))
+            continue
+        if 'constantValue' in node:
+            continue
+        invocation = node.get('functionInvocationValue')
+        if invocation is not None:
+            yield invocation.get('functionName'), invocation.get('arguments', {})
+        stack.extend(value for key, value in node.items() if key != 'values')
+
+
+def constant(expression, node):
+    """Get the constant value of a node of a serialized expression, following references and ee.Date() calls.
+
+    Args:
+        expression (dict): Serialized expression.
+        node (dict): Node of the expression.
+
+    Returns:
+        object: The constant, or None if the node is not constant.
+    """
+    values = expression.get('values', {})
+    while isinstance(node, dict) and 'valueReference' in node:
+        node = values.get(node['valueReference'])
+    if not isinstance(node, dict):
+        return None
+    if 'constantValue' in node:
+        return node['constantValue']
+    invocation = node.get('functionInvocationValue', {})
+    if invocation.get('functionName') == 'Date':
+        return constant(expression, invocation.get('arguments', {}).get('value'))
+    return None
+
+
+def to_timestamp(value):
+    """Convert an Earth Engine date constant to seconds since the epoch.
+
+    Args:
+        value (object): Milliseconds since the epoch, or an ISO date string.
+
+    Returns:
+        float: Seconds since the epoch, or None if the value is not a date.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value / 1000.0
+    if isinstance(value, str):
+        try:
+            date = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+        if date.tzinfo is None:
+            date = date.replace(tzinfo=datetime.timezone.utc)
+        return date.timestamp()
+    return None
+
+
+def datasets(expression):
+    """Get the asset IDs loaded by a serialized expression.
+
+    Args:
+        expression (dict): Serialized expression.
+
+    Returns:
+        set: Asset IDs.
+    """
+    ids = set()
+    for name, arguments in invocations(expression):
+        if name in LOAD_FUNCTIONS:
+            asset_id = constant(expression, arguments.get(LOAD_FUNCTIONS[name]))
+            if isinstance(asset_id, str):
+                ids.add(asset_id)
+    return ids
+
+
+def ends_in_past(expression, node, now):
+    """Check whether a node of a serialized expression, e.g. a filter, contains a date range ending before now."""
+    for name, arguments in invocations(expression, node):
+        if name == 'DateRange':
+            end = to_timestamp(constant(expression, arguments.get('end')))
+            if end is not None and end <= now:
+                return True
+    return False
+
+
+def unbounded_collections(expression, now):
+    """Get the collections an expression loads without a filter limiting them to a date range ending in the past.
+
+    Each collection load is checked on its own: a date filter only bounds the loads below the collection it filters.
+
+    Args:
+        expression (dict): Serialized expression.
+        now (float): Current time in seconds since the epoch.
+
+    Returns:
+        list: Asset IDs.
+    """
+    values = expression.get('values', {})
+    ids = []
+    stack = [(root_node(expression), False)]
+    seen = set()
+    while stack:
+        node, bounded = stack.pop()
+        if isinstance(node, list):
+            stack.extend((item, bounded) for item in node)
+            continue
+        if not isinstance(node, dict) or 'constantValue' in node:
+            continue
+        if 'valueReference' in node:
+            if (node['valueReference'], bounded) not in seen:
+                seen.add((node['valueReference'], bounded))
+                stack.append((values.get(node['valueReference']), bounded))
+            continue
+        invocation = node.get('functionInvocationValue')
+        if invocation is not None:
+            name, arguments = invocation.get('functionName'), invocation.get('arguments', {})
+            if name in COLLECTION_LOADS and not bounded:
+                asset_id = constant(expression, arguments.get(LOAD_FUNCTIONS[name]))
+                if isinstance(asset_id, str):
+                    ids.append(asset_id)
+            if name == 'Collection.filter' and ends_in_past(expression, arguments.get('filter'), now):
+                stack.extend((value, bounded or key == 'collection') for key, value in arguments.items())
+                continue
+        stack.extend((value, bounded) for key, value in node.items() if key != 'values')
+    return ids
+
+
+def uncacheable_reason(expression, now=None):
+    """Check whether the result of a serialized expression may change while its graph stays the same.
+
+    Args:
+        expression (dict): Serialized expression.
+        now (float, optional): Current time in seconds since the epoch. Defaults to None, which uses time.time().
+
+    Returns:
+        str: Why the result must not be cached, or None if it can be cached.
+    """
+    now = time.time() if now is None else now
+    for name, arguments in invocations(expression):
+        if name in NON_DETERMINISTIC:
+            seed = NON_DETERMINISTIC[name]
+            if seed is None or seed not in arguments:
+                return '{} without a seed'.format(name)
+
+    for asset_id in unbounded_collections(expression, now):
+        if any(asset_id.startswith(prefix) for prefix in TIME_VARYING_DATASETS):
+            return '{} receives new images'.format(asset_id)
+    return None
+
+
+class GetInfoCache:
+    """Size-capped LRU cache of evaluated expressions, stored in SQLite.
+
+    Args:
+        cache_file (str, optional): File path of the cache. Defaults to CACHE_FILE, which can be set with the EE_GETINFO_CACHE environment variable.
+        max_bytes (int, optional): Maximum total size of the cached results. Defaults to 256 MB.
+        default_ttl (float, optional): Seconds a result stays valid if none of its datasets is in ttls. Defaults to 7 days.
+        ttls (dict, optional): Seconds a result stays valid, by asset ID prefix. Defaults to None, which uses DATASET_TTLS.
+    """
+
+    def __init__(self, cache_file=CACHE_FILE, max_bytes=256 * 1024 * 1024, default_ttl=7 * 86400, ttls=None):
+        self.cache_file = cache_file
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.ttls = DATASET_TTLS if ttls is None else ttls
+        self.counters = {'hits': 0, 'misses': 0, 'uncacheable': 0, 'evictions': 0}
+        self.lock = threading.Lock()
+
+        cache_dir = os.path.dirname(os.path.abspath(cache_file))
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.db = sqlite3.connect(cache_file, timeout=30, check_same_thread=False)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS results '
+                            '(key TEXT PRIMARY KEY, value TEXT, size INTEGER, expires REAL, accessed REAL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, count INTEGER)')
+
+    def ttl(self, expression):
+        """Get the number of seconds the result of an expression stays valid.
+
+        Args:
+            expression (dict): Serialized expression.
+
+        Returns:
+            float: The shortest TTL of the datasets of the expression.
+        """
+        ttls = []
+        for asset_id in datasets(expression):
+            prefixes = [prefix for prefix in self.ttls if asset_id.startswith(prefix)]
+            ttls.append(self.ttls[max(prefixes, key=len)] if prefixes else self.default_ttl)
+        return min(ttls) if ttls else self.default_ttl
+
+    def count(self, name):
+        self.counters[name] += 1
+        self.db.execute('INSERT INTO counters VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET count = count + 1', (name,))
+
+    def get(self, key):
+        """Look up a result.
+
+        Args:
+            key (str): Cache key, see expression_key().
+
+        Returns:
+            tuple: Whether the result was found and not expired, and the result.
+        """
+        now = time.time()
+        with self.lock, self.db:
+            row = self.db.execute('SELECT value, expires FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None or row[1] < now:
+                self.count('misses')
+                return False, None
+            self.db.execute('UPDATE results SET accessed = ? WHERE key = ?', (now, key))
+            self.count('hits')
+        return True, json.loads(row[0])
+
+    def put(self, key, value, ttl):
+        """Store a result and evict the least recently used results beyond max_bytes.
+
+        Args:
+            key (str): Cache key, see expression_key().
+            value (object): JSON-serializable result.
+            ttl (float): Seconds the result stays valid.
+        """
+        value = json.dumps(value)
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)', (key, value, len(value), now + ttl, now))
+            self.db.execute('DELETE FROM results WHERE expires < ?', (now,))
+            total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+            while total > self.max_bytes:
+                row = self.db.execute('SELECT key, size FROM results ORDER BY accessed LIMIT 1').fetchone()
+                if row is None:
+                    break
+                self.db.execute('DELETE FROM results WHERE key = ?', (row[0],))
+                self.count('evictions')
+                total -= row[1]
+
+    def compute(self, expression, evaluate):
+        """Get the result of an expression from the cache, or evaluate and cache it.
+
+        Args:
+            expression (dict): Serialized expression.
+            evaluate (function): Function evaluating the expression on the server.
+
+        Returns:
+            object: The result.
+        """
+        if uncacheable_reason(expression) is not None:
+            with self.lock, self.db:
+                self.count('uncacheable')
+            return evaluate()
+
+        key = expression_key(expression)
+        found, value = self.get(key)
+        if found:
+            return value
+        value = evaluate()
+        self.put(key, value, self.ttl(expression))
+        return value
+
+    def stats(self):
+        """Get the counters of this process and of all the processes sharing the cache file.
+
+        Returns:
+            dict: Counters of this process ('process'), of the cache file ('total'), and the number and size of the cached results.
+        """
+        with self.lock:
+            totals = dict(self.db.execute('SELECT name, count FROM counters').fetchall())
+            entries, size = self.db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+        lookups = totals.get('hits', 0) + totals.get('misses', 0)
+        return {
+            'process': dict(self.counters),
+            'total': totals,
+            'hit_rate': round(totals.get('hits', 0) / lookups, 4) if lookups else None,
+            'entries': entries,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+        }
+
+    def clear(self):
+        """Remove all the results and reset the counters."""
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM results')
+            self.db.execute('DELETE FROM counters')
+
+
+CACHE = None
+ORIGINAL_COMPUTE_VALUE = None
+
+
+def enable_cache(cache_file=CACHE_FILE, **kwargs):
+    """Cache the results of ee.data.computeValue(), which evaluates getInfo() calls.
+
+    Args:
+        cache_file (str, optional): File path of the cache. Defaults to CACHE_FILE.
+        **kwargs: Other arguments of GetInfoCache.
+
+    Returns:
+        GetInfoCache: The cache, e.g. to read its stats().
+    """
+    import ee
+
+    global CACHE, ORIGINAL_COMPUTE_VALUE
+    if ORIGINAL_COMPUTE_VALUE is None:
+        ORIGINAL_COMPUTE_VALUE = ee.data.computeValue
+    CACHE = GetInfoCache(cache_file, **kwargs)
+
+    def computeValue(obj):
+        expression = ee.serializer.encode(obj, for_cloud_api=True)
+        return CACHE.compute(expression, lambda: ORIGINAL_COMPUTE_VALUE(obj))
+
+    ee.data.computeValue = computeValue
+    return CACHE
+
+
+def disable_cache():
+    """Restore the original ee.data.computeValue()."""
+    import ee
+
+    global CACHE, ORIGINAL_COMPUTE_VALUE
+    if ORIGINAL_COMPUTE_VALUE is not None:
+        ee.data.computeValue = ORIGINAL_COMPUTE_VALUE
+    CACHE = None
+    ORIGINAL_COMPUTE_VALUE = None
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Inspect the getInfo() cache.')
+    parser.add_argument('--cache-file', type=str, default=CACHE_FILE, help='Path to the cache file')
+    parser.add_argument('--stats', action='store_true', help='Print the hit/miss counters and the cache size as JSON')
+    parser.add_argument('--clear', action='store_true', help='Remove all the cached results')
+    args = parser.parse_args()
+
+    cache = GetInfoCache(args.cache_file)
+    if args.clear:
+        cache.clear()
+    if args.stats or not args.clear:
+        print(json.dumps(cache.stats(), indent=2))
@@ -0,0 +1,237 @@
+''' Local, vectorized ee.Algorithms.Landsat.simpleCloudScore() for Landsat TOA scenes saved as .npy files.
+
+Algorithms/landsat_cloud_score.py, ImageCollection/sort_by_cloud_and_date.py and MachineLearning/confusion_matrix.py
+mask clouds with simpleCloudScore(). For offline checks on many scenes cached locally (e.g. with tiled_download.py),
+score_scenes() computes the same score:
+    * each scene is read from its memory-mapped .npy file in row chunks, and only the seven bands the score needs,
+    * the score of a chunk is computed with whole-array NumPy operations, updating one buffer in place,
+    * the scenes run on a process pool, one scene per task, and each writes a score raster (0-100, NaN where the
+      scene is masked) and a cloud mask raster (1 cloud, 0 clear, 255 masked).
+
+    score_scenes(glob.glob('scenes/*.npy'), 'scores', sensor='OLI_TIRS', threshold=20)
+
+The score is the minimum of several indicators of cloudiness, each rescaled linearly:
+    * brightness in the blue band, between 0.1 and 0.3,
+    * brightness in the visible bands, between 0.2 and 0.8,
+    * brightness in the infrared bands, between 0.3 and 0.8,
+    * coolness of the thermal band, between 300 K and 290 K,
+    * not snow: an NDSI (green, swir1) between 0.8 and 0.6,
+clamped to [0, 1] and multiplied by 100.
+
+Running the module checks the score against a direct implementation and benchmarks synthetic scenes:
+
+    python local_cloud_score.py --scenes 24 --size 2000 --workers 4
+
+'''
+
+# License: MIT
+
+import os
+import time
+import argparse
+
+from memmap_chunks import CHUNK_BYTES, open_output, open_stack, peak_memory, row_chunks, run_chunks
+
+
+# Band names of the TOA collections, in the order of their images, and the bands the score needs.
+SENSOR_BANDS = {
+    'OLI_TIRS': ['B1', 'B2', 'B3', 'B4', 'B5', 'B6', 'B7', 'B8', 'B9', 'B10', 'B11', 'BQA'],
+    'ETM+': ['B1', 'B2', 'B3', 'B4', 'B5', 'B6_VCID_1', 'B6_VCID_2', 'B7', 'B8', 'BQA'],
+    'TM': ['B1', 'B2', 'B3', 'B4', 'B5', 'B6', 'B7', 'BQA'],
+}
+SCORE_BANDS = {
+    'OLI_TIRS': {'blue': 'B2', 'green': 'B3', 'red': 'B4', 'nir': 'B5', 'swir1': 'B6', 'swir2': 'B7', 'temp': 'B10'},
+    'ETM+': {'blue': 'B1', 'green': 'B2', 'red': 'B3', 'nir': 'B4', 'swir1': 'B5', 'swir2': 'B7', 'temp': 'B6_VCID_1'},
+    'TM': {'blue': 'B1', 'green': 'B2', 'red': 'B3', 'nir': 'B4', 'swir1': 'B5', 'swir2': 'B7', 'temp': 'B6'},
+}
+
+
+def rescale_min(score, values, low, high):
+    """Lower the score to (values - low) / (high - low) where that is smaller, in place."""
+    import numpy as np
+
+    values -= low
+    values /= high - low
+    np.minimum(score, values, out=score)
+
+
+def cloud_score(bands):
+    """Compute the cloud score of arrays of TOA bands.
+
+    Args:
+        bands (dict): Arrays of 'blue', 'green', 'red', 'nir', 'swir1', 'swir2' reflectance and 'temp' in Kelvin.
+
+    Returns:
+        numpy.ndarray: float32 score from 0 to 100, NaN where any band is NaN.
+    """
+    import numpy as np
+
+    def band(name):
+        return np.array(bands[name], dtype='float32')
+
+    score = np.ones(np.shape(bands['blue']), dtype='float32')
+    rescale_min(score, band('blue'), 0.1, 0.3)
+    visible = band('red')
+    visible += bands['green']
+    visible += bands['blue']
+    rescale_min(score, visible, 0.2, 0.8)
+    infrared = visible   # reuse the buffer
+    np.add(bands['nir'], bands['swir1'], out=infrared, dtype='float32')
+    infrared += bands['swir2']
+    rescale_min(score, infrared, 0.3, 0.8)
+    rescale_min(score, band('temp'), 300, 290)
+    green = band('green')
+    ndsi = np.subtract(green, bands['swir1'], dtype='float32')
+    green += bands['swir1']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ndsi /= green
+    rescale_min(score, ndsi, 0.8, 0.6)
+
+    np.clip(score, 0, 1, out=score)   # NaN from masked bands passes through np.minimum() and np.clip()
+    score *= 100
+    return score
+
+
+def score_scene(in_file, score_file, mask_file, sensor='OLI_TIRS', band_names=None, threshold=20, nodata=None,
+                chunk_bytes=CHUNK_BYTES):
+    """Score one scene, chunk by chunk.
+
+    Args:
+        in_file (str): .npy scene of shape (bands, height, width) with TOA reflectance and brightness temperature.
+        score_file (str): Output .npy file of the float32 score.
+        mask_file (str): Output .npy file of the uint8 cloud mask: 1 where the score is above threshold, 0 below, 255 where masked.
+        sensor (str, optional): 'OLI_TIRS' (Landsat 8), 'ETM+' (Landsat 7) or 'TM' (Landsat 5). Defaults to 'OLI_TIRS'.
+        band_names (list, optional): Band names of the scene, in order. Defaults to None, which uses SENSOR_BANDS.
+        threshold (float, optional): Score above which a pixel is cloudy. Defaults to 20.
+        nodata (float, optional): Value of masked pixels in the scene. Defaults to None. NaN is always masked.
+        chunk_bytes (int, optional): Maximum bytes of the scene read per chunk. Defaults to CHUNK_BYTES.
+
+    Returns:
+        dict: Scene file, number of 'cloudy' and 'clear' pixels, and the 'seconds' it took.
+    """
+    import numpy as np
+
+    start_time = time.time()
+    band_names = band_names or SENSOR_BANDS[sensor]
+    indices = {name: band_names.index(band) for name, band in SCORE_BANDS[sensor].items()}
+    scene = open_stack(in_file)
+    _, height, width = scene.shape
+    score_out = open_output(score_file, (height, width), 'float32')
+    mask_out = open_output(mask_file, (height, width), 'uint8')
+
+    cloudy = clear = 0
+    for start, stop in row_chunks(height, len(indices) * width * 4 * 3, chunk_bytes):
+        bands = {}
+        for name, index in indices.items():
+            values = np.array(scene[index, start:stop], dtype='float32')
+            if nodata is not None:
+                values[values == nodata] = np.nan
+            bands[name] = values
+        score = cloud_score(bands)
+        masked = np.isnan(score)
+        cloudy_pixels = score > threshold
+        score_out[start:stop] = score
+        mask_out[start:stop] = np.where(masked, 255, cloudy_pixels)
+        cloudy += int(cloudy_pixels.sum())
+        clear += int((~masked).sum()) - int(cloudy_pixels.sum())
+    score_out.flush()
+    mask_out.flush()
+    return {'scene': in_file, 'cloudy': cloudy, 'clear': clear, 'seconds': time.time() - start_time}
+
+
+def score_scenes(files, out_dir, sensor='OLI_TIRS', band_names=None, threshold=20, nodata=None, workers=None,
+                 processes=True, chunk_bytes=CHUNK_BYTES, verbose=True):
+    """Score many scenes on a pool, one scene per task.
+
+    Args:
+        files (list): .npy scenes, see score_scene().
+        out_dir (str): Folder of the outputs <scene>_score.npy and <scene>_cloud.npy.
+        sensor (str, optional): Sensor of the scenes. Defaults to 'OLI_TIRS'.
+        band_names (list, optional): Band names of the scenes. Defaults to None, which uses SENSOR_BANDS.
+        threshold (float, optional): Score above which a pixel is cloudy. Defaults to 20.
+        nodata (float, optional): Value of masked pixels. Defaults to None.
+        workers (int, optional): Number of workers. Defaults to None, which uses one per CPU.
+        processes (bool, optional): Whether to use processes rather than threads. Defaults to True.
+        chunk_bytes (int, optional): Maximum bytes of a scene read per chunk. Defaults to CHUNK_BYTES.
+        verbose (bool, optional): Whether to print the progress. Defaults to True.
+
+    Returns:
+        list: Results of score_scene() for each scene.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    tasks = []
+    for in_file in files:
+        name = os.path.splitext(os.path.basename(in_file))[0]
+        tasks.append((os.path.abspath(in_file), os.path.join(out_dir, name + '_score.npy'),
+                      os.path.join(out_dir, name + '_cloud.npy'), sensor, band_names, threshold, nodata, chunk_bytes))
+    return run_chunks(score_scene, tasks, workers, processes, verbose)
+
+
+def reference_score(scene, sensor='OLI_TIRS'):
+    """Direct transcription of simpleCloudScore(), without chunks or in-place updates, to check cloud_score()."""
+    import numpy as np
+
+    bands = {name: scene[SENSOR_BANDS[sensor].index(band)].astype('float64')
+             for name, band in SCORE_BANDS[sensor].items()}
+
+    def rescale(values, low, high):
+        return (values - low) / (high - low)
+
+    score = np.ones_like(bands['blue'])
+    score = np.minimum(score, rescale(bands['blue'], 0.1, 0.3))
+    score = np.minimum(score, rescale(bands['red'] + bands['green'] + bands['blue'], 0.2, 0.8))
+    score = np.minimum(score, rescale(bands['nir'] + bands['swir1'] + bands['swir2'], 0.3, 0.8))
+    score = np.minimum(score, rescale(bands['temp'], 300, 290))
+    ndsi = (bands['green'] - bands['swir1']) / (bands['green'] + bands['swir1'])
+    score = np.minimum(score, rescale(ndsi, 0.8, 0.6))
+    return np.clip(score, 0, 1) * 100
+
+
+def synthetic_scene(rng, size, sensor='OLI_TIRS'):
+    """Random TOA scene with clear land, bright clouds and snow."""
+    import numpy as np
+
+    scene = rng.uniform(0.02, 0.4, size=(len(SENSOR_BANDS[sensor]), size, size)).astype('float32')
+    temp = SENSOR_BANDS[sensor].index(SCORE_BANDS[sensor]['temp'])
+    scene[temp] = rng.uniform(280, 310, size=(size, size))
+    clouds = rng.random((size, size)) < 0.3
+    scene[:temp, clouds] += 0.4
+    scene[:, rng.random((size, size)) < 0.01] = np.nan
+    return scene
+
+
+if __name__ == '__main__':
+
+    import tempfile
+    import numpy as np
+
+    parser = argparse.ArgumentParser(description='Check the local cloud score and benchmark it on synthetic scenes.')
+    parser.add_argument('--scenes', type=int, default=12, help='Number of synthetic scenes')
+    parser.add_argument('--size', type=int, default=1000, help='Rows and columns of each scene')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes')
+    parser.add_argument('--threads', action='store_true', help='Use threads instead of processes')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as work_dir:
+        small = synthetic_scene(rng, 200)
+        np.save(os.path.join(work_dir, 'small.npy'), small)
+        score_scene(os.path.join(work_dir, 'small.npy'), os.path.join(work_dir, 'small_score.npy'),
+                    os.path.join(work_dir, 'small_cloud.npy'), chunk_bytes=200 * 7 * 4 * 3 * 9)
+        score = np.load(os.path.join(work_dir, 'small_score.npy'))
+        expected = reference_score(small)
+        assert np.array_equal(np.isnan(score), np.isnan(expected))
+        assert np.allclose(score, expected, atol=1e-3, equal_nan=True)
+        print('Score matches the direct implementation, {:.0f}% cloudy: OK'.format(
+            np.mean(np.load(os.path.join(work_dir, 'small_cloud.npy')) == 1) * 100))
+
+        files = []
+        for index in range(args.scenes):
+            files.append(os.path.join(work_dir, 'scene_{:03d}.npy'.format(index)))
+            np.save(files[-1], synthetic_scene(rng, args.size))
+        start_time = time.time()
+        results = score_scenes(files, os.path.join(work_dir, 'scores'), workers=args.workers,
+                               processes=not args.threads, chunk_bytes=64 * 1024 ** 2, verbose=False)
+        elapsed = time.time() - start_time
+        print('{} scenes of {}x{} pixels in {:.1f}s: {:.1f} scenes/minute, peak memory {:.0f} MB'.format(
+            len(results), args.size, args.size, elapsed, len(results) / elapsed * 60, (peak_memory() or 0) / 1e6))
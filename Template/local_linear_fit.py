@@ -0,0 +1,223 @@
+''' Local per-pixel linear trend of an image time series too large for memory, like ee.Reducer.linearFit().
+
+Algorithms/ntl_linear_fit.py and ImageCollection/linear_fit.py fit the nighttime lights of each pixel against
+the years since 1990. linear_fit() computes the same 'scale' (slope) and 'offset' (intercept) from a stack of
+shape (time, height, width) in a memory-mapped .npy file:
+    * the rows of the stack are split into chunks, which run on a process pool,
+    * within a chunk, the time slices are read one at a time and folded into per-pixel running means and
+      co-moments (Welford's update), so the stack is never held in memory and no precision is lost to large sums,
+    * the fit then follows in closed form: scale = Cxy / Cxx, offset = mean(y) - scale * mean(x).
+Optionally, the residual variance and the number of observations behind each fit are written too.
+
+    linear_fit('dmsp_avg_vis.npy', 'trend.npy', years_since(dates, '1990-01-01'))
+
+Masked observations (NaN or nodata) are skipped per pixel; pixels with fewer than two observations, or with all
+their observations at the same time, are NaN. Running the module checks the fit against NumPy:
+
+    python local_linear_fit.py --size 2000
+
+'''
+
+# License: MIT
+
+import os
+import time
+import argparse
+from datetime import date
+
+from memmap_chunks import CHUNK_BYTES, open_output, open_stack, peak_memory, row_chunks, run_chunks
+
+
+def years_since(dates, origin='1990-01-01'):
+    """Convert dates to fractional years since an origin, like ee.Date.difference(origin, 'year'): whole calendar
+    years, plus the elapsed share of the next one.
+
+    Args:
+        dates (list): Dates as 'YYYY-MM-DD' strings or datetime.date.
+        origin (str, optional): Origin date. Defaults to '1990-01-01'.
+
+    Returns:
+        list: Years since the origin.
+    """
+    def to_date(value):
+        return date.fromisoformat(value[:10]) if isinstance(value, str) else value
+
+    def shift(years):   # the origin moved by whole calendar years
+        try:
+            return origin.replace(year=origin.year + years)
+        except ValueError:   # 29 February
+            return origin.replace(year=origin.year + years, day=28)
+
+    origin = to_date(origin)
+    years = []
+    for value in map(to_date, dates):
+        # Whole calendar years, then the fraction of the year that follows, as Earth Engine counts them.
+        whole = value.year - origin.year
+        if shift(whole) > value:
+            whole -= 1
+        start, end = shift(whole), shift(whole + 1)
+        years.append(whole + (value - start).days / (end - start).days)
+    return years
+
+
+class TrendAccumulator:
+    """Per-pixel running means and co-moments of time (x) and value (y).
+
+    Args:
+        shape (tuple): Shape of the pixels.
+    """
+
+    def __init__(self, shape):
+        import numpy as np
+
+        self.n = np.zeros(shape, dtype='int32')
+        self.mean_x = np.zeros(shape)
+        self.mean_y = np.zeros(shape)
+        self.cxx = np.zeros(shape)
+        self.cxy = np.zeros(shape)
+        self.cyy = np.zeros(shape)
+
+    def update(self, x, y, valid):
+        """Add one time slice.
+
+        Args:
+            x (float): Time of the slice.
+            y (numpy.ndarray): Values of the slice.
+            valid (numpy.ndarray): Whether each value is an observation.
+        """
+        import numpy as np
+
+        self.n += valid
+        n = np.maximum(self.n, 1)
+        dx = np.where(valid, x - self.mean_x, 0)
+        dy = np.where(valid, y - self.mean_y, 0)
+        self.mean_x += dx / n
+        self.mean_y += dy / n
+        # The products use the deviations from the old and the new means, which keeps the update exact.
+        self.cxx += dx * (x - self.mean_x)
+        self.cxy += dx * np.where(valid, y - self.mean_y, 0)
+        self.cyy += dy * np.where(valid, y - self.mean_y, 0)
+
+    def fit(self, residuals=False, count=False):
+        """Get the least-squares fit of each pixel.
+
+        Returns:
+            list: Arrays of the scale, offset, optionally the residual variance (n - 2 degrees of freedom) and count.
+        """
+        import numpy as np
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fitted = (self.n >= 2) & (self.cxx > 0)
+            scale = np.where(fitted, self.cxy / self.cxx, np.nan)
+            offset = np.where(fitted, self.mean_y - scale * self.mean_x, np.nan)
+            bands = [scale, offset]
+            if residuals:
+                variance = np.maximum(self.cyy - scale * self.cxy, 0) / (self.n - 2)
+                bands.append(np.where(fitted & (self.n > 2), variance, np.nan))
+        if count:
+            bands.append(self.n)
+        return bands
+
+
+def fit_chunk(in_file, out_file, times, start, stop, band, nodata, residuals, count):
+    """Fit the rows [start, stop) of a stack, reading one time slice at a time, and write them into the output."""
+    import numpy as np
+
+    stack = open_stack(in_file)
+    accumulator = TrendAccumulator((stop - start, stack.shape[-1]))
+    for index, x in enumerate(times):
+        values = stack[index, start:stop] if stack.ndim == 3 else stack[index, band, start:stop]
+        y = np.asarray(values, dtype='float64')
+        valid = ~np.isnan(y)
+        if nodata is not None:
+            valid &= y != nodata
+        accumulator.update(x, y, valid)
+
+    out = open_output(out_file, None, None)
+    for index, values in enumerate(accumulator.fit(residuals, count)):
+        out[index, start:stop] = values
+    out.flush()
+    return int(np.count_nonzero(~np.isnan(out[0, start:stop])))
+
+
+def linear_fit(in_file, out_file, times, band=0, nodata=None, residuals=False, count=False, workers=None,
+               chunk_bytes=CHUNK_BYTES, verbose=True):
+    """Fit a linear trend to every pixel of a stack.
+
+    Args:
+        in_file (str): .npy stack of shape (time, height, width), or (time, bands, height, width) with band.
+        out_file (str): Output float32 .npy file with the bands 'scale', 'offset', then 'residual_variance' and 'count' if asked.
+        times (list): Time of each slice, e.g. from years_since().
+        band (int, optional): Band of a 4-D stack. Defaults to 0.
+        nodata (float, optional): Value of masked observations. Defaults to None. NaN is always masked.
+        residuals (bool, optional): Whether to add the residual variance of each fit. Defaults to False.
+        count (bool, optional): Whether to add the number of observations of each fit. Defaults to False.
+        workers (int, optional): Number of worker processes. Defaults to None, which uses one per CPU.
+        chunk_bytes (int, optional): Maximum bytes of the per-pixel accumulators of a chunk. Defaults to CHUNK_BYTES.
+        verbose (bool, optional): Whether to print the progress. Defaults to True.
+
+    Returns:
+        list: Band names of the output.
+    """
+    stack = open_stack(in_file)
+    if len(times) != stack.shape[0]:
+        raise ValueError('Got {} times for {} time slices.'.format(len(times), stack.shape[0]))
+    height, width = stack.shape[-2:]
+    names = ['scale', 'offset'] + (['residual_variance'] if residuals else []) + (['count'] if count else [])
+    open_output(out_file, (len(names), height, width), 'float32').flush()
+
+    # Six float64 accumulators per pixel, and the temporaries of one update.
+    chunks = row_chunks(height, width * 8 * 12, chunk_bytes)
+    tasks = [(os.path.abspath(in_file), os.path.abspath(out_file), [float(x) for x in times], start, stop, band,
+              nodata, residuals, count) for start, stop in chunks]
+    fitted = sum(run_chunks(fit_chunk, tasks, workers, verbose=verbose))
+    if verbose:
+        print('{} of {} pixels fitted'.format(fitted, height * width))
+    return names
+
+
+if __name__ == '__main__':
+
+    import tempfile
+    import numpy as np
+
+    parser = argparse.ArgumentParser(description='Check the local linear fit against NumPy and time it.')
+    parser.add_argument('--years', type=int, default=22, help='Number of yearly slices, e.g. DMSP 1992-2013')
+    parser.add_argument('--size', type=int, default=1000, help='Rows and columns of the stack')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    times = years_since(['{}-01-01'.format(year) for year in range(1992, 1992 + args.years)])
+    shape = (args.size, args.size)
+    scale, offset = rng.normal(0.5, 0.2, size=shape), rng.uniform(0, 40, size=shape)
+    with tempfile.TemporaryDirectory() as work_dir:
+        in_file = os.path.join(work_dir, 'stack.npy')
+        stack = np.lib.format.open_memmap(in_file, mode='w+', dtype='float32', shape=(args.years,) + shape)
+        for index, x in enumerate(times):
+            stack[index] = offset + scale * x + rng.normal(0, 2, size=shape)
+            stack[index][rng.random(shape) < 0.2] = np.nan
+        stack[:, 0, 0] = np.nan       # no observation
+        stack[1:, 0, 1] = np.nan      # one observation
+        stack[0, 0, 1] = 1.0
+        stack.flush()
+
+        start_time = time.time()
+        out_file = os.path.join(work_dir, 'trend.npy')
+        linear_fit(in_file, out_file, times, residuals=True, count=True, workers=args.workers,
+                   chunk_bytes=16 * 1024 ** 2, verbose=False)
+        elapsed = time.time() - start_time
+
+        trend = np.load(out_file, mmap_mode='r')
+        assert np.isnan(trend[0, 0, :2]).all() and trend[3, 0, 0] == 0 and trend[3, 0, 1] == 1
+        assert years_since(['1991-01-01', '2000-01-01', '2000-07-02']) == [1, 10, 10 + 183 / 366]
+        x = np.array(times)
+        for row, col in rng.integers(0, args.size, size=(200, 2)):
+            y = np.asarray(stack[:, row, col], dtype='float64')
+            valid = ~np.isnan(y)
+            (slope, intercept), residual = np.polyfit(x[valid], y[valid], 1, full=True)[:2]
+            expected = [slope, intercept, residual[0] / (valid.sum() - 2), valid.sum()]
+            assert np.allclose(trend[:, row, col], expected, rtol=1e-4, atol=1e-4), (row, col)
+        print('Fit matches numpy.polyfit: OK')
+        print('{} years x {}x{} pixels ({:.0f} MB) in {:.1f}s, peak memory {:.0f} MB'.format(
+            args.years, args.size, args.size, os.path.getsize(in_file) / 1e6, elapsed, (peak_memory() or 0) / 1e6))
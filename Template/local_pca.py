@@ -0,0 +1,302 @@
+''' Local principal components and decorrelation stretch of a scene too large for memory.
+
+Array/eigen_analysis.py and Array/decorrelation_stretch.py go over the scene twice before transforming it: once
+for the band means and once for the centered covariance. Here the mean and covariance come out of one streaming
+pass: the scene (bands, height, width) is read from a memory-mapped .npy file in row chunks, each chunk is
+reduced to its pixel count, mean vector and co-moment matrix on a process pool, and the chunks are merged with the
+pairwise update of Chan et al., which stays exact without a global sum of squares. A second pass applies the
+transform chunk by chunk into a memory-mapped output, so memory use depends on the chunk size only.
+
+    principal_components('LC80440342014077.npy', 'pcs.npy')     # PCs divided by their SD, like the notebook
+    decorrelation_stretch('MCD43A4_2002_07_04.npy', 'dcs.npy')  # rotated to SD 30 around 127, as bytes
+
+As with toArray() in the notebooks, a pixel takes part only if none of its bands is masked (NaN or nodata), and
+it is masked in the output. Running the module checks the statistics and the transforms on a synthetic scene:
+
+    python local_pca.py --size 3000
+
+'''
+
+# License: MIT
+
+import os
+import time
+import argparse
+
+from memmap_chunks import CHUNK_BYTES, open_output, open_stack, peak_memory, row_chunks, run_chunks
+
+
+class MomentAccumulator:
+    """Pixel count, mean vector and co-moment matrix of the bands, mergeable across chunks.
+
+    Args:
+        bands (int): Number of bands.
+    """
+
+    def __init__(self, bands):
+        import numpy as np
+
+        self.n = 0
+        self.mean = np.zeros(bands)
+        self.comoment = np.zeros((bands, bands))
+
+    def update(self, pixels):
+        """Add pixels.
+
+        Args:
+            pixels (numpy.ndarray): Values of shape (bands, pixels).
+        """
+        other = MomentAccumulator(pixels.shape[0])
+        other.n = pixels.shape[1]
+        if other.n:
+            pixels = pixels.astype('float64')
+            other.mean = pixels.mean(axis=1)
+            pixels -= other.mean[:, None]   # centered within the chunk
+            other.comoment = pixels @ pixels.T
+        self.merge(other)
+
+    def merge(self, other):
+        """Add the pixels of another accumulator."""
+        if not other.n:
+            return self
+        total = self.n + other.n
+        delta = other.mean - self.mean
+        self.comoment = self.comoment + other.comoment + (delta[:, None] * delta[None, :]) * (self.n * other.n / total)
+        self.mean = self.mean + delta * (other.n / total)
+        self.n = total
+        return self
+
+    def covariance(self, ddof=1):
+        return self.comoment / (self.n - ddof)
+
+
+def valid_columns(chunk, nodata=None):
+    """Get the pixels of a chunk (bands, rows, cols) with all their bands unmasked.
+
+    Returns:
+        tuple: Boolean validity of shape (rows, cols), and the valid pixels of shape (bands, pixels).
+    """
+    import numpy as np
+
+    valid = np.ones(chunk.shape[1:], dtype=bool)
+    for band in chunk:
+        if np.issubdtype(band.dtype, np.floating):
+            valid &= ~np.isnan(band)
+        if nodata is not None:
+            valid &= band != nodata
+    return valid, chunk[:, valid]
+
+
+def accumulate_chunk(in_file, start, stop, nodata):
+    """Reduce the rows [start, stop) of a scene to a MomentAccumulator."""
+    import numpy as np
+
+    chunk = np.asarray(open_stack(in_file)[:, start:stop])
+    accumulator = MomentAccumulator(chunk.shape[0])
+    accumulator.update(valid_columns(chunk, nodata)[1])
+    return accumulator
+
+
+def transform_chunk(in_file, out_file, start, stop, matrix, offset, shift, nodata, out_nodata, clip):
+    """Write matrix @ (pixel - offset) + shift for the rows [start, stop) of a scene into the output."""
+    import numpy as np
+
+    chunk = np.asarray(open_stack(in_file)[:, start:stop])
+    valid, pixels = valid_columns(chunk, nodata)
+    values = matrix @ (pixels.astype('float64') - offset[:, None]) + shift
+    out = open_output(out_file, None, None)
+    if clip is not None:
+        values = np.clip(values, *clip)
+    result = np.full((matrix.shape[0],) + valid.shape, out_nodata, dtype=out.dtype)
+    result[:, valid] = values
+    out[:, start:stop] = result
+    out.flush()
+
+
+def band_moments(in_file, nodata=None, workers=None, chunk_bytes=CHUNK_BYTES, verbose=True):
+    """Compute the mean and co-moments of the bands of a scene in one pass.
+
+    Args:
+        in_file (str): .npy scene of shape (bands, height, width).
+        nodata (float, optional): Value of masked pixels. Defaults to None. NaN is always masked.
+        workers (int, optional): Number of worker processes. Defaults to None, which uses one per CPU.
+        chunk_bytes (int, optional): Maximum bytes of the scene read per chunk. Defaults to CHUNK_BYTES.
+        verbose (bool, optional): Whether to print the progress. Defaults to True.
+
+    Returns:
+        MomentAccumulator: Statistics of the unmasked pixels.
+    """
+    scene = open_stack(in_file)
+    bands, height, width = scene.shape
+    # The float64 copy of the chunk is the largest buffer.
+    chunks = row_chunks(height, bands * width * 8 * 2, chunk_bytes)
+    tasks = [(os.path.abspath(in_file), start, stop, nodata) for start, stop in chunks]
+    total = MomentAccumulator(bands)
+    for accumulator in run_chunks(accumulate_chunk, tasks, workers, verbose=verbose):
+        total.merge(accumulator)
+    return total
+
+
+def eigen(covariance):
+    """Eigen-decompose a covariance matrix like ee.Array.eigen().
+
+    Returns:
+        tuple: Eigenvalues in descending order, and the eigenvectors in rows.
+    """
+    import numpy as np
+
+    values, vectors = np.linalg.eigh(covariance)
+    order = values.argsort()[::-1]
+    return values[order], vectors[:, order].T
+
+
+def transform(in_file, out_file, matrix, offset, shift=0, nodata=None, dtype='float32', out_nodata=None, clip=None,
+              workers=None, chunk_bytes=CHUNK_BYTES, verbose=True):
+    """Apply matrix @ (pixel - offset) + shift to every pixel of a scene, chunk by chunk.
+
+    Args:
+        in_file (str): .npy scene of shape (bands, height, width).
+        out_file (str): Output .npy file of shape (rows of matrix, height, width).
+        matrix (numpy.ndarray): Transform matrix.
+        offset (numpy.ndarray): Value subtracted from each band first.
+        shift (float | numpy.ndarray, optional): Value added to each output band. Defaults to 0.
+        nodata (float, optional): Value of masked pixels in the scene. Defaults to None.
+        dtype (str, optional): Data type of the output. Defaults to 'float32'.
+        out_nodata (float, optional): Value of the masked output pixels. Defaults to None, which uses NaN for floats, or 0.
+        clip (tuple, optional): (min, max) the output values are clipped to. Defaults to None.
+        workers (int, optional): Number of worker processes. Defaults to None, which uses one per CPU.
+        chunk_bytes (int, optional): Maximum bytes of the scene read per chunk. Defaults to CHUNK_BYTES.
+        verbose (bool, optional): Whether to print the progress. Defaults to True.
+    """
+    import numpy as np
+
+    scene = open_stack(in_file)
+    bands, height, width = scene.shape
+    if out_nodata is None:
+        out_nodata = np.nan if np.issubdtype(np.dtype(dtype), np.floating) else 0
+    open_output(out_file, (matrix.shape[0], height, width), dtype).flush()
+    chunks = row_chunks(height, max(bands, matrix.shape[0]) * width * 8 * 3, chunk_bytes)
+    tasks = [(os.path.abspath(in_file), os.path.abspath(out_file), start, stop, matrix, offset,
+              np.reshape(shift, (-1, 1)), nodata, out_nodata, clip) for start, stop in chunks]
+    run_chunks(transform_chunk, tasks, workers, verbose=verbose)
+
+
+def principal_components(in_file, out_file, nodata=None, workers=None, chunk_bytes=CHUNK_BYTES, verbose=True):
+    """Compute the principal components of a scene, divided by their standard deviation, like Array/eigen_analysis.py.
+
+    Args:
+        in_file (str): .npy scene of shape (bands, height, width).
+        out_file (str): Output .npy file of the float32 components pc1, pc2, ... of shape (bands, height, width).
+        nodata (float, optional): Value of masked pixels. Defaults to None. NaN is always masked.
+        workers (int, optional): Number of worker processes. Defaults to None, which uses one per CPU.
+        chunk_bytes (int, optional): Maximum bytes of the scene read per chunk. Defaults to CHUNK_BYTES.
+        verbose (bool, optional): Whether to print the progress. Defaults to True.
+
+    Returns:
+        dict: 'mean', 'covariance', 'eigenvalues' and 'eigenvectors' (in rows) of the bands.
+    """
+    import numpy as np
+
+    moments = band_moments(in_file, nodata, workers, chunk_bytes, verbose)
+    covariance = moments.covariance()
+    values, vectors = eigen(covariance)
+    matrix = vectors / np.sqrt(values)[:, None]
+    transform(in_file, out_file, matrix, moments.mean, nodata=nodata, workers=workers, chunk_bytes=chunk_bytes,
+              verbose=verbose)
+    return {'mean': moments.mean, 'covariance': covariance, 'eigenvalues': values, 'eigenvectors': vectors}
+
+
+def decorrelation_stretch(in_file, out_file, target_sd=30, shift=127, nodata=None, workers=None,
+                          chunk_bytes=CHUNK_BYTES, verbose=True):
+    """Decorrelate the bands of a scene and stretch them, like Array/decorrelation_stretch.py.
+
+    The centered pixels are rotated onto the eigenvectors, scaled to target_sd, rotated back, shifted and cast to bytes.
+
+    Args:
+        in_file (str): .npy scene of shape (bands, height, width).
+        out_file (str): Output .npy file of uint8 bands of shape (bands, height, width), 0 where masked.
+        target_sd (float, optional): Standard deviation of the stretched bands. Defaults to 30.
+        shift (float, optional): Mean of the stretched bands. Defaults to 127.
+        nodata (float, optional): Value of masked pixels. Defaults to None. NaN is always masked.
+        workers (int, optional): Number of worker processes. Defaults to None, which uses one per CPU.
+        chunk_bytes (int, optional): Maximum bytes of the scene read per chunk. Defaults to CHUNK_BYTES.
+        verbose (bool, optional): Whether to print the progress. Defaults to True.
+
+    Returns:
+        dict: 'mean', 'covariance', 'eigenvalues', 'eigenvectors' and the 'rotation' matrix.
+    """
+    import numpy as np
+
+    moments = band_moments(in_file, nodata, workers, chunk_bytes, verbose)
+    covariance = moments.covariance()
+    values, vectors = eigen(covariance)
+    rotation = vectors.T @ np.diag(target_sd / np.sqrt(values)) @ vectors
+    transform(in_file, out_file, rotation, moments.mean, shift, nodata, 'uint8', 0, (0, 255), workers, chunk_bytes,
+              verbose)
+    return {'mean': moments.mean, 'covariance': covariance, 'eigenvalues': values, 'eigenvectors': vectors,
+            'rotation': rotation}
+
+
+if __name__ == '__main__':
+
+    import tempfile
+    import numpy as np
+
+    parser = argparse.ArgumentParser(description='Check the one-pass PCA and decorrelation stretch on a synthetic scene.')
+    parser.add_argument('--bands', type=int, default=8, help='Number of bands')
+    parser.add_argument('--size', type=int, default=1500, help='Rows and columns of the scene')
+    parser.add_argument('--workers', type=int, default=2, help='Number of worker processes, at least 2 to measure their memory')
+    parser.add_argument('--chunk-mb', type=int, default=32, help='Megabytes read per chunk')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    mixing = rng.normal(size=(args.bands, args.bands))
+    with tempfile.TemporaryDirectory() as work_dir:
+        in_file = os.path.join(work_dir, 'scene.npy')
+        scene = np.lib.format.open_memmap(in_file, mode='w+', dtype='float32', shape=(args.bands, args.size, args.size))
+        for row in range(0, args.size, 256):   # correlated bands with a large offset, written in blocks
+            rows = min(256, args.size - row)
+            block = mixing @ rng.normal(size=(args.bands, rows * args.size)) * 100 + 5000
+            scene[:, row:row + rows] = block.reshape(args.bands, rows, args.size)
+        scene[:, rng.random((args.size, args.size)) < 0.05] = np.nan
+        scene.flush()
+        del scene   # unmapped, so the forked workers do not inherit its resident pages
+
+        start_time = time.time()
+        stats = principal_components(in_file, os.path.join(work_dir, 'pcs.npy'), workers=args.workers,
+                                     chunk_bytes=args.chunk_mb * 1024 ** 2, verbose=False)
+        elapsed = time.time() - start_time
+
+        # Two-pass reference covariance, reading a band of rows at a time.
+        scene = np.load(in_file, mmap_mode='r')
+        count, total = 0, np.zeros(args.bands)
+        for row in range(0, args.size, 256):
+            pixels = valid_columns(np.asarray(scene[:, row:row + 256]))[1].astype('float64')
+            count, total = count + pixels.shape[1], total + pixels.sum(axis=1)
+        mean, products = total / count, np.zeros((args.bands, args.bands))
+        for row in range(0, args.size, 256):
+            pixels = valid_columns(np.asarray(scene[:, row:row + 256]))[1].astype('float64') - mean[:, None]
+            products += pixels @ pixels.T
+        assert np.allclose(stats['covariance'], products / (count - 1), rtol=1e-9)
+
+        sample = np.asarray(scene[:, :300])   # the other checks hold in memory only a band of rows
+        valid, pixels = valid_columns(sample)
+
+        small_file = os.path.join(work_dir, 'small.npy')
+        np.save(small_file, sample)
+        small = band_moments(small_file, workers=2, chunk_bytes=args.bands * args.size * 8 * 2 * 7, verbose=False)
+        assert np.allclose(small.mean, pixels.astype('float64').mean(axis=1), rtol=1e-12)
+        assert np.allclose(small.covariance(), np.cov(pixels.astype('float64')), rtol=1e-9)
+
+        pcs = np.load(os.path.join(work_dir, 'pcs.npy'), mmap_mode='r')
+        pc_pixels = np.asarray(pcs[:, :300])[:, valid]
+        assert np.isnan(pcs[0, :300][~valid]).all()
+        assert np.allclose(np.cov(pc_pixels), np.eye(args.bands), atol=0.05)
+
+        decorrelation_stretch(small_file, os.path.join(work_dir, 'dcs.npy'), workers=2, verbose=False)
+        dcs = np.load(os.path.join(work_dir, 'dcs.npy'))[:, valid].astype('float64')
+        assert np.allclose(np.cov(dcs), np.eye(args.bands) * 900, atol=40)
+        print('Mean, covariance, PCs and stretch match NumPy: OK')
+        print('PCA of {} bands x {}x{} pixels ({:.0f} MB) in {:.1f}s, peak worker memory {:.0f} MB'.format(
+            args.bands, args.size, args.size, os.path.getsize(in_file) / 1e6, elapsed,
+            (peak_memory(workers_only=True) or 0) / 1e6))
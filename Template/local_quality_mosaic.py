@@ -0,0 +1,206 @@
+''' Local qualityMosaic of an image stack too large for memory, matching Array/quality_mosaic.py.
+
+The notebook sorts the array of each pixel by its quality band with arraySort() and keeps the first row, i.e.
+for every pixel the values of the image with the highest quality. quality_mosaic() computes the same selection
+without sorting: it reads the stack (time, bands, height, width) from a memory-mapped .npy file in row chunks,
+takes the argmax of the quality over time in one vectorized pass per chunk, and gathers the other bands of the
+winning image. The chunks run on a process pool (see memmap_chunks.py).
+
+As with ImageCollection.toArray() in the notebook:
+    * an image takes part at a pixel only if none of its bands is masked there (NaN, nodata, or a mask file);
+      nodata applies to the other bands only, since a quality such as an NDVI of 0 is a valid value,
+    * ties go to the earliest image, like the stable arraySort(),
+    * pixels without any unmasked image are masked in the output,
+    * the quality band is dropped from the output.
+
+    quality_mosaic('l7_2000_stack.npy', 'greenest.npy', quality_band=0, nodata=0)
+
+Running the module checks the result against a per-pixel sort and times a synthetic stack:
+
+    python local_quality_mosaic.py --scenes 230 --size 1000
+
+'''
+
+# License: MIT
+
+import os
+import time
+import argparse
+
+from memmap_chunks import CHUNK_BYTES, open_output, open_stack, peak_memory, row_chunks, run_chunks
+
+
+def valid_pixels(stack, nodata=None, mask=None, quality_band=None):
+    """Get where an image of a stack has all its bands unmasked.
+
+    Args:
+        stack (numpy.ndarray): Values of shape (time, bands, rows, cols).
+        nodata (float, optional): Value of masked pixels. Defaults to None. NaN is always masked.
+        mask (numpy.ndarray, optional): Boolean validity of shape (time, bands, rows, cols) or (time, rows, cols). Defaults to None.
+        quality_band (int, optional): Index of a band nodata does not apply to. Defaults to None.
+
+    Returns:
+        numpy.ndarray: Boolean validity of shape (time, rows, cols).
+    """
+    import numpy as np
+
+    valid = np.ones((stack.shape[0],) + stack.shape[2:], dtype=bool)
+    for band in range(stack.shape[1]):   # one band at a time keeps the temporaries to (time, rows, cols)
+        values = stack[:, band]
+        if np.issubdtype(values.dtype, np.floating):
+            valid &= ~np.isnan(values)
+        if nodata is not None and band != quality_band:
+            valid &= values != nodata
+        if mask is not None and mask.ndim == 4:
+            valid &= mask[:, band].astype(bool)
+    if mask is not None and mask.ndim == 3:
+        valid &= mask.astype(bool)
+    return valid
+
+
+def mosaic_arrays(stack, quality_band=0, nodata=None, mask=None):
+    """Select, for every pixel, the bands of the unmasked image with the highest quality.
+
+    Args:
+        stack (numpy.ndarray): Values of shape (time, bands, rows, cols).
+        quality_band (int, optional): Index of the quality band. Defaults to 0.
+        nodata (float, optional): Value of masked pixels in the bands other than the quality. Defaults to None.
+        mask (numpy.ndarray, optional): Boolean validity, see valid_pixels(). Defaults to None.
+
+    Returns:
+        tuple: Values of the other bands (bands - 1, rows, cols), the index of the selected image (rows, cols),
+            and whether the pixel has any unmasked image (rows, cols).
+    """
+    import numpy as np
+
+    valid = valid_pixels(stack, nodata, mask, quality_band)
+    quality = np.where(valid, stack[:, quality_band], -np.inf)
+    index = quality.argmax(axis=0)
+    found = valid.any(axis=0)
+    # With only -inf qualities left, argmax may land on a masked image; take the first unmasked one instead.
+    wrong = found & ~np.take_along_axis(valid, index[None], axis=0)[0]
+    if wrong.any():
+        index[wrong] = valid.argmax(axis=0)[wrong]
+
+    bands = [band for band in range(stack.shape[1]) if band != quality_band]
+    values = np.stack([np.take_along_axis(stack[:, band], index[None], axis=0)[0] for band in bands])
+    return values, index, found
+
+
+def mosaic_chunk(in_file, out_file, index_file, mask_file, start, stop, quality_band, nodata, out_nodata):
+    """Compute the rows [start, stop) of the mosaic and write them into the outputs."""
+    import numpy as np
+
+    stack = np.asarray(open_stack(in_file)[:, :, start:stop])
+    mask = np.asarray(open_stack(mask_file)[..., start:stop, :]) if mask_file else None
+    values, index, found = mosaic_arrays(stack, quality_band, nodata, mask)
+    values[:, ~found] = out_nodata
+
+    out = open_output(out_file, None, None)
+    out[:, start:stop] = values
+    out.flush()
+    if index_file:
+        out = open_output(index_file, None, None)
+        out[start:stop] = np.where(found, index, -1)
+        out.flush()
+    return int(found.sum())
+
+
+def quality_mosaic(in_file, out_file, quality_band=0, nodata=None, mask_file=None, index_file=None, out_nodata=None,
+                   workers=None, chunk_bytes=CHUNK_BYTES, verbose=True):
+    """Build the quality mosaic of a stack stored in a .npy file.
+
+    Args:
+        in_file (str): .npy stack of shape (time, bands, height, width), e.g. from memmap_chunks.stack_scenes().
+        out_file (str): Output .npy file of shape (bands - 1, height, width).
+        quality_band (int, optional): Index of the quality band, e.g. the NDVI. Defaults to 0.
+        nodata (float, optional): Value of masked pixels in the bands other than the quality. Defaults to None. NaN is always masked.
+        mask_file (str, optional): .npy validity of shape (time, bands, height, width) or (time, height, width). Defaults to None.
+        index_file (str, optional): Output .npy file of the selected time index of each pixel, -1 where masked. Defaults to None.
+        out_nodata (float, optional): Value of the masked output pixels. Defaults to None, which uses nodata, or NaN for floats, or 0.
+        workers (int, optional): Number of worker processes. Defaults to None, which uses one per CPU.
+        chunk_bytes (int, optional): Maximum bytes of the stack read per chunk. Defaults to CHUNK_BYTES.
+        verbose (bool, optional): Whether to print the progress. Defaults to True.
+
+    Returns:
+        int: Number of unmasked output pixels.
+    """
+    import numpy as np
+
+    stack = open_stack(in_file)
+    scenes, bands, height, width = stack.shape
+    if out_nodata is None:
+        out_nodata = nodata if nodata is not None else (np.nan if np.issubdtype(stack.dtype, np.floating) else 0)
+    open_output(out_file, (bands - 1, height, width), stack.dtype, out_nodata).flush()
+    if index_file:
+        open_output(index_file, (height, width), 'int32', -1).flush()
+
+    chunks = row_chunks(height, scenes * bands * width * stack.dtype.itemsize, chunk_bytes)
+    tasks = [(os.path.abspath(in_file), os.path.abspath(out_file), index_file and os.path.abspath(index_file),
+              mask_file and os.path.abspath(mask_file), start, stop, quality_band, nodata, out_nodata)
+             for start, stop in chunks]
+    return sum(run_chunks(mosaic_chunk, tasks, workers, verbose=verbose))
+
+
+def sorted_mosaic(stack, quality_band=0, nodata=None):
+    """Reference of the notebook's arraySort(): a stable per-pixel sort of the unmasked images by descending quality."""
+    import numpy as np
+
+    valid = valid_pixels(stack, nodata, quality_band=quality_band)
+    bands = [band for band in range(stack.shape[1]) if band != quality_band]
+    values = np.zeros((len(bands),) + stack.shape[2:], dtype=stack.dtype)
+    found = valid.any(axis=0)
+    for row, col in zip(*np.nonzero(found)):
+        rows = np.nonzero(valid[:, row, col])[0]
+        order = np.argsort(-stack[rows, quality_band, row, col].astype('float64'), kind='stable')
+        values[:, row, col] = stack[rows[order[0]], bands, row, col]
+    return values, found
+
+
+if __name__ == '__main__':
+
+    import tempfile
+    import numpy as np
+
+    parser = argparse.ArgumentParser(description='Check the local quality mosaic and time it on a synthetic stack.')
+    parser.add_argument('--scenes', type=int, default=60, help='Number of scenes of the synthetic stack')
+    parser.add_argument('--bands', type=int, default=7, help='Number of bands, the first one being the quality')
+    parser.add_argument('--size', type=int, default=500, help='Rows and columns of the synthetic stack')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    small = rng.integers(-5, 5, size=(9, 4, 40, 50)).astype('float32')   # small integers: many ties
+    small[rng.random(small.shape) < 0.15] = np.nan
+    small[:, 2][rng.random((9, 40, 50)) < 0.1] = -9999
+    with tempfile.TemporaryDirectory() as work_dir:
+        in_file = os.path.join(work_dir, 'small.npy')
+        np.save(in_file, small)
+        quality_mosaic(in_file, os.path.join(work_dir, 'out.npy'), nodata=-9999, workers=2, chunk_bytes=9 * 4 * 50 * 4 * 7,
+                       verbose=False)
+        values = np.load(os.path.join(work_dir, 'out.npy'))
+        expected, found = sorted_mosaic(small, nodata=-9999)
+        assert np.array_equal(values[0] == -9999, ~found)
+        assert np.array_equal(values[:, found], expected[:, found])
+        print('Mosaic matches the per-pixel sort, {} of {} pixels masked: OK'.format((~found).sum(), found.size))
+
+        # A quality equal to nodata, e.g. an NDVI of 0 where B4 == B3, is a valid quality.
+        ties = np.array([[[[0.0]], [[7]]], [[[-0.4]], [[8]]]], dtype='float32')
+        assert mosaic_arrays(ties, nodata=0)[0][0, 0, 0] == sorted_mosaic(ties, nodata=0)[0][0, 0, 0] == 7
+
+        stack_file = os.path.join(work_dir, 'stack.npy')
+        stack = np.lib.format.open_memmap(stack_file, mode='w+', dtype='int16',
+                                          shape=(args.scenes, args.bands, args.size, args.size))
+        for scene in range(args.scenes):
+            stack[scene] = rng.integers(0, 10000, size=stack.shape[1:], dtype='int16')
+        stack.flush()
+        del stack
+
+        start_time = time.time()
+        quality_mosaic(stack_file, os.path.join(work_dir, 'greenest.npy'), nodata=0, workers=args.workers,
+                       chunk_bytes=64 * 1024 ** 2, verbose=False)
+        elapsed = time.time() - start_time
+        size = os.path.getsize(stack_file)
+        print('{} scenes x {} bands x {}x{} pixels ({:.0f} MB): {:.1f}s, {:.0f} MB/s, peak memory {:.0f} MB'.format(
+            args.scenes, args.bands, args.size, args.size, size / 1e6, elapsed, size / 1e6 / elapsed,
+            (peak_memory() or 0) / 1e6))
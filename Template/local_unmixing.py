@@ -0,0 +1,292 @@
+''' Local linear spectral unmixing of a scene too large for memory, like ee.Image.unmix().
+
+Array/spectral_unmixing.py and Image/spectral_unmixing.py unmix each pixel against a few endmember spectra.
+Unmixer solves all the pixels of a chunk together instead of one small least-squares problem per pixel:
+    * the endmember matrix E is factorized once: the normal matrix G = E'E and its inverse,
+    * unconstrained fractions of a chunk are one matrix product, G^-1 E' Y, for all its pixels,
+    * sum-to-one fractions add the closed-form correction of the equality-constrained least squares,
+    * non-negative fractions use the active-set method of Lawson and Hanson, run for all the pixels at once:
+      pixels sharing the same set of free endmembers are solved together with the inverse of the matching
+      sub-matrix of G, computed once per set (there are at most 2^endmembers sets).
+With both constraints, the sum-to-one row is appended to E and Y with a large weight, as in fully constrained
+least squares (FCLS). unmix() streams a (bands, height, width) .npy scene in row chunks on a process pool.
+
+    unmix('LT05_044034_20080214.npy', 'fractions.npy', [urban, veg, water], sum_to_one=True, non_negative=True)
+
+Pixels with any masked band (NaN or nodata) are NaN in the output. Running the module checks the fractions
+against an exhaustive per-pixel solver:
+
+    python local_unmixing.py
+
+'''
+
+# License: MIT
+
+import os
+import time
+import argparse
+from itertools import combinations
+
+from memmap_chunks import CHUNK_BYTES, open_output, open_stack, peak_memory, row_chunks, run_chunks
+
+
+class Unmixer:
+    """Batched least-squares unmixing against fixed endmembers.
+
+    Args:
+        endmembers (list): Spectra of the endmembers, one row per endmember, like ee.Image.unmix().
+        sum_to_one (bool, optional): Whether the fractions of each pixel sum to one. Defaults to False.
+        non_negative (bool, optional): Whether the fractions are non-negative. Defaults to False.
+        sum_weight (float, optional): Weight of the sum-to-one row when both constraints are on. Defaults to None, which uses 1000 times the largest endmember value.
+        max_iterations (int, optional): Maximum number of active-set iterations. Defaults to None, which uses 3 per endmember.
+    """
+
+    def __init__(self, endmembers, sum_to_one=False, non_negative=False, sum_weight=None, max_iterations=None):
+        import numpy as np
+
+        self.endmembers = np.asarray(endmembers, dtype='float64').T   # (bands, endmembers)
+        self.sum_to_one = sum_to_one
+        self.non_negative = non_negative
+        self.size = self.endmembers.shape[1]
+        self.max_iterations = max_iterations or 3 * self.size
+        self.sum_weight = 0.0
+        if sum_to_one and non_negative:
+            self.sum_weight = sum_weight or 1000 * np.abs(self.endmembers).max()
+        matrix = self.design_matrix()
+        self.gram = matrix.T @ matrix
+        self.inverse = np.linalg.inv(self.gram)
+        self.inverses = {}
+
+    def design_matrix(self):
+        import numpy as np
+
+        if not self.sum_weight:
+            return self.endmembers
+        return np.vstack([self.endmembers, np.full((1, self.size), self.sum_weight)])
+
+    def correlations(self, pixels):
+        """Get E'Y of the pixels (bands, pixels), with the weighted sum-to-one row if any."""
+        correlations = self.endmembers.T @ pixels
+        if self.sum_weight:
+            correlations += self.sum_weight ** 2
+        return correlations
+
+    def restricted(self, correlations, free):
+        """Solve the least squares of each pixel over its free endmembers only, grouping pixels with the same free set.
+
+        Args:
+            correlations (numpy.ndarray): E'Y of shape (endmembers, pixels).
+            free (numpy.ndarray): Boolean free endmembers of shape (endmembers, pixels).
+
+        Returns:
+            numpy.ndarray: Fractions of shape (endmembers, pixels), 0 for the endmembers that are not free.
+        """
+        import numpy as np
+
+        solution = np.zeros_like(correlations)
+        codes = (free * (1 << np.arange(self.size))[:, None]).sum(axis=0)
+        for code in np.unique(codes):
+            if not code:
+                continue
+            members = np.nonzero((code >> np.arange(self.size)) & 1)[0]
+            if code not in self.inverses:
+                self.inverses[code] = np.linalg.inv(self.gram[np.ix_(members, members)])
+            pixels = np.nonzero(codes == code)[0]
+            solution[np.ix_(members, pixels)] = self.inverses[code] @ correlations[np.ix_(members, pixels)]
+        return solution
+
+    def non_negative_least_squares(self, correlations):
+        """Lawson-Hanson active-set method, with every step applied to all the pixels that are not done yet."""
+        import numpy as np
+
+        size, count = correlations.shape
+        fractions = np.zeros_like(correlations)
+        free = np.zeros((size, count), dtype=bool)
+        tolerance = 1e-10 * (np.abs(correlations).max(axis=0) + 1)
+        pending = np.arange(count)
+
+        for _ in range(self.max_iterations):
+            # Free the fixed endmember along which the residual decreases fastest, if any.
+            gradient = correlations[:, pending] - self.gram @ fractions[:, pending]
+            gradient[free[:, pending]] = -np.inf
+            best = gradient.argmax(axis=0)
+            improving = gradient[best, np.arange(pending.size)] > tolerance[pending]
+            pending, best = pending[improving], best[improving]
+            if not pending.size:
+                break
+            free[best, pending] = True
+
+            pixels = pending
+            for _ in range(self.max_iterations):
+                solution = self.restricted(correlations[:, pixels], free[:, pixels])
+                negative = free[:, pixels] & (solution <= 0)
+                feasible = ~negative.any(axis=0)
+                fractions[:, pixels[feasible]] = solution[:, feasible]
+                pixels, solution, negative = pixels[~feasible], solution[:, ~feasible], negative[:, ~feasible]
+                if not pixels.size:
+                    break
+                # Step towards the solution until the first fraction reaches zero, and fix it there.
+                current = fractions[:, pixels]
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    steps = np.where(negative, current / (current - solution), np.inf)
+                first = steps.argmin(axis=0)
+                step = np.clip(steps[first, np.arange(pixels.size)], 0, 1)
+                current = current + step * (solution - current)
+                current[first, np.arange(pixels.size)] = 0
+                fixed = free[:, pixels] & (current <= 0)
+                free[:, pixels] &= ~fixed
+                current[~free[:, pixels]] = 0
+                fractions[:, pixels] = current
+        return fractions
+
+    def solve(self, pixels):
+        """Unmix pixels.
+
+        Args:
+            pixels (numpy.ndarray): Spectra of shape (bands, pixels).
+
+        Returns:
+            numpy.ndarray: Fractions of shape (endmembers, pixels).
+        """
+        import numpy as np
+
+        correlations = self.correlations(np.asarray(pixels, dtype='float64'))
+        if self.non_negative:
+            return self.non_negative_least_squares(correlations)
+        fractions = self.inverse @ correlations
+        if self.sum_to_one:
+            # Lagrange correction of the unconstrained solution onto the plane sum(fractions) = 1.
+            direction = self.inverse.sum(axis=1)
+            fractions += direction[:, None] * ((1 - fractions.sum(axis=0)) / direction.sum())
+        return fractions
+
+
+def unmix_chunk(in_file, out_file, unmixer, start, stop, nodata):
+    """Unmix the rows [start, stop) of a scene and write them into the output."""
+    import numpy as np
+
+    chunk = np.asarray(open_stack(in_file)[:, start:stop], dtype='float64')
+    valid = ~np.isnan(chunk).any(axis=0)
+    if nodata is not None:
+        valid &= ~(chunk == nodata).any(axis=0)
+    result = np.full((unmixer.size,) + valid.shape, np.nan, dtype='float32')
+    result[:, valid] = unmixer.solve(chunk[:, valid])
+    out = open_output(out_file, None, None)
+    out[:, start:stop] = result
+    out.flush()
+    return int(valid.sum())
+
+
+def unmix(in_file, out_file, endmembers, sum_to_one=False, non_negative=False, nodata=None, workers=None,
+          chunk_bytes=CHUNK_BYTES, verbose=True):
+    """Unmix every pixel of a scene stored in a .npy file.
+
+    Args:
+        in_file (str): .npy scene of shape (bands, height, width).
+        out_file (str): Output float32 .npy file of the fractions, of shape (endmembers, height, width).
+        endmembers (list): Spectra of the endmembers, one row per endmember.
+        sum_to_one (bool, optional): Whether the fractions of each pixel sum to one. Defaults to False.
+        non_negative (bool, optional): Whether the fractions are non-negative. Defaults to False.
+        nodata (float, optional): Value of masked pixels. Defaults to None. NaN is always masked.
+        workers (int, optional): Number of worker processes. Defaults to None, which uses one per CPU.
+        chunk_bytes (int, optional): Maximum bytes of the float64 working copy of a chunk. Defaults to CHUNK_BYTES.
+        verbose (bool, optional): Whether to print the progress. Defaults to True.
+
+    Returns:
+        int: Number of unmixed pixels.
+    """
+    unmixer = Unmixer(endmembers, sum_to_one, non_negative)
+    scene = open_stack(in_file)
+    bands, height, width = scene.shape
+    if bands != unmixer.endmembers.shape[0]:
+        raise ValueError('The scene has {} bands, the endmembers {}.'.format(bands, unmixer.endmembers.shape[0]))
+    open_output(out_file, (unmixer.size, height, width), 'float32').flush()
+    chunks = row_chunks(height, (bands + 4 * unmixer.size) * width * 8, chunk_bytes)
+    tasks = [(os.path.abspath(in_file), os.path.abspath(out_file), unmixer, start, stop, nodata)
+             for start, stop in chunks]
+    return sum(run_chunks(unmix_chunk, tasks, workers, verbose=verbose))
+
+
+def exhaustive_unmix(endmembers, pixel, sum_to_one=False):
+    """Reference non-negative unmixing of one pixel: the best feasible solution over every subset of endmembers."""
+    import numpy as np
+
+    matrix = np.asarray(endmembers, dtype='float64').T
+    size = matrix.shape[1]
+    best, best_error = None, np.inf
+    if not sum_to_one:
+        best, best_error = np.zeros(size), np.sum(pixel ** 2)
+    for subset_size in range(1, size + 1):
+        for subset in combinations(range(size), subset_size):
+            columns = matrix[:, subset]
+            if sum_to_one:   # KKT system of the equality-constrained least squares
+                system = np.block([[columns.T @ columns, np.ones((subset_size, 1))],
+                                   [np.ones((1, subset_size)), np.zeros((1, 1))]])
+                values = np.linalg.solve(system, np.append(columns.T @ pixel, 1))[:subset_size]
+            else:
+                values = np.linalg.lstsq(columns, pixel, rcond=None)[0]
+            if (values < -1e-12).any():
+                continue
+            fractions = np.zeros(size)
+            fractions[list(subset)] = values
+            error = np.sum((matrix @ fractions - pixel) ** 2)
+            if error < best_error:
+                best, best_error = fractions, error
+    return best
+
+
+if __name__ == '__main__':
+
+    import tempfile
+    import numpy as np
+
+    parser = argparse.ArgumentParser(description='Check the batched unmixing and time it on a synthetic scene.')
+    parser.add_argument('--size', type=int, default=1000, help='Rows and columns of the synthetic scene')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes')
+    args = parser.parse_args()
+
+    # Endmembers of Array/spectral_unmixing.py.
+    urban = [88, 42, 48, 38, 86, 115, 59]
+    veg = [50, 21, 20, 35, 50, 110, 23]
+    water = [51, 20, 14, 9, 7, 116, 4]
+    endmembers = [urban, veg, water]
+
+    rng = np.random.default_rng(0)
+    fractions = rng.dirichlet([1, 1, 1], size=2000).T * rng.uniform(0.7, 1.3, size=2000)
+    fractions[:, :200] -= 0.3   # outside the simplex, so the constraints bind
+    pixels = np.asarray(endmembers, dtype='float64').T @ fractions + rng.normal(0, 3, size=(7, 2000))
+
+    unconstrained = Unmixer(endmembers).solve(pixels)
+    assert np.allclose(unconstrained, np.linalg.pinv(np.asarray(endmembers, dtype='float64').T) @ pixels)
+    summed = Unmixer(endmembers, sum_to_one=True).solve(pixels)
+    assert np.allclose(summed.sum(axis=0), 1)
+    for sum_to_one, tolerance in [(False, 1e-8), (True, 1e-4)]:
+        solved = Unmixer(endmembers, sum_to_one, non_negative=True).solve(pixels)
+        for index in range(0, 2000, 7):
+            expected = exhaustive_unmix(endmembers, pixels[:, index], sum_to_one)
+            assert np.allclose(solved[:, index], expected, atol=tolerance), (sum_to_one, index)
+        if sum_to_one:
+            summed_positive = solved.sum(axis=0)
+            assert np.allclose(summed_positive, 1, atol=1e-4)
+    print('Unconstrained, sum-to-one and non-negative fractions match the per-pixel solvers: OK')
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        in_file = os.path.join(work_dir, 'scene.npy')
+        scene = np.lib.format.open_memmap(in_file, mode='w+', dtype='float32', shape=(7, args.size, args.size))
+        for row in range(0, args.size, 256):
+            rows = min(256, args.size - row)
+            mix = rng.dirichlet([1, 1, 1], size=rows * args.size).T
+            block = np.asarray(endmembers, dtype='float64').T @ mix + rng.normal(0, 3, size=(7, rows * args.size))
+            scene[:, row:row + rows] = block.reshape(7, rows, args.size)
+        scene[:, 0, :10] = np.nan
+        scene.flush()
+
+        start_time = time.time()
+        unmixed = unmix(in_file, os.path.join(work_dir, 'fractions.npy'), endmembers, sum_to_one=True,
+                        non_negative=True, workers=args.workers, chunk_bytes=32 * 1024 ** 2, verbose=False)
+        elapsed = time.time() - start_time
+        out = np.load(os.path.join(work_dir, 'fractions.npy'), mmap_mode='r')
+        assert np.isnan(out[:, 0, :10]).all() and unmixed == args.size * args.size - 10
+        assert (np.asarray(out[:, 1:50]) >= 0).all()
+        print('{} pixels fully constrained in {:.1f}s ({:.1f} M pixels/s), peak memory {:.0f} MB'.format(
+            unmixed, elapsed, unmixed / elapsed / 1e6, (peak_memory() or 0) / 1e6))
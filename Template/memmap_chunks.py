@@ -0,0 +1,147 @@
+''' Helpers of the local raster engines: memory-mapped .npy stacks processed in row chunks on a process pool.
+
+The engines (e.g. local_quality_mosaic.py) read rasters that do not fit in memory from .npy files opened with
+numpy.load(mmap_mode='r'), e.g. the outputs of tiled_download.py. The rows of the raster are split into chunks
+small enough for memory; each worker process opens the files itself, computes its chunk, and writes it into a
+memory-mapped output, so the workers share neither memory nor a lock.
+
+    chunks = row_chunks(height, bytes_per_row, chunk_bytes=256 * 1024 ** 2)
+    run_chunks(process_chunk, [(in_file, out_file, start, stop) for start, stop in chunks], workers=4)
+
+'''
+
+# License: MIT
+
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+CHUNK_BYTES = 256 * 1024 ** 2
+
+
+def open_stack(in_file):
+    """Open a .npy raster without reading it.
+
+    Args:
+        in_file (str): .npy file.
+
+    Returns:
+        numpy.memmap: Read-only memory map of the array.
+    """
+    import numpy as np
+
+    return np.load(in_file, mmap_mode='r')
+
+
+def open_output(out_file, shape, dtype, fill=None):
+    """Create a memory-mapped .npy file, or open it to write chunks into it.
+
+    Args:
+        out_file (str): .npy file.
+        shape (tuple): Shape of a new array, or None to open an existing file.
+        dtype (str): Data type of a new array.
+        fill (float, optional): Value to fill a new file with. Defaults to None, which leaves it zeroed.
+
+    Returns:
+        numpy.memmap: Writable memory map of the array.
+    """
+    import numpy as np
+
+    if shape is None:
+        return np.load(out_file, mmap_mode='r+')
+    out = np.lib.format.open_memmap(out_file, mode='w+', dtype=dtype, shape=tuple(shape))
+    if fill is not None:
+        out[...] = fill
+    return out
+
+
+def stack_scenes(files, out_file):
+    """Stack single-scene rasters into one memory-mapped cube, one scene at a time.
+
+    Args:
+        files (list): .npy files of shape (bands, height, width), e.g. from tiled_download.py, in time order.
+        out_file (str): Output .npy file of shape (time, bands, height, width).
+
+    Returns:
+        str: File path of the cube.
+    """
+    first = open_stack(files[0])
+    out = open_output(out_file, (len(files),) + first.shape, first.dtype)
+    for index, in_file in enumerate(files):
+        scene = open_stack(in_file)
+        if scene.shape != first.shape:
+            raise ValueError('{} has shape {}, expected {}'.format(in_file, scene.shape, first.shape))
+        out[index] = scene
+    out.flush()
+    return out_file
+
+
+def row_chunks(height, bytes_per_row, chunk_bytes=CHUNK_BYTES):
+    """Split the rows of a raster into chunks of at most chunk_bytes.
+
+    Args:
+        height (int): Number of rows.
+        bytes_per_row (int): Bytes read and written per row, over every array the chunk touches.
+        chunk_bytes (int, optional): Maximum bytes per chunk. Defaults to CHUNK_BYTES.
+
+    Returns:
+        list: (start, stop) rows of each chunk.
+    """
+    rows = max(int(chunk_bytes // max(bytes_per_row, 1)), 1)
+    return [(start, min(start + rows, height)) for start in range(0, height, rows)]
+
+
+def run_chunks(function, tasks, workers=None, processes=True, verbose=True):
+    """Run a function on every chunk task on a pool.
+
+    Args:
+        function (function): Module-level function of one task, so it can be sent to worker processes.
+        tasks (list): Arguments of each call, as tuples.
+        workers (int, optional): Number of workers. Defaults to None, which uses one per CPU.
+        processes (bool, optional): Whether to use processes rather than threads. Defaults to True.
+        verbose (bool, optional): Whether to print the progress. Defaults to True.
+
+    Returns:
+        list: Results of the calls, in the order of the tasks.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(tasks) == 1:
+        executor = None
+        results = map(lambda task: function(*task), tasks)
+    else:
+        executor = (ProcessPoolExecutor if processes else ThreadPoolExecutor)(max_workers=workers)
+        results = executor.map(function, *zip(*tasks))
+
+    output = []
+    start_time = time.time()
+    try:
+        for index, result in enumerate(results, 1):
+            output.append(result)
+            if verbose:
+                print('{}/{} chunks ({:.1f}s)'.format(index, len(tasks), time.time() - start_time))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return output
+
+
+def peak_memory(workers_only=False):
+    """Get the peak resident memory of this process and its finished worker processes.
+
+    Args:
+        workers_only (bool, optional): Whether to leave this process out, e.g. when it wrote the input itself. Defaults to False.
+
+    Returns:
+        int: Peak resident set size in bytes, or None where it cannot be measured (Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    scale = 1 if sys.platform == 'darwin' else 1024   # bytes on macOS, kilobytes on Linux
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if workers_only:
+        return children * scale
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, children) * scale
@@ -28,6 +28,21 @@ except ImportError:
 import ee
 import geemap
 
+# Optional: evaluate consecutive getInfo() calls together in one request (see Template/getinfo_batch.py)
+# and reuse the results of earlier runs from a local cache (see Template/getinfo_cache.py).
+# Under Voila, map tiles can also be served from a local cache (see Template/tile_cache_proxy.py).
+# import os, sys
+# root = os.getcwd()
+# while not os.path.isdir(os.path.join(root, 'Template')) and os.path.dirname(root) != root:
+#     root = os.path.dirname(root)
+# sys.path.append(os.path.join(root, 'Template'))
+# from getinfo_batch import enable_auto_batching
+# enable_auto_batching()
+# from getinfo_cache import enable_cache
+# enable_cache()
+# from tile_cache_proxy import enable_tile_proxy
+# enable_tile_proxy()
+
 # %%
 """
 ## Create an interactive map 
@@ -0,0 +1,348 @@
+''' Render thumbnails of every image of a collection, and timelapses of them, with bounded concurrency.
+
+getThumbURL() renders one image per call. ThumbnailRenderer
+    * lists the images of a collection with one getInfo() call,
+    * requests and downloads their thumbnails on a thread pool over one pooled HTTP session, with at most
+      `workers` requests at the same time and jittered retries of throttled requests,
+    * caches every thumbnail on disk under a key of (image ID, visualization parameters, region, dimensions), so a
+      report rendered again only fetches the new images,
+    * pipes the frames of a timelapse one at a time, in order, into ffmpeg, which encodes the GIF or MP4, so the
+      frames are never all held in memory.
+
+    renderer = ThumbnailRenderer()
+    renderer.thumbnails(collection, {'bands': ['B4', 'B3', 'B2'], 'max': 0.3}, region, 512, out_dir='thumbnails')
+    renderer.timelapse(monthly_composites(collection, '2019-01-01', '2020-01-01'), 'monthly.gif', vis, region, 512)
+
+Timelapses need Pillow and the ffmpeg program (or the imageio-ffmpeg package, which ships one).
+
+'''
+
+# License: MIT
+
+import io
+import os
+import json
+import time
+import random
+import shutil
+import hashlib
+import threading
+import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+CACHE_DIR = os.environ.get('EE_THUMBNAIL_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'ee_thumbnails'))
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+
+def monthly_composites(collection, start, end, reducer=None):
+    """Composite a collection per calendar month, dropping the months without images.
+
+    Args:
+        collection (ee.ImageCollection): Images to composite.
+        start (str | ee.Date): First month.
+        end (str | ee.Date): End of the last month (exclusive).
+        reducer (ee.Reducer, optional): Reducer of each month. Defaults to None, which takes the median.
+
+    Returns:
+        ee.ImageCollection: One image per month, with its system:time_start set to the start of the month.
+    """
+    import ee
+
+    start = ee.Date(start)
+    months = ee.Date(end).difference(start, 'month').round()
+
+    def composite(month):
+        month_start = start.advance(month, 'month')
+        images = collection.filterDate(month_start, month_start.advance(1, 'month'))
+        image = images.reduce(reducer) if reducer is not None else images.median()
+        return image.set({'system:time_start': month_start.millis(), 'count': images.size()})
+
+    return ee.ImageCollection(ee.List.sequence(0, months.subtract(1)).map(composite)).filter(ee.Filter.gt('count', 0))
+
+
+def thumbnail_key(image_id, vis_params, region, dimensions, file_format):
+    """Get the cache key of a thumbnail.
+
+    Args:
+        image_id (str): Asset ID of the image, or the serialized image if it is computed.
+        vis_params (dict): Visualization parameters.
+        region (dict | list): Region as GeoJSON or coordinates.
+        dimensions (int | str): Dimensions of the thumbnail.
+        file_format (str): 'png' or 'jpg'.
+
+    Returns:
+        str: Hex digest of the key.
+    """
+    return hashlib.sha256(json.dumps([image_id, vis_params, region, dimensions, file_format],
+                                     sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def ordered_results(executor, function, items, window):
+    """Map a function over items on an executor, with at most `window` items in flight, yielding results in order."""
+    futures = deque()
+    for item in items:
+        futures.append(executor.submit(function, item))
+        if len(futures) >= window:
+            yield futures.popleft().result()
+    while futures:
+        yield futures.popleft().result()
+
+
+def ffmpeg_executable():
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        try:
+            import imageio_ffmpeg
+            ffmpeg = imageio_ffmpeg.get_ffmpeg_exe()
+        except ImportError:
+            raise ImportError('Encoding timelapses needs the ffmpeg program. To install it: pip install imageio-ffmpeg')
+    return ffmpeg
+
+
+class FrameEncoder:
+    """Encode RGB frames to a GIF or MP4 file by piping them to ffmpeg as they arrive.
+
+    Args:
+        out_file (str): Output file, .gif or .mp4.
+        width (int): Frame width.
+        height (int): Frame height.
+        fps (float): Frames per second.
+    """
+
+    def __init__(self, out_file, width, height, fps):
+        self.width = width
+        self.height = height
+        if out_file.lower().endswith('.gif'):
+            # The palette of the GIF is computed by ffmpeg from all the frames, so the frames are buffered there, compressed.
+            output = ['-filter_complex', 'split[a][b];[a]palettegen[p];[b][p]paletteuse', '-loop', '0']
+        else:
+            output = ['-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2']
+        command = [ffmpeg_executable(), '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+                   '-s', '{}x{}'.format(width, height), '-r', str(fps), '-i', '-'] + output + [out_file]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def write(self, frame):
+        """Write one frame.
+
+        Args:
+            frame (PIL.Image.Image): Frame, resized to the size of the encoder if needed.
+        """
+        frame = frame.convert('RGB')
+        if frame.size != (self.width, self.height):
+            frame = frame.resize((self.width, self.height))
+        self.process.stdin.write(frame.tobytes())
+
+    def close(self):
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise IOError('ffmpeg failed with exit code {}'.format(self.process.returncode))
+
+    def abort(self):
+        """Stop ffmpeg without finishing the file, e.g. after a frame failed to render."""
+        self.process.kill()
+        self.process.wait()
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+
+
+class ThumbnailRenderer:
+    """Render and cache the thumbnails of the images of collections.
+
+    Args:
+        cache_dir (str, optional): Folder of the cached thumbnails. Defaults to CACHE_DIR, which can be set with the EE_THUMBNAIL_CACHE environment variable.
+        workers (int, optional): Number of thumbnails rendered at the same time. Defaults to 8.
+        retries (int, optional): Number of retries of a failed thumbnail. Defaults to 4.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, workers=8, retries=4):
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.retries = retries
+        self.lock = threading.Lock()
+        self.reset_counters()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def jobs(self, collection, vis_params, region, dimensions, file_format='png', max_images=5000):
+        """List the thumbnails of the images of a collection, with one getInfo() call.
+
+        Args:
+            collection (ee.ImageCollection): Images to render, in order.
+            vis_params (dict): Visualization parameters, e.g. {'bands': ['B4', 'B3', 'B2'], 'min': 0, 'max': 0.3}.
+            region (list | ee.Geometry): Region of the thumbnails.
+            dimensions (int | str): Dimensions of the thumbnails, e.g. 512 or '512x256'.
+            file_format (str, optional): 'png' or 'jpg'. Defaults to 'png'.
+            max_images (int, optional): Maximum number of images. Defaults to 5000.
+
+        Returns:
+            list: Thumbnail jobs with the 'name', 'image', thumbnail 'params' and cache 'key'.
+        """
+        import ee
+
+        if isinstance(region, ee.Geometry):
+            region = region.toGeoJSON()
+        images = collection.toList(max_images)
+        ids = images.map(lambda image: ee.Algorithms.If(
+            ee.Image(image).propertyNames().contains('system:id'), ee.Image(image).get('system:id'), '')).getInfo()
+
+        jobs = []
+        for index, image_id in enumerate(ids):
+            image = ee.Image(image_id) if image_id else ee.Image(images.get(index))
+            key_id = image_id or ee.serializer.toJSON(image)
+            params = dict(vis_params, region=region, dimensions=dimensions, format=file_format)
+            jobs.append({
+                'name': image_id.replace('/', '_') if image_id else '{:05d}'.format(index),
+                'image': image,
+                'params': params,
+                'key': thumbnail_key(key_id, vis_params, region, dimensions, file_format),
+            })
+        return jobs
+
+    def reset_counters(self):
+        with self.lock:
+            self.counters = {'cached': 0, 'rendered': 0}
+
+    def cache_file(self, job):
+        return os.path.join(self.cache_dir, job['key'][:2], job['key'] + '.' + job['params']['format'])
+
+    def fetch(self, session, job):
+        """Render one thumbnail, or get it from the cache.
+
+        Args:
+            session (requests.Session): Pooled HTTP session.
+            job (dict): Thumbnail job, see jobs().
+
+        Returns:
+            str: File path of the cached thumbnail.
+        """
+        import requests
+
+        cache_file = self.cache_file(job)
+        if os.path.isfile(cache_file):
+            with self.lock:
+                self.counters['cached'] += 1
+            return cache_file
+
+        # Only throttling, server errors and dropped connections are retried: a bad request or an
+        # ee.EEException fails the same way every time.
+        url = job['image'].getThumbURL(job['params'])
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(min(2 ** (attempt - 1), 60) * (0.5 + random.random()))
+            try:
+                response = session.get(url, timeout=300)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+                continue
+            if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                response.raise_for_status()
+                break
+
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = '{}.{}.tmp'.format(cache_file, threading.get_ident())
+        with open(tmp_file, 'wb') as f:
+            f.write(response.content)
+        os.replace(tmp_file, cache_file)
+        with self.lock:
+            self.counters['rendered'] += 1
+        return cache_file
+
+    def render(self, jobs):
+        """Render thumbnails with at most `workers` requests at the same time.
+
+        Args:
+            jobs (list): Thumbnail jobs, see jobs().
+
+        Yields:
+            tuple: Job and file path of its cached thumbnail, in the order of the jobs.
+        """
+        import requests
+
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                results = ordered_results(executor, lambda job: (job, self.fetch(session, job)), jobs, self.workers * 2)
+                for result in results:
+                    yield result
+        finally:
+            session.close()
+
+    def thumbnails(self, collection, vis_params, region, dimensions, out_dir=None, file_format='png', max_images=5000):
+        """Render the thumbnails of every image of a collection.
+
+        Args:
+            collection (ee.ImageCollection): Images to render.
+            vis_params (dict): Visualization parameters.
+            region (list | ee.Geometry): Region of the thumbnails.
+            dimensions (int | str): Dimensions of the thumbnails.
+            out_dir (str, optional): Folder to copy the thumbnails to, named after the image IDs. Defaults to None, which leaves them in the cache.
+            file_format (str, optional): 'png' or 'jpg'. Defaults to 'png'.
+            max_images (int, optional): Maximum number of images. Defaults to 5000.
+
+        Returns:
+            list: File paths of the thumbnails, in the order of the collection.
+        """
+        jobs = self.jobs(collection, vis_params, region, dimensions, file_format, max_images)
+        self.reset_counters()
+        if out_dir is not None:
+            os.makedirs(out_dir, exist_ok=True)
+
+        files = []
+        start_time = time.time()
+        for index, (job, cache_file) in enumerate(self.render(jobs), 1):
+            if out_dir is not None:
+                out_file = os.path.join(out_dir, job['name'] + '.' + file_format)
+                shutil.copyfile(cache_file, out_file)
+                files.append(out_file)
+            else:
+                files.append(cache_file)
+            print('{}/{} {} ({:.1f}s)'.format(index, len(jobs), job['name'], time.time() - start_time))
+        print('{} thumbnails: {rendered} rendered, {cached} from the cache'.format(len(files), **self.counters))
+        return files
+
+    def timelapse(self, collection, out_file, vis_params, region, dimensions, fps=2, max_images=5000):
+        """Render a GIF or MP4 timelapse of a collection, encoding each frame as soon as it and the ones before it are rendered.
+
+        Args:
+            collection (ee.ImageCollection): Frames, in order, e.g. from monthly_composites().
+            out_file (str): Output file, .gif or .mp4.
+            vis_params (dict): Visualization parameters.
+            region (list | ee.Geometry): Region of the frames.
+            dimensions (int | str): Dimensions of the frames.
+            fps (float, optional): Frames per second. Defaults to 2.
+            max_images (int, optional): Maximum number of frames. Defaults to 5000.
+
+        Returns:
+            str: File path of the timelapse.
+        """
+        try:
+            from PIL import Image
+        except ImportError:
+            raise ImportError('Encoding timelapses needs the Pillow package. To install it: pip install Pillow')
+
+        jobs = self.jobs(collection, vis_params, region, dimensions, 'png', max_images)
+        self.reset_counters()
+        encoder = None
+        try:
+            for index, (job, cache_file) in enumerate(self.render(jobs), 1):
+                with open(cache_file, 'rb') as f:
+                    frame = Image.open(io.BytesIO(f.read()))
+                if encoder is None:
+                    encoder = FrameEncoder(out_file, frame.width, frame.height, fps)
+                encoder.write(frame)
+                print('Frame {}/{} {}'.format(index, len(jobs), job['name']))
+        except BaseException:
+            # Closing would wait for ffmpeg to fail on the truncated input and hide the original error.
+            if encoder is not None:
+                encoder.abort()
+            raise
+        if encoder is not None:
+            encoder.close()
+        return out_file
@@ -0,0 +1,501 @@
+''' Local caching proxy for the Earth Engine map tiles of Map.addLayer().
+
+With Voila (see the Procfile), every page view of a notebook asks Earth Engine for the same map tiles again, e.g.
+the SRTM DEM of Template/template.py. TileCacheProxy serves the tiles of each layer from a local HTTP server:
+    * tiles are keyed on the layer (its serialized image and visualization, or else its map ID) and z/x/y,
+      because a new map ID is created for every page view of the same layer,
+    * tiles are stored in a size-bounded SQLite file with least-recently-used eviction, and the most recently
+      used tiles are also kept in memory,
+    * tiles can expire after a maximum age, for the layers of datasets that change, like the TTLs of
+      getinfo_cache.py,
+    * after serving a tile, the neighbouring tiles at the same zoom are fetched in the background, so panning
+      finds them in the cache.
+
+To route the layers of a notebook through the proxy, before Map.addLayer():
+
+    from tile_cache_proxy import enable_tile_proxy
+    enable_tile_proxy()
+
+The browser must be able to reach the proxy. It listens on 127.0.0.1 by default; behind a remote Voila server,
+pass host='0.0.0.0' and the public_url at which the proxy port is exposed.
+
+FakeTileServer stands in for the Earth Engine tile server, so the proxy can be exercised offline:
+
+    python tile_cache_proxy.py --latency 0.2
+
+'''
+
+# License: MIT
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+CACHE_FILE = os.environ.get('EE_TILE_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'ee_tile_cache.sqlite'))
+
+
+class TileStore:
+    """Tiles on disk with least-recently-used eviction, and an in-memory hot set of the most recently used tiles.
+
+    Args:
+        cache_file (str): File path of the SQLite cache.
+        max_bytes (int): Maximum total size of the tiles on disk.
+        memory_bytes (int): Maximum total size of the tiles in memory.
+    """
+
+    def __init__(self, cache_file, max_bytes, memory_bytes):
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self.memory = OrderedDict()
+        self.memory_size = 0
+        self.lock = threading.Lock()
+
+        cache_dir = os.path.dirname(os.path.abspath(cache_file))
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.db = sqlite3.connect(cache_file, timeout=30, check_same_thread=False)
+        with self.db:
+            columns = [row[1] for row in self.db.execute('PRAGMA table_info(tiles)')]
+            if columns and 'expires' not in columns:   # a cache file of an earlier version
+                self.db.execute('DROP TABLE tiles')
+            self.db.execute('CREATE TABLE IF NOT EXISTS tiles (key TEXT PRIMARY KEY, content_type TEXT, data BLOB, '
+                            'size INTEGER, accessed REAL, expires REAL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS tiles_accessed ON tiles (accessed)')
+        self.disk_size = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM tiles').fetchone()[0]
+
+    def remember(self, key, tile):
+        """Add a tile to the hot set, evicting the least recently used tiles beyond memory_bytes."""
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return
+        self.memory[key] = tile
+        self.memory_size += len(tile[1])
+        while self.memory_size > self.memory_bytes and self.memory:
+            _, (_, data, _) = self.memory.popitem(last=False)
+            self.memory_size -= len(data)
+
+    def forget(self, key):
+        tile = self.memory.pop(key, None)
+        if tile is not None:
+            self.memory_size -= len(tile[1])
+
+    def get(self, key):
+        """Look up a tile.
+
+        Args:
+            key (str): Tile key.
+
+        Returns:
+            tuple: Content type and data of the tile, and where it was found ('memory' or 'disk'), or None if the
+                tile is not cached or expired.
+        """
+        now = time.time()
+        with self.lock:
+            tile = self.memory.get(key)
+            if tile is not None and tile[2] >= now:
+                self.memory.move_to_end(key)
+                return tile[:2] + ('memory',)
+            self.forget(key)
+            row = self.db.execute('SELECT content_type, data, expires FROM tiles WHERE key = ?', (key,)).fetchone()
+            if row is None or row[2] < now:
+                return None
+            with self.db:
+                self.db.execute('UPDATE tiles SET accessed = ? WHERE key = ?', (now, key))
+            tile = (row[0], bytes(row[1]), row[2])
+            self.remember(key, tile)
+            return tile[:2] + ('disk',)
+
+    def contains(self, key):
+        now = time.time()
+        with self.lock:
+            if key in self.memory:
+                return self.memory[key][2] >= now
+            row = self.db.execute('SELECT expires FROM tiles WHERE key = ?', (key,)).fetchone()
+            return row is not None and row[0] >= now
+
+    def put(self, key, content_type, data, max_age=None):
+        """Store a tile, evicting the least recently used tiles beyond max_bytes.
+
+        Args:
+            key (str): Tile key.
+            content_type (str): MIME type of the tile.
+            data (bytes): Tile image.
+            max_age (float, optional): Seconds the tile stays valid. Defaults to None, which keeps it until it is evicted.
+
+        Returns:
+            int: Number of tiles evicted from the disk.
+        """
+        evicted = 0
+        now = time.time()
+        expires = now + max_age if max_age is not None else float('inf')
+        with self.lock, self.db:
+            old = self.db.execute('SELECT size FROM tiles WHERE key = ?', (key,)).fetchone()
+            self.disk_size += len(data) - (old[0] if old else 0)
+            self.db.execute('INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?, ?)',
+                            (key, content_type, sqlite3.Binary(data), len(data), now, expires))
+            while self.disk_size > self.max_bytes:
+                row = self.db.execute('SELECT key, size FROM tiles ORDER BY accessed LIMIT 1').fetchone()
+                if row is None:
+                    break
+                self.db.execute('DELETE FROM tiles WHERE key = ?', (row[0],))
+                self.disk_size -= row[1]
+                evicted += 1
+            self.forget(key)
+            self.remember(key, (content_type, data, expires))
+        return evicted
+
+
+class TileCacheProxy:
+    """Local HTTP server caching the tiles of registered layers.
+
+    Args:
+        cache_file (str, optional): File path of the SQLite cache. Defaults to CACHE_FILE, which can be set with the EE_TILE_CACHE environment variable.
+        max_bytes (int, optional): Maximum size of the tiles on disk. Defaults to 1 GB.
+        memory_bytes (int, optional): Maximum size of the tiles in memory. Defaults to 64 MB.
+        host (str, optional): Address to listen on. Defaults to '127.0.0.1'.
+        port (int, optional): Port. Defaults to 0, which picks a free port.
+        public_url (str, optional): URL at which browsers reach the proxy. Defaults to None, which uses http://host:port.
+        prefetch (bool, optional): Whether to fetch the neighbours of requested tiles in the background. Defaults to True.
+        workers (int, optional): Number of background prefetch threads. Defaults to 4.
+        timeout (float, optional): Seconds before an upstream tile request times out. Defaults to 60.
+        max_age (float, optional): Seconds a cached tile stays valid, unless set per layer in register(). Defaults to None, which keeps tiles until they are evicted.
+    """
+
+    def __init__(self, cache_file=CACHE_FILE, max_bytes=1024 ** 3, memory_bytes=64 * 1024 ** 2, host='127.0.0.1', port=0,
+                 public_url=None, prefetch=True, workers=4, timeout=60, max_age=None):
+        self.store = TileStore(cache_file, max_bytes, memory_bytes)
+        self.layers = {}
+        self.max_ages = {}
+        self.max_age = max_age
+        self.prefetch = prefetch
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.fetching = {}
+        self.lock = threading.Lock()
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'prefetched': 0, 'evictions': 0, 'errors': 0}
+        proxy = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                parts = self.path.split('?')[0].strip('/').split('/')
+                try:
+                    if len(parts) != 5 or parts[0] != 'tiles':
+                        raise KeyError(self.path)
+                    content_type, data, _ = proxy.tile(parts[1], int(parts[2]), int(parts[3]), int(parts[4]))
+                    status = 200
+                except (KeyError, ValueError):
+                    status, content_type, data = 404, 'text/plain', b'Not found'
+                except urllib.error.HTTPError as e:
+                    status, content_type, data = e.code, 'text/plain', str(e).encode('utf-8')
+                except OSError as e:
+                    status, content_type, data = 502, 'text/plain', str(e).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.send_header('Access-Control-Allow-Origin', '*')
+                if status == 200:
+                    max_age = proxy.max_ages.get(parts[1])
+                    self.send_header('Cache-Control', 'public, max-age={}'.format(
+                        86400 if max_age is None else int(min(max_age, 86400))))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.url = public_url or 'http://{}:{}'.format(host, self.httpd.server_address[1])
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.executor.shutdown(wait=False)
+
+    def register(self, url_format, layer_key=None, max_age=None):
+        """Route the tiles of a layer through the proxy.
+
+        Args:
+            url_format (str): Upstream tile URL with {z}, {x} and {y} placeholders.
+            layer_key (str, optional): Text identifying the layer across sessions, e.g. its serialized image and visualization. Defaults to None, which uses url_format.
+            max_age (float, optional): Seconds a cached tile of the layer stays valid. Defaults to None, which uses the max_age of the proxy.
+
+        Returns:
+            str: Proxied tile URL with {z}, {x} and {y} placeholders.
+        """
+        layer = hashlib.sha256((layer_key or url_format).encode('utf-8')).hexdigest()[:24]
+        with self.lock:
+            self.layers[layer] = url_format
+            self.max_ages[layer] = self.max_age if max_age is None else max_age
+        return '{}/tiles/{}/{{z}}/{{x}}/{{y}}'.format(self.url, layer)
+
+    def fetch(self, layer, z, x, y, counter='misses'):
+        """Fetch a tile from the upstream server and store it, sharing the request with concurrent fetches of the same tile."""
+        key = '{}/{}/{}/{}'.format(layer, z, x, y)
+        with self.lock:
+            event = self.fetching.get(key)
+            owner = event is None
+            if owner:
+                event = self.fetching[key] = threading.Event()
+        if not owner:
+            event.wait(self.timeout)
+            tile = self.store.get(key)
+            if tile is not None:
+                return tile[:2]
+
+        try:
+            url = self.layers[layer].format(z=z, x=x, y=y)
+            with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                content_type = response.headers.get('Content-Type', 'image/png')
+                data = response.read()
+            evicted = self.store.put(key, content_type, data, self.max_ages.get(layer))
+            with self.lock:
+                self.counters[counter] += 1
+                self.counters['evictions'] += evicted
+            return content_type, data
+        finally:
+            if owner:
+                with self.lock:
+                    del self.fetching[key]
+                event.set()
+
+    def prefetch_tile(self, layer, z, x, y):
+        key = '{}/{}/{}/{}'.format(layer, z, x, y)
+        if self.store.contains(key):
+            return
+        try:
+            self.fetch(layer, z, x, y, 'prefetched')
+        except OSError:
+            with self.lock:
+                self.counters['errors'] += 1
+
+    def neighbours(self, z, x, y):
+        """Get the 8 tiles around a tile at the same zoom, wrapping around the antimeridian."""
+        n = 2 ** z
+        return [(z, (x + dx) % n, y + dy) for dy in (-1, 0, 1) for dx in (-1, 0, 1)
+                if (dx or dy) and 0 <= y + dy < n]
+
+    def tile(self, layer, z, x, y):
+        """Get a tile from the cache, or from the upstream server on a miss.
+
+        Args:
+            layer (str): Layer ID returned in the URL of register().
+            z (int): Zoom level.
+            x (int): Tile column.
+            y (int): Tile row.
+
+        Returns:
+            tuple: Content type, data, and where the tile came from ('memory', 'disk' or 'upstream').
+        """
+        if layer not in self.layers:
+            raise KeyError(layer)
+        tile = self.store.get('{}/{}/{}/{}'.format(layer, z, x, y))
+        if tile is not None:
+            with self.lock:
+                self.counters[tile[2] + '_hits'] += 1
+        else:
+            tile = self.fetch(layer, z, x, y) + ('upstream',)
+
+        if self.prefetch:
+            for neighbour in self.neighbours(z, x, y):
+                self.executor.submit(self.prefetch_tile, layer, *neighbour)
+        return tile
+
+    def stats(self):
+        """Get the counters of the proxy.
+
+        Returns:
+            dict: Hits from memory and disk, misses, prefetched tiles, evictions, errors, and the cache size.
+        """
+        with self.lock:
+            stats = dict(self.counters)
+        stats.update({'memory_bytes': self.store.memory_size, 'disk_bytes': self.store.disk_size})
+        return stats
+
+
+class ProxyTileFetcher:
+    """Stand-in for the tile_fetcher of ee.data.getMapId() whose url_format points to a TileCacheProxy."""
+
+    def __init__(self, url_format, tile_fetcher):
+        self.url_format = url_format
+        self.tile_fetcher = tile_fetcher
+
+    def fetch_tile(self, x, y, z):
+        return self.tile_fetcher.fetch_tile(x, y, z)
+
+
+PROXY = None
+ORIGINAL_GET_MAP_ID = None
+
+
+def enable_tile_proxy(**kwargs):
+    """Route the tiles of every layer added afterwards, e.g. with Map.addLayer(), through a TileCacheProxy.
+
+    Args:
+        **kwargs: Arguments of TileCacheProxy.
+
+    Returns:
+        TileCacheProxy: The running proxy, e.g. to read its stats().
+    """
+    import ee
+
+    global PROXY, ORIGINAL_GET_MAP_ID
+    if PROXY is None:
+        PROXY = TileCacheProxy(**kwargs).start()
+    if ORIGINAL_GET_MAP_ID is None:
+        ORIGINAL_GET_MAP_ID = ee.data.getMapId
+
+    def getMapId(params):
+        result = ORIGINAL_GET_MAP_ID(params)
+        try:
+            layer_key = json.dumps([ee.serializer.encode(params['image'], for_cloud_api=True),
+                                    {key: value for key, value in params.items() if key != 'image'}],
+                                   sort_keys=True, default=str)
+        except Exception:
+            layer_key = None
+        url_format = PROXY.register(result['tile_fetcher'].url_format, layer_key)
+        result['tile_fetcher'] = ProxyTileFetcher(url_format, result['tile_fetcher'])
+        return result
+
+    ee.data.getMapId = getMapId
+    return PROXY
+
+
+def disable_tile_proxy():
+    """Restore the original ee.data.getMapId() and stop the proxy."""
+    import ee
+
+    global PROXY, ORIGINAL_GET_MAP_ID
+    if ORIGINAL_GET_MAP_ID is not None:
+        ee.data.getMapId = ORIGINAL_GET_MAP_ID
+    if PROXY is not None:
+        PROXY.stop()
+    PROXY = None
+    ORIGINAL_GET_MAP_ID = None
+
+
+class FakeTileServer:
+    """Local stand-in for the Earth Engine tile server, answering every tile after an injected latency.
+
+    Args:
+        latency (float, optional): Seconds before each answer. Defaults to 0.1.
+        tile_bytes (int, optional): Size of the tiles. Defaults to 20000.
+    """
+
+    def __init__(self, latency=0.1, tile_bytes=20000):
+        self.latency = latency
+        self.tile_bytes = tile_bytes
+        self.requests = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                with server.lock:
+                    server.requests += 1
+                time.sleep(server.latency)
+                data = self.path.encode('utf-8').ljust(server.tile_bytes, b'\0')
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/png')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url_format = 'http://127.0.0.1:{}/map/{{z}}/{{x}}/{{y}}'.format(self.httpd.server_address[1])
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def visit(url_format, z, x, y, size=4):
+    """Request a size x size viewport of tiles through HTTP, like a map view in a browser.
+
+    Returns:
+        float: Mean seconds per tile.
+    """
+    start_time = time.perf_counter()
+    for dy in range(size):
+        for dx in range(size):
+            with urllib.request.urlopen(url_format.format(z=z, x=x + dx, y=y + dy)) as response:
+                response.read()
+    return (time.perf_counter() - start_time) / (size * size)
+
+
+if __name__ == '__main__':
+
+    import tempfile
+
+    parser = argparse.ArgumentParser(description='Run the tile cache proxy against a local fake tile server.')
+    parser.add_argument('--latency', type=float, default=0.2, help='Seconds before the fake tile server answers')
+    parser.add_argument('--viewport', type=int, default=4, help='Tiles per side of the viewport of each visit')
+    args = parser.parse_args()
+
+    upstream = FakeTileServer(args.latency).start()
+    tiles = args.viewport * args.viewport
+    with tempfile.TemporaryDirectory() as cache_dir:
+        proxy = TileCacheProxy(os.path.join(cache_dir, 'tiles.sqlite')).start()
+        url_format = proxy.register(upstream.url_format, 'SRTM DEM')
+        first = visit(url_format, 10, 160, 390, args.viewport)
+        time.sleep(args.latency * 4)   # let the prefetches finish
+        before = proxy.stats()
+        repeat = visit(url_format, 10, 160, 390, args.viewport)
+        after = proxy.stats()
+        panned = visit(url_format, 10, 160 + args.viewport, 390, 1)
+        proxy.executor.shutdown(wait=True)
+        proxy.stop()
+        stats = proxy.stats()
+        print('First visit: {:.1f} ms/tile, repeat visit: {:.1f} ms/tile, panned tile: {:.1f} ms'.format(
+            first * 1000, repeat * 1000, panned * 1000))
+        print('Upstream requests: {}, proxy stats: {}'.format(upstream.requests, json.dumps(stats)))
+        hits = after['memory_hits'] + after['disk_hits'] - before['memory_hits'] - before['disk_hits']
+        assert hits == tiles and after['misses'] == before['misses'], 'the repeat visit is served from the cache'
+        assert upstream.requests == stats['misses'] + stats['prefetched'], 'every upstream request is counted once'
+
+        # A cache of 5 tiles evicts the least recently used ones.
+        small = TileCacheProxy(os.path.join(cache_dir, 'small.sqlite'), max_bytes=5 * upstream.tile_bytes,
+                               prefetch=False).start()
+        visit(small.register(upstream.url_format, 'small'), 10, 160, 390, args.viewport)
+        small.stop()
+        stats = small.stats()
+        assert stats['evictions'] == tiles - 5 and stats['disk_bytes'] <= 5 * upstream.tile_bytes, stats
+
+        # Tiles older than max_age are fetched again.
+        expiring = TileCacheProxy(os.path.join(cache_dir, 'expiring.sqlite'), prefetch=False, max_age=0.5).start()
+        url_format = expiring.register(upstream.url_format, 'expiring')
+        visit(url_format, 10, 160, 390, 1)
+        visit(url_format, 10, 160, 390, 1)
+        time.sleep(0.6)
+        visit(url_format, 10, 160, 390, 1)
+        expiring.stop()
+        stats = expiring.stats()
+        assert stats['misses'] == 2 and stats['memory_hits'] == 1, stats
+    upstream.stop()
+    print('Tile cache proxy: OK')
@@ -0,0 +1,532 @@
+''' Download an Earth Engine image of any size as a grid of tiles, and mosaic them into one local file.
+
+A single getDownloadURL() request fails once the region exceeds the per-request size limit of the server.
+TiledDownloader splits the region into a grid of pixel-aligned tiles small enough for one request each, based on
+the scale, the number of bands and the data type, and
+    * downloads the tiles concurrently over one pooled HTTP session, retrying throttled requests,
+    * records the finished tiles in a manifest next to the output, so an interrupted download resumes with the
+      missing tiles only,
+    * mosaics the tiles one at a time into a memory-mapped .npy array (numpy) or a tiled, compressed GeoTIFF
+      (rasterio), so the full raster is never held in memory.
+
+    download_tiled(ee.Image('srtm90_v4'), 'srtm.tif', [-120, 34, -119, 35], scale=30, dtype='int16')
+
+'''
+
+# License: MIT
+
+import io
+import os
+import json
+import math
+import time
+import random
+import shutil
+import hashlib
+import argparse
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+MAX_TILE_BYTES = 32 * 1024 * 1024   # the server rejects requests over 48 MB
+MAX_TILE_DIMENSION = 8192
+METERS_PER_DEGREE = 111319.49079327357
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+CAST_FUNCTIONS = {
+    'uint8': 'toUint8', 'int8': 'toInt8', 'uint16': 'toUint16', 'int16': 'toInt16',
+    'uint32': 'toUint32', 'int32': 'toInt32', 'float32': 'toFloat', 'float64': 'toDouble',
+}
+
+
+def pixel_size(scale, crs):
+    """Get the size of a pixel in the units of a CRS.
+
+    Args:
+        scale (float): Pixel size in meters.
+        crs (str): CRS code. EPSG:4326 is in degrees; other CRS are assumed to be in meters.
+
+    Returns:
+        float: Pixel size in CRS units.
+    """
+    if crs.upper() in ['EPSG:4326', 'EPSG:4269', 'EPSG:4267']:
+        return scale / METERS_PER_DEGREE
+    return float(scale)
+
+
+def tile_side(bands, dtype, max_tile_bytes=MAX_TILE_BYTES, max_tile_dimension=MAX_TILE_DIMENSION):
+    """Get the side of the largest square tile that fits in one request.
+
+    Args:
+        bands (int): Number of bands.
+        dtype (str): Data type of the pixels, e.g. 'float32'.
+        max_tile_bytes (int, optional): Maximum size of a tile. Defaults to MAX_TILE_BYTES.
+        max_tile_dimension (int, optional): Maximum width and height of a tile. Defaults to MAX_TILE_DIMENSION.
+
+    Returns:
+        int: Side of the tiles in pixels, a multiple of 256 when possible so tiles line up with GeoTIFF blocks.
+    """
+    import numpy as np
+
+    side = int(math.sqrt(max_tile_bytes / float(bands * np.dtype(dtype).itemsize)))
+    side = min(side, max_tile_dimension)
+    if side >= 256:
+        side -= side % 256
+    return max(side, 1)
+
+
+def plan_tiles(bounds, pixel, side):
+    """Split a region into a grid of tiles.
+
+    Args:
+        bounds (list): [xmin, ymin, xmax, ymax] of the region in CRS units.
+        pixel (float): Pixel size in CRS units.
+        side (int): Side of the tiles in pixels.
+
+    Returns:
+        tuple: Width and height of the mosaic in pixels, and the tiles as dicts with their 'name',
+            pixel window ('row', 'col', 'height', 'width') and 'transform' ([pixel, 0, x0, 0, -pixel, y0]).
+    """
+    xmin, ymin, xmax, ymax = bounds
+    width = max(int(math.ceil((xmax - xmin) / pixel - 1e-9)), 1)
+    height = max(int(math.ceil((ymax - ymin) / pixel - 1e-9)), 1)
+
+    tiles = []
+    for row in range(0, height, side):
+        for col in range(0, width, side):
+            tiles.append({
+                'name': 'tile_{}_{}'.format(row, col),
+                'row': row,
+                'col': col,
+                'height': min(side, height - row),
+                'width': min(side, width - col),
+                'transform': [pixel, 0, xmin + col * pixel, 0, -pixel, ymax - row * pixel],
+            })
+    return width, height, tiles
+
+
+def region_bounds(region, crs):
+    """Get the bounds of a region.
+
+    Args:
+        region (list | ee.Geometry): [xmin, ymin, xmax, ymax], a list of [x, y] coordinates, or a geometry.
+        crs (str): CRS of the bounds.
+
+    Returns:
+        list: [xmin, ymin, xmax, ymax].
+    """
+    if isinstance(region, str):
+        region = json.loads(region)
+    if isinstance(region, (list, tuple)):
+        if len(region) == 4 and all(isinstance(value, (int, float)) for value in region):
+            return list(region)
+        points = region
+        while isinstance(points[0][0], (list, tuple)):
+            points = [point for ring in points for point in ring]
+        xs = [point[0] for point in points]
+        ys = [point[1] for point in points]
+        return [min(xs), min(ys), max(xs), max(ys)]
+
+    import ee
+    ring = ee.Geometry(region).bounds(1, crs).coordinates().getInfo()[0]
+    return region_bounds(ring, crs)
+
+
+class TiledDownloader:
+    """Download an image as a grid of tiles and mosaic them.
+
+    Args:
+        image (ee.Image): Image to download.
+        out_file (str): Output file, a .tif GeoTIFF or a .npy array of shape (bands, height, width).
+        region (list | ee.Geometry): Region, see region_bounds().
+        scale (float): Pixel size in meters.
+        crs (str, optional): CRS of the output. Defaults to 'EPSG:4326'.
+        bands (list, optional): Bands to download. Defaults to None, which downloads every band.
+        dtype (str, optional): Data type of the output; the image is cast to it on the server. Defaults to 'float32'.
+        nodata (float, optional): Value of the masked pixels. Defaults to None, which leaves them to the server (0).
+        workers (int, optional): Number of tiles downloaded at the same time. Defaults to 8.
+        retries (int, optional): Number of retries of a failed tile. Defaults to 4.
+        max_tile_bytes (int, optional): Maximum size of a tile. Defaults to MAX_TILE_BYTES.
+    """
+
+    def __init__(self, image, out_file, region, scale, crs='EPSG:4326', bands=None, dtype='float32', nodata=None,
+                 workers=8, retries=4, max_tile_bytes=MAX_TILE_BYTES):
+        if dtype not in CAST_FUNCTIONS:
+            raise ValueError('The dtype must be one of the following: {}'.format(', '.join(CAST_FUNCTIONS)))
+
+        self.out_file = os.path.abspath(out_file)
+        self.tiles_dir = self.out_file + '.tiles'
+        self.manifest_file = self.out_file + '.manifest.json'
+        self.crs = crs
+        self.dtype = dtype
+        self.nodata = nodata
+        self.workers = workers
+        self.retries = retries
+
+        self.bands, self.image, expression = self.prepare(image, bands)
+        self.bounds = region_bounds(region, crs)
+        self.pixel = pixel_size(scale, crs)
+        self.side = tile_side(len(self.bands), dtype, max_tile_bytes)
+        self.width, self.height, self.tiles = plan_tiles(self.bounds, self.pixel, self.side)
+
+        self.key = hashlib.sha256(json.dumps([
+            expression, self.bounds, self.pixel, crs, self.bands, dtype, self.side,
+        ], sort_keys=True).encode('utf-8')).hexdigest()
+        self.lock = threading.Lock()
+        self.manifest = self.read_manifest()
+
+    def prepare(self, image, bands):
+        """Select the bands of the image, and fill and cast its pixels on the server.
+
+        Args:
+            image (ee.Image): Image to download.
+            bands (list): Bands to download, or None for every band.
+
+        Returns:
+            tuple: Band names, the image to download, and its serialized expression.
+        """
+        import ee
+
+        bands = bands or ee.Image(image).bandNames().getInfo()
+        image = ee.Image(image).select(bands)
+        if self.nodata is not None:
+            image = image.unmask(self.nodata)
+        image = getattr(image, CAST_FUNCTIONS[self.dtype])()
+        return bands, image, ee.serializer.toJSON(image)
+
+    def read_manifest(self):
+        """Read the manifest of an earlier download of the same image, region and grid.
+
+        Returns:
+            dict: Manifest with the finished 'tiles'. Tiles of a different download are removed.
+        """
+        manifest = None
+        if os.path.isfile(self.manifest_file):
+            try:
+                with open(self.manifest_file) as f:
+                    manifest = json.load(f)
+            except ValueError:
+                manifest = None
+        if manifest is None or manifest.get('key') != self.key:
+            shutil.rmtree(self.tiles_dir, ignore_errors=True)
+            manifest = {'key': self.key, 'tiles': {}}
+        manifest.update({
+            'crs': self.crs, 'transform': [self.pixel, 0, self.bounds[0], 0, -self.pixel, self.bounds[3]],
+            'width': self.width, 'height': self.height, 'bands': self.bands, 'dtype': self.dtype, 'nodata': self.nodata,
+        })
+        return manifest
+
+    def write_manifest(self):
+        tmp_file = self.manifest_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_file, self.manifest_file)
+
+    def tile_file(self, tile):
+        return os.path.join(self.tiles_dir, tile['name'] + '.npy')
+
+    def pending(self):
+        """Get the tiles that are not downloaded yet.
+
+        Returns:
+            list: Tiles missing from the manifest or from the tiles folder.
+        """
+        return [tile for tile in self.tiles
+                if tile['name'] not in self.manifest['tiles'] or not os.path.isfile(self.tile_file(tile))]
+
+    def fetch(self, session, tile):
+        """Download one tile and record it in the manifest.
+
+        Args:
+            session (requests.Session): Pooled HTTP session.
+            tile (dict): Tile, see plan_tiles().
+
+        Returns:
+            int: Size of the tile in bytes.
+        """
+        import numpy as np
+        import requests
+
+        params = {
+            'crs': self.crs,
+            'crs_transform': tile['transform'],
+            'dimensions': [tile['width'], tile['height']],
+            'format': 'NPY',
+        }
+        # Only throttling, server errors and dropped connections are retried: a bad request or an
+        # ee.EEException fails the same way every time.
+        url = self.image.getDownloadURL(params)
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(min(2 ** (attempt - 1), 60) * (0.5 + random.random()))
+            try:
+                response = session.get(url, timeout=600)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+                continue
+            if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                response.raise_for_status()
+                break
+        data = np.load(io.BytesIO(response.content))
+        if data.shape != (tile['height'], tile['width']):
+            raise IOError('Unexpected tile shape {}'.format(data.shape))
+
+        tmp_file = self.tile_file(tile) + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            np.save(f, np.stack([data[band] for band in self.bands]).astype(self.dtype, copy=False))
+        os.replace(tmp_file, self.tile_file(tile))
+        size = os.path.getsize(self.tile_file(tile))
+        # Recorded here rather than by the caller, so the tiles still in flight when another one fails are kept.
+        with self.lock:
+            self.manifest['tiles'][tile['name']] = {'bytes': size}
+            self.write_manifest()
+        return size
+
+    def download(self):
+        """Download the tiles that are missing, recording each finished tile in the manifest.
+
+        Returns:
+            int: Number of tiles downloaded.
+        """
+        try:
+            import requests
+        except ImportError:
+            raise ImportError('Downloading tiles needs the requests package. To install it: pip install requests')
+
+        pending = self.pending()
+        print('{} tiles of {}x{} pixels, {} to download'.format(len(self.tiles), self.side, self.side, len(pending)))
+        if not pending:
+            return 0
+
+        os.makedirs(self.tiles_dir, exist_ok=True)
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        start_time = time.time()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = {executor.submit(self.fetch, session, tile): tile for tile in pending}
+                for index, future in enumerate(as_completed(futures), 1):
+                    tile = futures[future]
+                    size = future.result()
+                    print('{}/{} {} ({:.1f} MB, {:.1f}s)'.format(
+                        index, len(pending), tile['name'], size / 1e6, time.time() - start_time))
+        finally:
+            session.close()
+        return len(pending)
+
+    def mosaic(self):
+        """Write the downloaded tiles into the output file, one tile at a time.
+
+        Returns:
+            str: File path of the output.
+        """
+        if self.pending():
+            raise IOError('{} tiles are missing. Run download() first.'.format(len(self.pending())))
+        if self.out_file.lower().endswith('.npy'):
+            self.mosaic_npy()
+        else:
+            self.mosaic_geotiff()
+        return self.out_file
+
+    def mosaic_npy(self):
+        import numpy as np
+
+        out = np.lib.format.open_memmap(self.out_file, mode='w+', dtype=self.dtype,
+                                        shape=(len(self.bands), self.height, self.width))
+        for tile in self.tiles:
+            data = np.load(self.tile_file(tile), mmap_mode='r')
+            out[:, tile['row']:tile['row'] + tile['height'], tile['col']:tile['col'] + tile['width']] = data
+        out.flush()
+        del out
+
+    def mosaic_geotiff(self):
+        import numpy as np
+        try:
+            import rasterio
+            from rasterio.windows import Window
+        except ImportError:
+            raise ImportError('Writing GeoTIFF needs the rasterio package. To install it: pip install rasterio. '
+                              'Or use a .npy output file.')
+
+        profile = {
+            'driver': 'GTiff', 'width': self.width, 'height': self.height, 'count': len(self.bands),
+            'dtype': self.dtype, 'crs': self.crs, 'nodata': self.nodata,
+            'transform': rasterio.transform.from_origin(self.bounds[0], self.bounds[3], self.pixel, self.pixel),
+            'tiled': True, 'blockxsize': 256, 'blockysize': 256, 'compress': 'deflate', 'BIGTIFF': 'IF_SAFER',
+        }
+        with rasterio.open(self.out_file, 'w', **profile) as dst:
+            dst.descriptions = tuple(self.bands)
+            for tile in self.tiles:
+                data = np.load(self.tile_file(tile), mmap_mode='r')
+                dst.write(data, window=Window(tile['col'], tile['row'], tile['width'], tile['height']))
+
+    def run(self, keep_tiles=False):
+        """Download the missing tiles and mosaic them.
+
+        Args:
+            keep_tiles (bool, optional): Whether to keep the tiles and the manifest after the mosaic is written. Defaults to False.
+
+        Returns:
+            str: File path of the output.
+        """
+        self.download()
+        self.mosaic()
+        if not keep_tiles:
+            shutil.rmtree(self.tiles_dir, ignore_errors=True)
+            os.remove(self.manifest_file)
+        return self.out_file
+
+
+def download_tiled(image, out_file, region, scale, crs='EPSG:4326', bands=None, dtype='float32', nodata=None,
+                   workers=8, keep_tiles=False):
+    """Download an image of any size to a GeoTIFF (.tif) or a memory-mappable numpy array (.npy).
+
+    Args:
+        image (ee.Image): Image to download.
+        out_file (str): Output file.
+        region (list | ee.Geometry): Region, see region_bounds().
+        scale (float): Pixel size in meters.
+        crs (str, optional): CRS of the output. Defaults to 'EPSG:4326'.
+        bands (list, optional): Bands to download. Defaults to None, which downloads every band.
+        dtype (str, optional): Data type of the output. Defaults to 'float32'.
+        nodata (float, optional): Value of the masked pixels. Defaults to None.
+        workers (int, optional): Number of tiles downloaded at the same time. Defaults to 8.
+        keep_tiles (bool, optional): Whether to keep the tiles after the mosaic is written. Defaults to False.
+
+    Returns:
+        str: File path of the output.
+    """
+    downloader = TiledDownloader(image, out_file, region, scale, crs, bands, dtype, nodata, workers)
+    return downloader.run(keep_tiles)
+
+
+class FakeDownloadServer:
+    """Local stand-in for the Earth Engine download server, answering NPY tiles of a synthetic image.
+
+    The value of a pixel is row * 1e4 + col in band 'a' and its negative in band 'b', in the pixel grid of the bounds.
+
+    Args:
+        bounds (list): [xmin, ymin, xmax, ymax] of the pixel grid.
+        pixel (float): Pixel size.
+        answers (dict, optional): HTTP statuses answered first for some tiles, by 'tile_<row>_<col>' name, e.g.
+            {'tile_0_0': [503]}; the last status of a list is repeated. Defaults to None.
+    """
+
+    def __init__(self, bounds, pixel, answers=None):
+        self.requests = {}
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                import numpy as np
+
+                query = dict(urllib.parse.parse_qsl(urllib.parse.urlparse(self.path).query))
+                row = int(round((bounds[3] - float(query['y0'])) / pixel))
+                col = int(round((float(query['x0']) - bounds[0]) / pixel))
+                name = 'tile_{}_{}'.format(row, col)
+                with server.lock:
+                    count = server.requests[name] = server.requests.get(name, 0) + 1
+                statuses = (answers or {}).get(name, [])
+                status = statuses[min(count, len(statuses)) - 1] if statuses else 200
+                if status == 200:
+                    rows, cols = np.mgrid[row:row + int(query['height']), col:col + int(query['width'])]
+                    data = np.zeros(rows.shape, dtype=[('a', 'float64'), ('b', 'float64')])
+                    data['a'] = rows * 1e4 + cols
+                    data['b'] = -data['a']
+                    f = io.BytesIO()
+                    np.save(f, data)
+                    body = f.getvalue()
+                else:
+                    body = b''
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = 'http://127.0.0.1:{}/download'.format(self.httpd.server_address[1])
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == '__main__':
+
+    import tempfile
+    import numpy as np
+
+    parser = argparse.ArgumentParser(description='Check the retries, resume and .npy mosaic of TiledDownloader '
+                                                 'against a local fake download server.')
+    parser.add_argument('--height', type=int, default=700, help='Rows of the test image')
+    parser.add_argument('--width', type=int, default=900, help='Columns of the test image')
+    parser.add_argument('--tile-bytes', type=int, default=2 * 256 * 256 * 4, help='Maximum size of a tile')
+    args = parser.parse_args()
+
+    bounds = [0.0, 0.0, args.width * 30.0, args.height * 30.0]
+
+    class FakeImage:
+        def __init__(self, url):
+            self.url = url
+
+        def getDownloadURL(self, params):
+            transform = params['crs_transform']
+            return '{}?x0={}&y0={}&width={}&height={}'.format(self.url, transform[2], transform[5],
+                                                               *params['dimensions'])
+
+    class FakeDownloader(TiledDownloader):
+        def prepare(self, image, bands):
+            return bands, image, 'fake image'
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        out_file = os.path.join(out_dir, 'fake.npy')
+        _, _, tiles = plan_tiles(bounds, 30.0, tile_side(2, 'float32', args.tile_bytes))
+        names = [tile['name'] for tile in tiles]
+        server = FakeDownloadServer(bounds, 30.0, {names[0]: [503, 200], names[-1]: [400]}).start()
+        downloader = FakeDownloader(FakeImage(server.url), out_file, bounds, 30, 'EPSG:3857', ['a', 'b'],
+                                    retries=2, workers=4, max_tile_bytes=args.tile_bytes)
+        try:
+            downloader.download()
+            raise AssertionError('The HTTP 400 tile did not fail the download.')
+        except Exception as e:
+            assert '400' in str(e), e
+        assert server.requests[names[0]] == 2, 'HTTP 503 is retried'
+        assert server.requests[names[-1]] == 1, 'HTTP 400 is not retried'
+        with open(downloader.manifest_file) as f:
+            recorded = json.load(f)['tiles']
+        assert sorted(recorded) == sorted(names[:-1]), 'every finished tile is in the manifest'
+
+        server.stop()
+        server = FakeDownloadServer(bounds, 30.0).start()
+        downloader = FakeDownloader(FakeImage(server.url), out_file, bounds, 30, 'EPSG:3857', ['a', 'b'],
+                                    retries=2, workers=4, max_tile_bytes=args.tile_bytes)
+        assert downloader.download() == 1 and list(server.requests) == [names[-1]], 'the resume fetches the failed tile only'
+        downloader.mosaic()
+        server.stop()
+
+        mosaic = np.load(out_file, mmap_mode='r')
+        rows, cols = np.mgrid[0:args.height, 0:args.width]
+        assert mosaic.shape == (2, args.height, args.width) and mosaic.dtype == np.float32
+        assert np.array_equal(mosaic[0], (rows * 1e4 + cols).astype('float32'))
+        assert np.array_equal(mosaic[1], -(rows * 1e4 + cols).astype('float32'))
+        del mosaic
+
+    print('Tiled download of a {}x{} image in {} tiles, with a retry, a failure and a resume: OK'.format(
+        args.height, args.width, len(tiles)))
@@ -0,0 +1,475 @@
+''' reduceRegion over regions of any size, split into a grid of tiles whose partial statistics are merged exactly.
+
+reduceRegion() over a large region at a fine scale fails with "Too many pixels in the region" or times out.
+tiled_reduce_region() splits the region into a grid of tiles on the pixel grid of the reduction, so every pixel
+belongs to exactly one tile, reduces the tiles concurrently, and merges the partial results:
+    * sum, count, min and max are merged directly,
+    * mean, variance and stdDev are computed from the weight, sum and sum of squared deviations from the tile mean
+      of each tile, merged with the pairwise update of Chan et al.; the deviations are taken in a second pass over
+      the tile, so no precision is lost to sums of squares of large values,
+    * histograms use fixed buckets, so the counts of the tiles add up,
+    * the covariance of the bands is merged in the same way from the mean vector and centred co-moment matrix of
+      each tile,
+    * grouped statistics (like ee.Reducer.mean().group()) are merged per group.
+
+    tiled_reduce_region(image, region, ['mean', 'stdDev'], scale=30)
+
+Means, sums and moments are weighted by the pixel coverage like reduceRegion(); count is the number of unmasked
+pixels. tiled_reduce_array() computes the same partial statistics from a local array, so the merges can be checked
+offline against NumPy:
+
+    python tiled_reduce.py
+
+'''
+
+# License: MIT
+
+import math
+import time
+import random
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from tiled_download import pixel_size, plan_tiles, region_bounds
+
+
+STATISTICS = ['mean', 'sum', 'count', 'min', 'max', 'variance', 'stdDev', 'histogram', 'covariance']
+GROUP_STATISTICS = ['mean', 'sum', 'count', 'min', 'max', 'variance', 'stdDev']
+MOMENT_STATISTICS = ['mean', 'sum', 'variance', 'stdDev']
+
+
+def check_statistics(statistics, histogram, group):
+    allowed = GROUP_STATISTICS if group else STATISTICS
+    unknown = [statistic for statistic in statistics if statistic not in allowed]
+    if unknown:
+        raise ValueError('Unsupported statistics {}. Choose from: {}'.format(', '.join(unknown), ', '.join(allowed)))
+    if 'histogram' in statistics and histogram is None:
+        raise ValueError('A histogram needs fixed buckets: histogram=(min, max, steps).')
+
+
+def merge_moments(parts):
+    """Merge the weight, sum and sum of squared deviations of several tiles.
+
+    Args:
+        parts (list): (n, s, m2) of each tile, with m2 the sum of the squared deviations from the mean of the tile.
+
+    Returns:
+        tuple: Total weight, mean and sum of squared deviations from the mean.
+    """
+    n = mean = m2 = 0.0
+    for part_n, part_s, part_m2 in parts:
+        if not part_n:
+            continue
+        part_mean = part_s / part_n
+        delta = part_mean - mean
+        total = n + part_n
+        mean += delta * part_n / total
+        m2 += part_m2 + delta * delta * n * part_n / total
+        n = total
+    return n, mean, m2
+
+
+def merge_comoments(parts, size):
+    """Merge the weight, sums and co-moments of several tiles.
+
+    Args:
+        parts (list): (n, s, c) of each tile, with s the sums of the bands and c the matrix of the sums of the products
+            of their deviations from the means of the tile.
+        size (int): Number of bands.
+
+    Returns:
+        tuple: Total weight, mean vector and co-moment matrix (sums of the products of the deviations from the means).
+    """
+    n = 0.0
+    mean = [0.0] * size
+    comoment = [[0.0] * size for _ in range(size)]
+    for part_n, part_s, part_c in parts:
+        if not part_n:
+            continue
+        part_mean = [value / part_n for value in part_s]
+        delta = [part_mean[i] - mean[i] for i in range(size)]
+        total = n + part_n
+        for i in range(size):
+            for j in range(size):
+                comoment[i][j] += part_c[i][j] + delta[i] * delta[j] * n * part_n / total
+        mean = [mean[i] + delta[i] * part_n / total for i in range(size)]
+        n = total
+    return n, mean, comoment
+
+
+def moment_statistics(n, s, mean, m2, statistics, ddof):
+    values = {'mean': mean if n else None, 'sum': s,
+              'variance': m2 / (n - ddof) if n > ddof else None}
+    values['stdDev'] = math.sqrt(values['variance']) if values['variance'] is not None else None
+    return {statistic: values[statistic] for statistic in statistics if statistic in values}
+
+
+def merge_partials(partials, bands, statistics, ddof=0, group_name='group'):
+    """Merge the partial statistics of the tiles.
+
+    Args:
+        partials (list): Partial statistics of each tile, from tile_partials() or array_partials().
+        bands (list): Band names.
+        statistics (list): Statistics to compute.
+        ddof (int, optional): Delta degrees of freedom of variance, stdDev and covariance. Defaults to 0.
+        group_name (str, optional): Key of the group values. Defaults to 'group'.
+
+    Returns:
+        dict: '<band>_<statistic>' values, 'covariance' as a matrix in the order of the bands, or 'groups' as a
+            list of {group_name: value, '<statistic>': value} sorted by group.
+    """
+    if any('groups' in partial for partial in partials):
+        groups = {}
+        for partial in partials:
+            for item in partial['groups']:
+                merged = groups.setdefault(item['group'], {'sums': [], 'count': [], 'min': [], 'max': []})
+                for key in merged:
+                    if item.get(key) is not None:
+                        merged[key].append(item[key])
+        result = []
+        for group in sorted(groups):
+            n, mean, m2 = merge_moments(groups[group]['sums'])
+            item = {group_name: group}
+            item.update(moment_statistics(n, sum(part[1] for part in groups[group]['sums']), mean, m2, statistics, ddof))
+            if 'count' in statistics:
+                item['count'] = sum(groups[group]['count'])
+            if 'min' in statistics:
+                item['min'] = min(groups[group]['min'], default=None)
+            if 'max' in statistics:
+                item['max'] = max(groups[group]['max'], default=None)
+            result.append(item)
+        return {'groups': result}
+
+    result = {}
+    for band in bands:
+        if any(statistic in statistics for statistic in MOMENT_STATISTICS):
+            parts = [(partial['sums']['n_' + band] or 0, partial['sums']['s_' + band] or 0,
+                      partial['sums']['c_' + band] or 0) for partial in partials]
+            n, mean, m2 = merge_moments(parts)
+            for statistic, value in moment_statistics(n, sum(part[1] for part in parts), mean, m2,
+                                                      statistics, ddof).items():
+                result['{}_{}'.format(band, statistic)] = value
+        if 'count' in statistics:
+            result[band + '_count'] = sum(partial['count'][band] or 0 for partial in partials)
+        for statistic, function in [('min', min), ('max', max)]:
+            if statistic in statistics:
+                values = [partial[statistic][band] for partial in partials if partial[statistic][band] is not None]
+                result['{}_{}'.format(band, statistic)] = function(values, default=None)
+        if 'histogram' in statistics:
+            histogram = None
+            for partial in partials:
+                buckets = partial['histogram'][band]
+                if buckets is None:
+                    continue
+                if histogram is None:
+                    histogram = [[bucket, 0] for bucket, _ in buckets]
+                for bucket, (_, count) in enumerate(buckets):
+                    histogram[bucket][1] += count
+            result[band + '_histogram'] = histogram
+
+    if 'covariance' in statistics:
+        parts = []
+        for partial in partials:
+            sums = partial['covariance']
+            if not sums.get('n'):
+                continue
+            parts.append((sums['n'], [sums['s_' + band] for band in bands],
+                          [[sums['c_{}_{}'.format(*sorted([a, b]))] for b in bands] for a in bands]))
+        n, _, comoment = merge_comoments(parts, len(bands))
+        result['covariance'] = [[value / (n - ddof) for value in row] for row in comoment] if n > ddof else None
+    return result
+
+
+def tile_partials(image, bands, geometry, tile, crs, transform, statistics, histogram=None, group_band=None):
+    """Compute the partial statistics of one tile on the server, with one request.
+
+    Args:
+        image (ee.Image): Image to reduce.
+        bands (list): Bands to reduce; with group_band, a single band.
+        geometry (ee.Geometry): Region of the whole reduction.
+        tile (dict): Tile, see tiled_download.plan_tiles().
+        crs (str): CRS of the pixel grid.
+        transform (list): Transform of the pixel grid, shared by all the tiles.
+        statistics (list): Statistics to compute.
+        histogram (tuple, optional): (min, max, steps) of the fixed histogram buckets. Defaults to None.
+        group_band (str, optional): Band with the group of each pixel. Defaults to None.
+
+    Returns:
+        dict: Partial statistics, see merge_partials().
+    """
+    import ee
+
+    pixel, x0, y0 = tile['transform'][0], tile['transform'][2], tile['transform'][5]
+    cell = ee.Geometry.Rectangle([x0, y0 - tile['height'] * pixel, x0 + tile['width'] * pixel, y0], crs, False)
+    # The tile edges lie half a pixel from the pixel centres that decide which tile a pixel belongs to, so the
+    # intersection must not move them by more than a small fraction of a pixel.
+    region = ee.Geometry(geometry).intersection(cell, ee.ErrorMargin(pixel / 1000, 'projected'), crs)
+
+    def reduce(selected, reducer):
+        return selected.reduceRegion(reducer=reducer, geometry=region, crs=crs, crsTransform=transform,
+                                     maxPixels=1e13)
+
+    def deviations(selected, sums, weights):
+        # Second pass over the tile: the deviations from the tile means, from the weights and sums of the first.
+        means = ee.List([ee.Number(sums.get('s_' + band)).divide(sums.get(weight))
+                         for band, weight in zip(bands, weights)])
+        return selected.subtract(ee.Image.constant(means)).rename(bands)
+
+    values = image.select(bands)
+    partials = {}
+
+    if group_band is not None:
+        groups = image.select(group_band)
+        sums = ee.List(reduce(ee.Image.cat([values.multiply(0).add(1), values, groups]),
+                              ee.Reducer.sum().repeat(2).group(groupField=2, groupName='group')).get('groups'))
+        codes = sums.map(lambda item: ee.Dictionary(item).get('group'))
+        means = sums.map(lambda item: ee.Number(ee.List(ee.Dictionary(item).get('sum')).get(1)).divide(
+            ee.List(ee.Dictionary(item).get('sum')).get(0)))
+        centred = values.subtract(groups.remap(codes, means))
+        partials['groups'] = sums
+        partials['m2'] = ee.Algorithms.If(codes.size(), reduce(
+            ee.Image.cat([centred.multiply(centred), groups]),
+            ee.Reducer.sum().group(groupField=1, groupName='group')).get('groups'), ee.List([]))
+        for statistic in ['count', 'min', 'max']:
+            if statistic in statistics:
+                reducer = getattr(ee.Reducer, statistic)().group(groupField=1, groupName='group')
+                partials[statistic] = reduce(ee.Image.cat([values, groups]), reducer).get('groups')
+        partials = ee.data.computeValue(ee.Dictionary(partials))
+        m2 = {item['group']: item['sum'] for item in partials['m2']}
+        items = {item['group']: {'group': item['group'], 'sums': item['sum'] + [m2.get(item['group'], 0.0)]}
+                 for item in partials['groups']}
+        for statistic in ['count', 'min', 'max']:
+            for item in partials.get(statistic, []):
+                items[item['group']][statistic] = item[statistic]
+        return {'groups': list(items.values())}
+
+    if any(statistic in statistics for statistic in MOMENT_STATISTICS):
+        sums = reduce(ee.Image.cat([values.multiply(0).add(1).rename(['n_' + band for band in bands]),
+                                    values.rename(['s_' + band for band in bands])]), ee.Reducer.sum())
+        centred = deviations(values, sums, ['n_' + band for band in bands])
+        partials['sums'] = sums.combine(reduce(centred.multiply(centred).rename(['c_' + band for band in bands]),
+                                               ee.Reducer.sum()))
+    for statistic in ['count', 'min', 'max']:
+        if statistic in statistics:
+            partials[statistic] = reduce(values, getattr(ee.Reducer, statistic)())
+    if 'histogram' in statistics:
+        partials['histogram'] = reduce(values, ee.Reducer.fixedHistogram(*histogram))
+    if 'covariance' in statistics:
+        joint = values.updateMask(values.mask().reduce(ee.Reducer.min()))
+        sums = reduce(ee.Image.cat([joint.select(bands[0]).multiply(0).add(1).rename('n'),
+                                    joint.rename(['s_' + band for band in bands])]), ee.Reducer.sum())
+        centred = deviations(joint, sums, ['n'] * len(bands))
+        products = [centred.select(a).multiply(centred.select(b)).rename('c_{}_{}'.format(*sorted([a, b])))
+                    for index, a in enumerate(bands) for b in bands[index:]]
+        partials['covariance'] = sums.combine(reduce(ee.Image.cat(products), ee.Reducer.sum()))
+    return ee.data.computeValue(ee.Dictionary(partials))
+
+
+def array_partials(data, mask, window, bands, statistics, histogram=None, groups=None):
+    """Compute the partial statistics of one tile of a local array, like tile_partials().
+
+    Args:
+        data (numpy.ndarray): Values of shape (bands, height, width).
+        mask (numpy.ndarray): Boolean validity of shape (bands, height, width).
+        window (dict): Tile, see tiled_download.plan_tiles().
+        bands (list): Band names.
+        statistics (list): Statistics to compute.
+        histogram (tuple, optional): (min, max, steps) of the fixed histogram buckets. Defaults to None.
+        groups (numpy.ndarray, optional): Group of each pixel, of shape (height, width). Defaults to None.
+
+    Returns:
+        dict: Partial statistics, see merge_partials().
+    """
+    import numpy as np
+
+    rows = slice(window['row'], window['row'] + window['height'])
+    cols = slice(window['col'], window['col'] + window['width'])
+    data = data[:, rows, cols].astype('float64')
+    mask = mask[:, rows, cols]
+
+    if groups is not None:
+        values, zones = data[0][mask[0]], groups[rows, cols][mask[0]]
+        items = []
+        for group in np.unique(zones):
+            selected = values[zones == group]
+            items.append({'group': group.item(), 'sums': [float(selected.size), float(selected.sum()),
+                                                          float(((selected - selected.mean()) ** 2).sum())],
+                          'count': int(selected.size), 'min': float(selected.min()), 'max': float(selected.max())})
+        return {'groups': items}
+
+    partials = {'sums': {}, 'count': {}, 'min': {}, 'max': {}, 'histogram': {}}
+    for index, band in enumerate(bands):
+        values = data[index][mask[index]]
+        centred = values - values.mean() if values.size else values
+        partials['sums'].update({'n_' + band: float(values.size), 's_' + band: float(values.sum()),
+                                 'c_' + band: float((centred * centred).sum())})
+        partials['count'][band] = int(values.size)
+        partials['min'][band] = float(values.min()) if values.size else None
+        partials['max'][band] = float(values.max()) if values.size else None
+        if histogram is not None and values.size:
+            low, high, steps = histogram
+            buckets = np.floor((values - low) / (high - low) * steps).astype('int64')
+            counts = np.bincount(buckets[(buckets >= 0) & (buckets < steps)], minlength=steps)
+            width = (high - low) / steps
+            partials['histogram'][band] = [[low + bucket * width, int(count)] for bucket, count in enumerate(counts)]
+        else:
+            partials['histogram'][band] = None
+
+    joint = mask.all(axis=0)
+    values = data[:, joint]
+    centred = values - values.mean(axis=1, keepdims=True) if values.shape[1] else values
+    partials['covariance'] = {'n': float(values.shape[1])}
+    for index, a in enumerate(bands):
+        partials['covariance']['s_' + a] = float(values[index].sum())
+        for other, b in enumerate(bands[index:], index):
+            partials['covariance']['c_{}_{}'.format(*sorted([a, b]))] = float((centred[index] * centred[other]).sum())
+    return partials
+
+
+def reduce_tiles(reduce_tile, tiles, workers=8, retries=4, verbose=True):
+    """Compute the partial statistics of the tiles concurrently, retrying failed tiles.
+
+    Args:
+        reduce_tile (function): Function of a tile returning its partial statistics.
+        tiles (list): Tiles, see tiled_download.plan_tiles().
+        workers (int, optional): Number of tiles reduced at the same time. Defaults to 8.
+        retries (int, optional): Number of retries of a failed tile. Defaults to 4.
+        verbose (bool, optional): Whether to print the progress. Defaults to True.
+
+    Returns:
+        list: Partial statistics of the tiles, in the order of the tiles.
+    """
+    def reduce(tile):
+        for attempt in range(retries + 1):
+            try:
+                return reduce_tile(tile)
+            except Exception:
+                if attempt == retries:
+                    raise
+                time.sleep(min(2 ** attempt, 60) * (0.5 + random.random()))
+
+    partials = [None] * len(tiles)
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(reduce, tile): index for index, tile in enumerate(tiles)}
+        for done, future in enumerate(as_completed(futures), 1):
+            partials[futures[future]] = future.result()
+            if verbose:
+                print('{}/{} tiles ({:.1f}s)'.format(done, len(tiles), time.time() - start_time))
+    return partials
+
+
+def tiled_reduce_region(image, geometry, statistics, scale, crs='EPSG:4326', bands=None, histogram=None,
+                        group_band=None, group_name='group', ddof=0, tile_pixels=1e7, workers=8, verbose=True):
+    """Reduce an image over a region of any size, tile by tile.
+
+    Args:
+        image (ee.Image): Image to reduce.
+        geometry (ee.Geometry): Region.
+        statistics (list): Statistics, from 'mean', 'sum', 'count', 'min', 'max', 'variance', 'stdDev', 'histogram' and 'covariance'.
+        scale (float): Pixel size in meters.
+        crs (str, optional): CRS of the pixel grid. Defaults to 'EPSG:4326'.
+        bands (list, optional): Bands to reduce. Defaults to None, which reduces every band but group_band.
+        histogram (tuple, optional): (min, max, steps) of the fixed histogram buckets. Defaults to None.
+        group_band (str, optional): Band with the group of each pixel, for grouped statistics of a single band. Defaults to None.
+        group_name (str, optional): Key of the group values in the result. Defaults to 'group'.
+        ddof (int, optional): Delta degrees of freedom of variance, stdDev and covariance. Defaults to 0.
+        tile_pixels (float, optional): Maximum number of pixels per tile. Defaults to 1e7.
+        workers (int, optional): Number of tiles reduced at the same time. Defaults to 8.
+        verbose (bool, optional): Whether to print the progress. Defaults to True.
+
+    Returns:
+        dict: Statistics, see merge_partials().
+    """
+    import ee
+
+    check_statistics(statistics, histogram, group_band is not None)
+    image = ee.Image(image)
+    if bands is None:
+        bands = [band for band in image.bandNames().getInfo() if band != group_band]
+    if group_band is not None and len(bands) != 1:
+        raise ValueError('Grouped statistics need a single band besides the group band, got {}.'.format(bands))
+
+    bounds = region_bounds(geometry, crs)
+    pixel = pixel_size(scale, crs)
+    _, _, tiles = plan_tiles(bounds, pixel, max(int(math.sqrt(tile_pixels)), 1))
+    transform = [pixel, 0, bounds[0], 0, -pixel, bounds[3]]
+    if verbose:
+        print('{} tiles of at most {:.0f} pixels'.format(len(tiles), tile_pixels))
+
+    partials = reduce_tiles(lambda tile: tile_partials(image, bands, geometry, tile, crs, transform, statistics,
+                                                       histogram, group_band), tiles, workers, verbose=verbose)
+    return merge_partials(partials, bands, statistics, ddof, group_name)
+
+
+def tiled_reduce_array(data, mask, statistics, bands=None, histogram=None, groups=None, group_name='group', ddof=0,
+                       tile_side=256, workers=8):
+    """Reduce a local array tile by tile, with the same partial statistics and merges as tiled_reduce_region().
+
+    Args:
+        data (numpy.ndarray): Values of shape (bands, height, width).
+        mask (numpy.ndarray): Boolean validity of shape (bands, height, width).
+        statistics (list): Statistics to compute.
+        bands (list, optional): Band names. Defaults to None, which names them b0, b1, ...
+        histogram (tuple, optional): (min, max, steps) of the fixed histogram buckets. Defaults to None.
+        groups (numpy.ndarray, optional): Group of each pixel, of shape (height, width). Defaults to None.
+        group_name (str, optional): Key of the group values in the result. Defaults to 'group'.
+        ddof (int, optional): Delta degrees of freedom of variance, stdDev and covariance. Defaults to 0.
+        tile_side (int, optional): Side of the tiles in pixels. Defaults to 256.
+        workers (int, optional): Number of tiles reduced at the same time. Defaults to 8.
+
+    Returns:
+        dict: Statistics, see merge_partials().
+    """
+    check_statistics(statistics, histogram, groups is not None)
+    bands = bands or ['b{}'.format(index) for index in range(data.shape[0])]
+    _, _, tiles = plan_tiles([0, 0, data.shape[2], data.shape[1]], 1, tile_side)
+    partials = reduce_tiles(lambda tile: array_partials(data, mask, tile, bands, statistics, histogram, groups),
+                            tiles, workers, retries=0, verbose=False)
+    return merge_partials(partials, bands, statistics, ddof, group_name)
+
+
+if __name__ == '__main__':
+
+    import numpy as np
+
+    parser = argparse.ArgumentParser(description='Check the merged statistics of tiled_reduce_array() against NumPy.')
+    parser.add_argument('--height', type=int, default=1000, help='Rows of the test image')
+    parser.add_argument('--width', type=int, default=1200, help='Columns of the test image')
+    parser.add_argument('--tile-side', type=int, default=173, help='Side of the tiles in pixels')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    shape = (3, args.height, args.width)
+    data = 1e8 + rng.normal(size=shape) * [[[1]], [[5]], [[20]]]   # large offset: raw sums of squares lose digits
+    data[1] += 0.5 * data[0]
+    mask = rng.random(shape) > 0.1
+    zones = rng.integers(0, 6, size=shape[1:])
+    bands = ['b0', 'b1', 'b2']
+    histogram = (9900, 10100, 40)
+
+    statistics = ['mean', 'sum', 'count', 'min', 'max', 'variance', 'stdDev', 'histogram', 'covariance']
+    result = tiled_reduce_array(data, mask, statistics, bands, histogram, ddof=1, tile_side=args.tile_side)
+    for index, band in enumerate(bands):
+        values = data[index][mask[index]]
+        expected = {'mean': values.mean(), 'sum': values.sum(), 'count': values.size, 'min': values.min(),
+                    'max': values.max(), 'variance': values.var(ddof=1), 'stdDev': values.std(ddof=1)}
+        for statistic, value in expected.items():
+            assert np.isclose(result['{}_{}'.format(band, statistic)], value, rtol=1e-9), (band, statistic)
+        buckets = np.floor((values - histogram[0]) / (histogram[1] - histogram[0]) * histogram[2]).astype('int64')
+        counts = np.bincount(buckets[(buckets >= 0) & (buckets < histogram[2])], minlength=histogram[2])
+        assert [count for _, count in result[band + '_histogram']] == counts.tolist(), band
+    joint = mask.all(axis=0)
+    assert np.allclose(result['covariance'], np.cov(data[:, joint], ddof=1), rtol=1e-9)
+
+    grouped = tiled_reduce_array(data[:1], mask[:1], ['mean', 'count', 'stdDev', 'min', 'max'], groups=zones,
+                                 group_name='code', tile_side=args.tile_side)
+    for item in grouped['groups']:
+        values = data[0][mask[0] & (zones == item['code'])]
+        assert item['count'] == values.size
+        assert np.isclose(item['mean'], values.mean(), rtol=1e-12)
+        assert np.isclose(item['stdDev'], values.std(), rtol=1e-9)
+        assert item['min'] == values.min() and item['max'] == values.max()
+
+    print('Tiled statistics of a {}x{} image in tiles of {} pixels match NumPy: OK'.format(
+        args.height, args.width, args.tile_side))
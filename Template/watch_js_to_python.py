@@ -0,0 +1,283 @@
+''' Watch Earth Engine JavaScripts and rebuild only the Python scripts and notebooks that depend on changed files.
+
+Every JavaScript X.js is the start of a dependency chain:
+    X.js -> X_qgis.py (js_to_python) -> X.ipynb and X.py (notebook template + script)
+The notebook template is a dependency of every X.ipynb and X.py, so editing it rebuilds every chain,
+while editing one JavaScript rebuilds only its own chain.
+
+File changes are detected with inotify through the watchdog package when it is installed, and by polling
+modification times otherwise. Bursts of changes are debounced and the chains are rebuilt on a bounded
+pool of worker processes.
+
+To watch the JavaScripts folder: python watch_js_to_python.py --in-dir ../JavaScripts
+
+'''
+
+# License: MIT
+
+import os
+import time
+import queue
+import argparse
+import threading
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from convert_js_to_python import js_to_python, py_to_ipynb, py_to_nb_script, execute_notebook_dir
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATE_FILE = os.path.join(ROOT_DIR, 'Template', 'template.py')
+
+
+def chain_outputs(js_file, in_dir, out_dir):
+    """Get the files built from a JavaScript.
+
+    Args:
+        js_file (str): Input JavaScript.
+        in_dir (str): The input folder containing Earth Engine JavaScripts.
+        out_dir (str): The output folder.
+
+    Returns:
+        dict: File paths of the 'qgis' script, the 'notebook' and the percent-format 'script'.
+    """
+    base = os.path.splitext(str(js_file))[0].replace(in_dir, out_dir)
+    return {
+        'qgis': base + '_qgis.py',
+        'notebook': base + '.ipynb',
+        'script': base + '.py',
+    }
+
+
+def rebuild_chain(js_file, in_dir, out_dir, template_file, github_username=None, github_repo=None):
+    """Rebuild the Python scripts and the notebook of one JavaScript. Unchanged outputs are left untouched.
+
+    Args:
+        js_file (str): Input JavaScript.
+        in_dir (str): The input folder containing Earth Engine JavaScripts.
+        out_dir (str): The output folder.
+        template_file (str): Input Jupyter notebook template.
+        github_username (str, optional): GitHub username. Defaults to None.
+        github_repo (str, optional): GitHub repo name. Defaults to None.
+
+    Returns:
+        list: File paths of the outputs that were written.
+    """
+    outputs = chain_outputs(js_file, in_dir, out_dir)
+    written = []
+
+    mtime = os.stat(outputs['qgis']).st_mtime_ns if os.path.isfile(outputs['qgis']) else None
+    js_to_python(str(js_file), outputs['qgis'], use_qgis=True)
+    if os.stat(outputs['qgis']).st_mtime_ns != mtime:
+        written.append(outputs['qgis'])
+    # The header links point to X.ipynb, as in the batch pipeline, not to the intermediate X_qgis.py.
+    if py_to_ipynb(outputs['qgis'], template_file, outputs['notebook'], github_username, github_repo,
+                   link_file=outputs['script']):
+        written.append(outputs['notebook'])
+    if py_to_nb_script(outputs['qgis'], template_file, outputs['script'], github_username, github_repo,
+                       link_file=outputs['script']):
+        written.append(outputs['script'])
+
+    return written
+
+
+class PollingWatcher(threading.Thread):
+    """Watch files by polling their modification times. Used when watchdog is not installed.
+
+    Args:
+        in_dir (str): The folder containing Earth Engine JavaScripts.
+        template_file (str): The notebook template.
+        events (queue.Queue): Queue receiving the paths of changed files.
+        interval (float, optional): Seconds between two scans. Defaults to 0.25.
+    """
+
+    def __init__(self, in_dir, template_file, events, interval=0.25):
+        super().__init__(daemon=True)
+        self.in_dir = in_dir
+        self.template_file = template_file
+        self.events = events
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.mtimes = self.scan()
+
+    def scan(self):
+        mtimes = {}
+        for path in [self.template_file] + [str(path) for path in Path(self.in_dir).rglob('*.js')]:
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                pass
+        return mtimes
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            mtimes = self.scan()
+            for path, mtime in mtimes.items():
+                if self.mtimes.get(path) != mtime:
+                    self.events.put(path)
+            self.mtimes = mtimes
+
+    def stop(self):
+        self.stopped.set()
+
+
+class InotifyWatcher:
+    """Watch files with inotify (or the native API of the platform) through watchdog.
+
+    Args:
+        in_dir (str): The folder containing Earth Engine JavaScripts.
+        template_file (str): The notebook template.
+        events (queue.Queue): Queue receiving the paths of changed files.
+    """
+
+    def __init__(self, in_dir, template_file, events):
+        from watchdog.observers import Observer
+        from watchdog.events import FileSystemEventHandler
+
+        template_file = os.path.abspath(template_file)
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.is_directory:
+                    return
+                for path in [event.src_path, getattr(event, 'dest_path', '')]:
+                    if path.endswith('.js') or os.path.abspath(path) == template_file:
+                        events.put(path)
+
+        self.observer = Observer()
+        self.observer.schedule(Handler(), in_dir, recursive=True)
+        self.observer.schedule(Handler(), os.path.dirname(template_file), recursive=False)
+
+    def start(self):
+        self.observer.start()
+
+    def stop(self):
+        self.observer.stop()
+        self.observer.join()
+
+
+class ConversionWatcher:
+    """Rebuild the dependency chains of changed JavaScripts and of the notebook template.
+
+    Args:
+        in_dir (str): The folder containing Earth Engine JavaScripts.
+        out_dir (str, optional): The output folder. Defaults to None, which uses in_dir.
+        template_file (str, optional): The notebook template. Defaults to Template/template.py.
+        github_username (str, optional): GitHub username. Defaults to None.
+        github_repo (str, optional): GitHub repo name. Defaults to None.
+        workers (int, optional): Maximum number of worker processes. Defaults to 4.
+        debounce (float, optional): Seconds without changes to wait before rebuilding. Defaults to 0.2.
+        execute (bool, optional): Whether to execute the notebooks that changed. Defaults to False.
+        polling (bool, optional): Whether to poll even if watchdog is installed. Defaults to False.
+    """
+
+    def __init__(self, in_dir, out_dir=None, template_file=TEMPLATE_FILE, github_username=None, github_repo=None,
+                 workers=4, debounce=0.2, execute=False, polling=False):
+        self.in_dir = in_dir
+        self.out_dir = out_dir or in_dir
+        self.template_file = template_file
+        self.github_username = github_username
+        self.github_repo = github_repo
+        self.workers = workers
+        self.debounce = debounce
+        self.execute = execute
+        self.events = queue.Queue()
+
+        self.source = None
+        if not polling:
+            try:
+                self.source = InotifyWatcher(in_dir, template_file, self.events)
+            except ImportError:
+                print('watchdog is not installed. Polling for changes instead. To use inotify:\n')
+                print('pip install watchdog')
+        if self.source is None:
+            self.source = PollingWatcher(in_dir, template_file, self.events)
+
+    def affected(self, paths):
+        """Get the JavaScripts whose chains depend on the changed files.
+
+        Args:
+            paths (set): Changed file paths.
+
+        Returns:
+            list: JavaScripts to rebuild.
+        """
+        template_file = os.path.abspath(self.template_file)
+        if any(os.path.abspath(path) == template_file for path in paths):
+            return sorted(str(path) for path in Path(self.in_dir).rglob('*.js'))
+        return sorted(path for path in paths if path.endswith('.js') and os.path.isfile(path))
+
+    def rebuild(self, js_files, executor):
+        """Rebuild the chains of the given JavaScripts.
+
+        Args:
+            js_files (list): JavaScripts to rebuild.
+            executor (concurrent.futures.Executor): Pool running the rebuilds.
+
+        Returns:
+            list: File paths of the outputs that were written.
+        """
+        start_time = time.time()
+        futures = [(executor.submit(rebuild_chain, js_file, self.in_dir, self.out_dir, self.template_file,
+                                    self.github_username, self.github_repo), js_file) for js_file in js_files]
+        written = []
+        for future, js_file in futures:
+            try:
+                written.extend(future.result())
+            except Exception as e:
+                print('Failed to rebuild {}: {}'.format(js_file, e))
+
+        print('Rebuilt {} chain(s), wrote {} file(s) in {:.2f}s'.format(len(js_files), len(written), time.time() - start_time))
+
+        notebooks = [path for path in written if path.endswith('.ipynb')]
+        if self.execute and notebooks:
+            execute_notebook_dir(self.out_dir, kernels=min(self.workers, len(notebooks)), notebooks=notebooks)
+
+        return written
+
+    def run(self, max_rebuilds=None):
+        """Watch for changes until interrupted.
+
+        Args:
+            max_rebuilds (int, optional): Stop after this many rebuilds. Defaults to None, which runs until interrupted.
+        """
+        rebuilds = 0
+        self.source.start()
+        print('Watching {} and {} ...'.format(self.in_dir, self.template_file))
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                while max_rebuilds is None or rebuilds < max_rebuilds:
+                    changed = {self.events.get()}
+                    # Wait until the files have been quiet for the debounce period.
+                    while True:
+                        try:
+                            changed.add(self.events.get(timeout=self.debounce))
+                        except queue.Empty:
+                            break
+                    js_files = self.affected(changed)
+                    if js_files:
+                        self.rebuild(js_files, executor)
+                        rebuilds += 1
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.source.stop()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Rebuild Python scripts and notebooks when Earth Engine JavaScripts change.')
+    parser.add_argument('--in-dir', type=str, default=os.path.join(ROOT_DIR, 'JavaScripts'), help='Folder containing the JavaScripts')
+    parser.add_argument('--out-dir', type=str, default=None, help='Output folder. Defaults to the input folder')
+    parser.add_argument('--template', type=str, default=TEMPLATE_FILE, help='Path to the notebook template')
+    parser.add_argument('--github-username', type=str, default='giswqs', help='GitHub username')
+    parser.add_argument('--github-repo', type=str, default='earthengine-py-notebooks', help='GitHub repo name')
+    parser.add_argument('--workers', type=int, default=4, help='Maximum number of worker processes')
+    parser.add_argument('--debounce', type=float, default=0.2, help='Seconds without changes before rebuilding')
+    parser.add_argument('--execute', action='store_true', help='Execute the notebooks that changed')
+    parser.add_argument('--polling', action='store_true', help='Poll for changes instead of using inotify')
+    args = parser.parse_args()
+
+    watcher = ConversionWatcher(os.path.abspath(args.in_dir), args.out_dir, args.template, args.github_username,
+                                args.github_repo, args.workers, args.debounce, args.execute, args.polling)
+    watcher.run()
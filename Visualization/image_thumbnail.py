@@ -78,6 +78,22 @@ print('Thumbnail:', thumbnail1)
 # })
 # print('Linear ring region and specified crs', thumbnail3)
 
+# # Render the thumbnails of every image of a filtered collection, and a timelapse of its monthly composites.
+# import os, sys
+# root = os.getcwd()
+# while not os.path.isdir(os.path.join(root, 'Template')) and os.path.dirname(root) != root:
+#     root = os.path.dirname(root)
+# sys.path.append(os.path.join(root, 'Template'))
+# from thumbnail_renderer import ThumbnailRenderer, monthly_composites
+# collection = ee.ImageCollection('LANDSAT/LC08/C01/T1_TOA') \
+#   .filterBounds(ee.Geometry.Point([-122.26, 37.87])) \
+#   .filterDate('2019-01-01', '2020-01-01')
+# vis = {'bands': ['B4', 'B3', 'B2'], 'min': 0, 'max': 0.3}
+# region = ee.Geometry.Rectangle([-122.5, 37.6, -122.0, 38.1])
+# renderer = ThumbnailRenderer()
+# renderer.thumbnails(collection, vis, region, 512, out_dir='thumbnails')
+# renderer.timelapse(monthly_composites(collection, '2019-01-01', '2020-01-01'), 'monthly.gif', vis, region, 512)
+
 # %%
 """
 ## Display Earth Engine data layers 